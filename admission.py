@@ -0,0 +1,504 @@
+"""
+Admission control for LLM calls.
+
+Every analysis or chat that is about to call the API first takes a slot from the
+AdmissionController. Slots are limited across all gunicorn workers on the host by a SQLite
+file holding the in-flight calls and two token buckets, one for requests and one for
+estimated tokens per minute. A call that cannot start at once waits in its client's queue;
+queues are served round-robin so one busy client cannot starve the others, and every wait
+has a deadline. When the queue is full or the deadline passes the call is shed: the analysis
+is answered by the local engine, or the request is refused with 429 and Retry-After.
+"""
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from llm_client import WORKER_TIMEOUT
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_ACTIONS = ('local', 'reject')
+
+# Who is calling the API: (client id, interactive). Requests set it; job workers, mailbox
+# ingestion and the CLI keep the default and are queued as one background client.
+_caller = contextvars.ContextVar('admission_caller', default=('background', False))
+
+
+def set_client(client):
+    """Attribute the API calls of the current request (or task) to client."""
+    return _caller.set(((client or 'anonymous')[:100], True))
+
+
+class Overloaded(Exception):
+    """No admission slot could be had in time.
+
+    action is 'local' when the caller should fall back to local analysis and 'reject' when
+    the request should be answered with 429 and retry_after seconds.
+    """
+
+    def __init__(self, reason, retry_after, action):
+        super().__init__(f"LLM capacity exhausted ({reason}); retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.action = action
+
+
+class SharedLimits:
+    """In-flight leases and token buckets in a SQLite file shared by the workers of a host.
+
+    A bucket holds up to one minute of its rate and refills continuously. Leases of a
+    process that died, or older than the worker timeout, are dropped when the slots run out.
+    """
+
+    def __init__(self, path, max_inflight=64, requests_per_minute=0, tokens_per_minute=0, lease_ttl=WORKER_TIMEOUT,
+                 poll_interval=0.05):
+        self.path = path
+        self.max_inflight = max_inflight
+        self.rates = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS admission_bucket ("
+                         " name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS admission_lease ("
+                         " id INTEGER PRIMARY KEY, pid INTEGER NOT NULL, client TEXT, tokens REAL NOT NULL,"
+                         " started_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS admission_queue ("
+                         " pid INTEGER PRIMARY KEY, depth INTEGER NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork (preload_app) belongs to the parent; never reuse it
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _levels(self, conn, now):
+        """Current level of every enabled bucket, refilled up to now."""
+        levels = {}
+        rows = {name: (level, updated_at) for name, level, updated_at in
+                conn.execute("SELECT name, level, updated_at FROM admission_bucket")}
+        for name, rate in self.rates.items():
+            if not rate:
+                continue
+            level, updated_at = rows.get(name, (rate, now))
+            levels[name] = min(rate, level + (now - updated_at) * rate / 60.0)
+        return levels
+
+    def _purge(self, conn, now):
+        """Drop leases and queue counts of dead processes, and leases past the worker timeout."""
+        pids = {pid for (pid,) in conn.execute("SELECT pid FROM admission_lease UNION SELECT pid FROM admission_queue")}
+        for pid in pids:
+            if not _alive(pid):
+                conn.execute("DELETE FROM admission_lease WHERE pid = ?", (pid,))
+                conn.execute("DELETE FROM admission_queue WHERE pid = ?", (pid,))
+        conn.execute("DELETE FROM admission_lease WHERE started_at < ?", (now - self.lease_ttl,))
+
+    def try_acquire(self, client, requests, tokens):
+        """Take a slot and the bucket budget. Returns (lease id, 0) or (None, seconds worth waiting)."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.max_inflight:
+                inflight = conn.execute("SELECT COUNT(*) FROM admission_lease").fetchone()[0]
+                if inflight >= self.max_inflight:
+                    self._purge(conn, now)
+                    inflight = conn.execute("SELECT COUNT(*) FROM admission_lease").fetchone()[0]
+                if inflight >= self.max_inflight:
+                    conn.execute("COMMIT")
+                    return None, self.poll_interval
+
+            levels = self._levels(conn, now)
+            # A request larger than a whole bucket would never fit; let it through on a full bucket
+            costs = {'requests': requests, 'tokens': tokens}
+            costs = {name: min(costs[name], self.rates[name]) for name in levels}
+            waits = [(costs[name] - level) * 60.0 / self.rates[name] for name, level in levels.items()
+                     if level < costs[name]]
+            if waits:
+                conn.execute("COMMIT")
+                return None, max(waits)
+
+            for name, level in levels.items():
+                self._store_level(conn, name, level - costs[name], now)
+            lease_id = conn.execute(
+                "INSERT INTO admission_lease (pid, client, tokens, started_at) VALUES (?, ?, ?, ?)",
+                (os.getpid(), client, tokens, now)
+            ).lastrowid
+            conn.execute("COMMIT")
+            return lease_id, 0.0
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _store_level(self, conn, name, level, now):
+        conn.execute("INSERT OR REPLACE INTO admission_bucket (name, level, updated_at) VALUES (?, ?, ?)",
+                     (name, level, now))
+
+    def release(self, lease_id, token_correction=0):
+        """End a lease; token_correction (actual minus estimated tokens) settles the token bucket."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM admission_lease WHERE id = ?", (lease_id,))
+            rate = self.rates['tokens']
+            if rate and token_correction:
+                level = self._levels(conn, now)['tokens']
+                # Overspending may push the bucket below zero, down to one minute of debt
+                self._store_level(conn, 'tokens', max(-rate, level - token_correction), now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def set_queue_depth(self, depth):
+        self._connect().execute("INSERT OR REPLACE INTO admission_queue (pid, depth) VALUES (?, ?)",
+                                (os.getpid(), depth))
+
+    def counts(self):
+        """(in-flight leases, queued calls) from one read, without the write lock or the purge."""
+        return self._connect().execute(
+            "SELECT (SELECT COUNT(*) FROM admission_lease), (SELECT COALESCE(SUM(depth), 0) FROM admission_queue)"
+        ).fetchone()
+
+    def snapshot(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._purge(conn, now)
+            inflight = conn.execute("SELECT COUNT(*) FROM admission_lease").fetchone()[0]
+            queued = conn.execute("SELECT COALESCE(SUM(depth), 0) FROM admission_queue").fetchone()[0]
+            levels = self._levels(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {
+            'inflight': inflight,
+            'max_inflight': self.max_inflight,
+            'queued': queued,
+            'buckets': {name: {'per_minute': self.rates[name], 'available': round(level, 1)}
+                        for name, level in levels.items()},
+        }
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Waiter:
+    __slots__ = ('client', 'interactive', 'requests', 'tokens')
+
+    def __init__(self, client, interactive, requests, tokens):
+        self.client = client
+        self.interactive = interactive
+        self.requests = requests
+        self.tokens = tokens
+
+
+class FairQueue:
+    """Per-client FIFO queues served round-robin: the head of the first client's queue goes
+    next, and a client that was served moves behind the others."""
+
+    def __init__(self):
+        self._clients = OrderedDict()
+        self.depth = 0
+
+    def push(self, waiter):
+        self._clients.setdefault(waiter.client, deque()).append(waiter)
+        self.depth += 1
+
+    def waiting(self, client):
+        return len(self._clients.get(client, ()))
+
+    def is_next(self, waiter):
+        for queue in self._clients.values():
+            return queue[0] is waiter
+        return False
+
+    def remove(self, waiter, served=False):
+        queue = self._clients[waiter.client]
+        queue.remove(waiter)
+        self.depth -= 1
+        if not queue:
+            del self._clients[waiter.client]
+        elif served:
+            self._clients.move_to_end(waiter.client)
+
+    def snapshot(self):
+        return {client: len(queue) for client, queue in self._clients.items()}
+
+
+class Lease:
+    """An admission slot held for one API call; release it with 'with lease:' or release(),
+    or from a coroutine with 'async with lease:'."""
+
+    def __init__(self, controller, lease_id, tokens):
+        self.controller = controller
+        self.lease_id = lease_id
+        self.tokens = tokens
+        self.used_tokens = None
+        self.started = time.monotonic()
+        self.executor = None  # Where an async release writes the shared state
+
+    def record_usage(self, usage):
+        """Settle the token bucket with the real usage of the call instead of the estimate."""
+        self.used_tokens = getattr(usage, 'total_tokens', None)
+
+    def release(self):
+        if self.controller is not None:
+            self.controller._release(self)
+            self.controller = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def release_async(self):
+        if self.controller is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.release)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.release_async()
+
+
+# Returned when admission control is disabled
+NO_LEASE = Lease(None, None, 0)
+
+
+class AdmissionController:
+    """Queues API calls for the shared limits and sheds them when the wait would be too long."""
+
+    def __init__(self, limits, max_queue=64, max_queue_per_client=16, max_wait=10.0, background_max_wait=300.0,
+                 overload='local'):
+        self.limits = limits
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.background_max_wait = background_max_wait
+        self.overload = overload if overload in OVERLOAD_ACTIONS else 'local'
+        self._queue = FairQueue()
+        # Guards the queue only; the shared SQLite state is never touched while holding it
+        self._ready = threading.Condition()
+        self._wakeups = 0  # Bumped on every notify, so a waiter sees releases that happened while it was trying
+        self._publish_lock = threading.Lock()
+        self._published_depth = None
+        self._counts = (float('-inf'), (0, 0))  # (read at, (in flight, queued)) shared by the two gauges
+        self._average_hold = 1.0  # Seconds a lease is held, smoothed; sizes Retry-After
+        self.stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'wait_seconds': 0.0}
+
+    @classmethod
+    def from_env(cls):
+        if os.getenv('ADMISSION_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        limits = SharedLimits(
+            os.getenv('ADMISSION_DB') or os.path.join(tempfile.gettempdir(), 'emailwise-admission.db'),
+            max_inflight=int(os.getenv('ADMISSION_MAX_INFLIGHT', 64)),
+            requests_per_minute=float(os.getenv('ADMISSION_RPM', 0)),
+            tokens_per_minute=float(os.getenv('ADMISSION_TPM', 0)),
+        )
+        return cls(
+            limits,
+            max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', 64)),
+            max_queue_per_client=int(os.getenv('ADMISSION_MAX_QUEUE_PER_CLIENT', 16)),
+            max_wait=float(os.getenv('ADMISSION_MAX_WAIT', 10)),
+            background_max_wait=float(os.getenv('ADMISSION_BACKGROUND_MAX_WAIT', 300)),
+            overload=os.getenv('ADMISSION_OVERLOAD', 'local').lower(),
+        )
+
+    def _shed(self, reason, interactive, retry_after=None):
+        if retry_after is None:
+            # Time for the calls ahead of this one to drain through the slots
+            slots = self.limits.max_inflight or 1
+            retry_after = self._average_hold * (self._queue.depth + 1) / slots
+        retry_after = max(1, math.ceil(retry_after))
+        # Background work has nobody to retry it, so it always falls back to local analysis
+        action = self.overload if interactive else 'local'
+        self.stats['shed'] += 1
+        metrics.inc('emailwise_admission_shed_total', reason=reason, action=action)
+        return Overloaded(reason, retry_after, action)
+
+    def _enqueue(self, requests, tokens):
+        client, interactive = _caller.get()
+        waiter = _Waiter(client, interactive, requests, tokens)
+        with self._ready:
+            if self._queue.depth >= self.max_queue:
+                raise self._shed('queue full', interactive)
+            if interactive and self._queue.waiting(client) >= self.max_queue_per_client:
+                raise self._shed('client queue full', interactive)
+            self._queue.push(waiter)
+        return waiter
+
+    def _publish_depth(self):
+        """Record this process's queue depth for the other workers (called without the condition held)."""
+        with self._publish_lock:
+            # Read under the publish lock, so the last write always carries the latest depth
+            depth = self._queue.depth
+            if depth == self._published_depth:
+                return
+            try:
+                self.limits.set_queue_depth(depth)
+                self._published_depth = depth
+            except sqlite3.Error as e:
+                logger.warning(f"Could not record admission queue depth: {str(e)}")
+
+    def _notify(self):
+        with self._ready:
+            self._wakeups += 1
+            self._ready.notify_all()
+
+    def _try(self, waiter):
+        """(Lease, 0) when the waiter got its slot, else (None, seconds to wait before trying again)."""
+        try:
+            lease_id, retry_in = self.limits.try_acquire(waiter.client, waiter.requests, waiter.tokens)
+        except sqlite3.Error as e:
+            # Admission must never take the app down with it: without the shared state, admit
+            logger.warning(f"Admission state unavailable, admitting without limits: {str(e)}")
+            return Lease(None, None, waiter.tokens), 0.0
+        if lease_id is None:
+            return None, retry_in
+        return Lease(self, lease_id, waiter.tokens), 0.0
+
+    def _next_wait(self, waiter, deadline, retry_in):
+        """Seconds to sleep before the next try; raises Overloaded when the deadline cannot be met."""
+        remaining = deadline - time.monotonic()
+        if retry_in > remaining:
+            retry_after = retry_in if retry_in > self.limits.poll_interval else None
+            raise self._shed('timeout', waiter.interactive, retry_after)
+        return retry_in
+
+    def _leave(self, waiter, lease, started):
+        """Take the waiter out of the queue and let the next one try (publish the depth afterwards)."""
+        with self._ready:
+            self._queue.remove(waiter, served=lease is not None)
+            self._wakeups += 1
+            self._ready.notify_all()
+            if lease is not None:
+                waited = time.monotonic() - started
+                self.stats['admitted'] += 1
+                self.stats['wait_seconds'] += waited
+                if waited > 0.001:
+                    self.stats['queued'] += 1
+        if lease is not None:
+            metrics.observe('emailwise_admission_wait_seconds', waited)
+
+    def _turn(self, waiter):
+        """(whether the waiter heads the queue, wake-up count) read under the condition."""
+        with self._ready:
+            return self._queue.is_next(waiter), self._wakeups
+
+    def acquire(self, tokens, requests=1):
+        """Block until the call may start and return its Lease. Raises Overloaded."""
+        started = time.monotonic()
+        waiter = self._enqueue(requests, tokens)
+        self._publish_depth()
+        deadline = started + (self.max_wait if waiter.interactive else self.background_max_wait)
+        lease = None
+        try:
+            while True:
+                retry_in = self.limits.poll_interval
+                is_next, wakeups = self._turn(waiter)
+                if is_next:
+                    # Only the head of the queue tries, with the condition released during the write
+                    lease, retry_in = self._try(waiter)
+                    if lease is not None:
+                        return lease
+                wait = self._next_wait(waiter, deadline, retry_in)
+                with self._ready:
+                    if self._wakeups == wakeups:
+                        self._ready.wait(wait)
+        finally:
+            self._leave(waiter, lease, started)
+            self._publish_depth()
+
+    async def acquire_async(self, tokens, requests=1, executor=None):
+        """acquire() for coroutines: polls instead of blocking the event loop, and reads and
+        writes the shared state in executor, so a contended admission file stalls no other task."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        waiter = self._enqueue(requests, tokens)
+        await loop.run_in_executor(executor, self._publish_depth)
+        deadline = started + (self.max_wait if waiter.interactive else self.background_max_wait)
+        lease = None
+        try:
+            while True:
+                retry_in = self.limits.poll_interval
+                is_next, _ = self._turn(waiter)
+                if is_next:
+                    lease, retry_in = await loop.run_in_executor(executor, self._try, waiter)
+                    if lease is not None:
+                        lease.executor = executor
+                        return lease
+                await asyncio.sleep(self._next_wait(waiter, deadline, retry_in))
+        finally:
+            self._leave(waiter, lease, started)
+            await loop.run_in_executor(executor, self._publish_depth)
+
+    def _release(self, lease):
+        held = time.monotonic() - lease.started
+        self._average_hold = 0.8 * self._average_hold + 0.2 * held
+        correction = lease.used_tokens - lease.tokens if lease.used_tokens is not None else 0
+        try:
+            self.limits.release(lease.lease_id, correction)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not release admission lease: {str(e)}")
+        self._notify()
+
+    def _shared_counts(self):
+        """(in flight, queued) across workers; one read serves both gauges of a scrape."""
+        read_at, counts = self._counts
+        if time.monotonic() - read_at > 1.0:
+            counts = self.limits.counts()
+            self._counts = (time.monotonic(), counts)
+        return counts
+
+    def inflight_gauge(self):
+        return [({}, self._shared_counts()[0])]
+
+    def queue_gauge(self):
+        return [({}, self._shared_counts()[1])]
+
+    def snapshot(self):
+        with self._ready:
+            stats = dict(self.stats)
+            clients = self._queue.snapshot()
+        admitted = stats['admitted']
+        return {
+            **self.limits.snapshot(),
+            'overload_action': self.overload,
+            'max_wait_seconds': self.max_wait,
+            'process': {
+                'pid': os.getpid(),
+                'queued_now': sum(clients.values()),
+                'queued_by_client': clients,
+                'admitted': admitted,
+                'had_to_wait': stats['queued'],
+                'shed': stats['shed'],
+                'mean_wait_ms': round(1000 * stats['wait_seconds'] / admitted, 1) if admitted else 0.0,
+            },
+        }
@@ -2,25 +2,177 @@ import os
 import json
 import logging
 import re
+import time
+import hashlib
+import threading
 from datetime import datetime
-from openai import OpenAI
-from pypdf import PdfReader
-import mammoth
-import io
+from concurrent.futures import ThreadPoolExecutor
+from cache import AnalysisCache, make_cache_key
+from streaming import JsonFieldStreamer
+from attachments import AttachmentExtractor
+from thread_parser import split_messages, chunk_messages, chain_hashes
+from local_engine import LocalAnalyzer
+from router import TierRouter, usage_cost
+from llm_client import ResilientClient, AsyncResilientClient, CircuitOpenError
+from prompts import PromptBuilder
+from admission import AdmissionController, Overloaded, NO_LEASE
+from metrics import metrics
+
+# Threads over the prompt's body token budget are summarized chunk-by-chunk instead of head/tail truncated
+MAP_REDUCE_ENABLED = os.getenv('MAP_REDUCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MAP_REDUCE_CHUNK_CHARS = int(os.getenv('MAP_REDUCE_CHUNK_CHARS', 12000))
+MAP_REDUCE_CONCURRENCY = int(os.getenv('MAP_REDUCE_CONCURRENCY', 4))
+MAP_REDUCE_MODEL = os.getenv('MAP_REDUCE_MODEL', 'gpt-4o-mini')
+
+CHAT_ERROR_ANSWER = "I encountered an error trying to answer that."
+
+
+class ChatStreamError(Exception):
+    """A streamed chat answer failed part way; the tokens already sent are not a complete answer."""
 
 class EmailAnalyzer:
     """Class to handle email analysis using OpenAI or local fallback"""
     
     def __init__(self):
-        # Initialize OpenAI client only if API key is present
-        api_key = os.getenv('OPENAI_API_KEY')
-        self.client = OpenAI(api_key=api_key) if api_key else None
-        self.openai_client = self.client # Alias for compatibility
+        # The OpenAI client is created on first use in each process (see the client property)
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+        # AsyncOpenAI counterpart, created by enable_async() in the ASGI app
+        self.async_client = None
+        # Threads for the blocking work of async calls (SQLite admission state and cache writes)
+        self.async_executor = None
         
         # Configure logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
+        # Result cache keyed by normalized content, attachment digests and options
+        self.cache = AnalysisCache.from_env()
+
+        # CPU-only engine used offline, for emails routed locally and when the API fails
+        self.local_engine = LocalAnalyzer()
+
+        # Cache-friendly prompt layout with token-budgeted, de-noised email bodies
+        self.prompts = PromptBuilder.from_env()
+
+        # Chooses local analysis, a small model or the full model per email
+        self.router = TierRouter.from_env()
+
+        # Optional callable(chain_hashes) -> prior analysis of a thread prefix (set by the app)
+        self.prior_lookup = None
+
+        # Optional callable(email_content, options) -> stored analysis of a near-identical email made
+        # with the same summary style, language and tone (set by the app)
+        self.similar_lookup = None
+
+        # Per-chunk summaries for map-reduce, so a thread that gained one reply only maps the new chunk.
+        # Its own size budget and shared table, so chunk entries never evict whole-email results
+        self.chunk_cache = AnalysisCache.from_env(prefix='CHUNK_CACHE', table='chunk_cache')
+
+        # Attachment text extraction runs in a process pool with per-file limits
+        self.attachment_extractor = AttachmentExtractor.from_env()
+
+        # Limits API calls across workers and sheds them when the queue for a slot is too long
+        self.admission = AdmissionController.from_env()
+        if self.admission is not None:
+            metrics.gauge('emailwise_admission_inflight', self.admission.inflight_gauge)
+            metrics.gauge('emailwise_admission_queue_depth', self.admission.queue_gauge)
+        metrics.gauge('emailwise_upstream_breaker_state', self._breaker_gauge)
+
+    @property
+    def client(self):
+        """Pooled OpenAI client with deadlines, retries and a circuit breaker, or None without an API key.
+
+        Built lazily and per process: importing the app stays fast, and gunicorn workers forked
+        from a preloaded master never share the master's connection pool.
+        """
+        if self._client_pid != os.getpid():
+            with self._client_lock:
+                if self._client_pid != os.getpid():
+                    api_key = os.getenv('OPENAI_API_KEY')
+                    self._client = ResilientClient.from_env(api_key) if api_key else None
+                    self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def openai_client(self):
+        return self.client # Alias for compatibility
+
+    def _attachment_digests(self, files):
+        """Hash attachment bytes without consuming the upload streams."""
+        digests = []
+        for file in files:
+            stream = file.stream
+            position = stream.tell()
+            hasher = hashlib.sha256()
+            for block in iter(lambda: stream.read(65536), b''):
+                hasher.update(block)
+            stream.seek(position)
+            digests.append(f"{file.filename}:{hasher.hexdigest()}")
+        return digests
+
+    def enable_async(self, executor=None):
+        """Create the async API client; it shares the circuit breaker with the sync client.
+
+        Blocking work of the async paths runs in executor (the loop's default executor if None).
+        """
+        self.async_executor = executor
+        if self.client is not None and self.async_client is None:
+            self.async_client = AsyncResilientClient.from_env(os.getenv('OPENAI_API_KEY'), breaker=self.client.breaker)
+        return self.async_client
+
+    def routing_stats(self):
+        """Per-tier request counts, latency and spend."""
+        return self.router.snapshot()
+
+    def upstream_stats(self):
+        """OpenAI client health: breaker state, retries, hedges."""
+        if self.client is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.client.snapshot()}
+
+    def _breaker_gauge(self):
+        # Only a client this process already built; a scrape should not create one
+        client = self._client if self._client_pid == os.getpid() else None
+        return client.breaker.gauge() if client is not None else []
+
+    def clear_caches(self):
+        """Forget cached analyses and chunk summaries (after the history is cleared)."""
+        for cache in (self.cache, self.chunk_cache):
+            if cache is not None:
+                cache.clear()
+
+    def admission_stats(self):
+        """In-flight calls, bucket levels, queue depth and shed counts of admission control."""
+        if self.admission is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.admission.snapshot()}
+
+    def _admit(self, tokens, requests=1):
+        """Wait for an admission slot for API calls; raises Overloaded when none comes in time."""
+        if self.admission is None:
+            return NO_LEASE
+        return self.admission.acquire(tokens, requests)
+
+    async def _admit_async(self, tokens, requests=1):
+        if self.admission is None:
+            return NO_LEASE
+        return await self.admission.acquire_async(tokens, requests, self.async_executor)
+
+    def _estimated_tokens(self, prompt_info, max_tokens):
+        """Upper estimate of a call's tokens for the token bucket, settled with the real usage later."""
+        return self.prompts.instruction_tokens + prompt_info['body_tokens'] + max_tokens
+
+    def cache_stats(self):
+        """Hit/miss counters and estimated savings of the result cache."""
+        if self.cache is None:
+            return {'enabled': False}
+        stats = {'enabled': True, **self.cache.snapshot()}
+        if self.chunk_cache is not None:
+            stats['map_reduce_chunks'] = self.chunk_cache.snapshot()
+        return stats
+
     def _smart_truncate(self, content, max_length=50000):
         """Truncate content smartly keeping head and tail if too long."""
         if len(content) <= max_length:
@@ -33,137 +185,501 @@ class EmailAnalyzer:
         return content[:head_len] + "\n...[Content Truncated]...\n" + content[-tail_len:]
 
     def process_attachments(self, files):
-        """Extract text from uploaded files (PDF, DOCX)."""
-        attachment_text = ""
-        for file in files:
-            filename = file.filename.lower()
-            try:
-                if filename.endswith('.pdf'):
-                    # Use pypdf to extract text
-                    reader = PdfReader(file.stream)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() + "\n"
-                    attachment_text += f"\n\n--- Attachment: {file.filename} ---\n{text}"
-                elif filename.endswith('.docx'):
-                    # Use mammoth to extract raw text
-                    result = mammoth.extract_raw_text(file.stream)
-                    attachment_text += f"\n\n--- Attachment: {file.filename} ---\n{result.value}"
-                elif filename.endswith('.txt'):
-                    # Plain text
-                    text = file.read().decode('utf-8', errors='ignore')
-                    attachment_text += f"\n\n--- Attachment: {file.filename} ---\n{text}"
-                else:
-                    self.logger.warning(f"Unsupported file type: {filename}")
-            except Exception as e:
-                self.logger.error(f"Error processing attachment {filename}: {str(e)}")
-                attachment_text += f"\n\n--- Attachment: {file.filename} (Error extraction) ---\n"
+        """Extract text from uploaded files (PDF, DOCX, TXT)."""
+        parts = []
+        with metrics.span('attachments'):
+            extracted = self.attachment_extractor.extract_all(files)
+        for filename, text, error in extracted:
+            if text is not None:
+                parts.append(f"\n\n--- Attachment: {filename} ---\n{text}")
+            elif error != 'unsupported':
+                parts.append(f"\n\n--- Attachment: {filename} (Error extraction) ---\n")
         
-        return attachment_text
+        return ''.join(parts)
 
-    def analyze_email(self, email_content, attachments=None, summary_style="detailed", output_language="english", reply_tone="professional"):
+    def _summarize_chunk(self, chunk, index, total, output_language):
+        """Map step: condense one chunk of a long thread, served from the chunk cache when possible."""
+        cache_key = None
+        if self.chunk_cache is not None:
+            cache_key = make_cache_key(chunk, kind='chunk', model=MAP_REDUCE_MODEL, output_language=output_language)
+            cached = self.chunk_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        started = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                model=MAP_REDUCE_MODEL,
+                messages=self.prompts.chunk_messages(chunk, index, total, output_language),
+                max_tokens=500,
+                temperature=0.2
+            )
+            summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            self.logger.error(f"Error summarizing chunk {index + 1}/{total}: {str(e)}")
+            # Keep some coverage of this chunk rather than dropping it
+            return self._smart_truncate(chunk, 2000)
+
+        self._store_in_cache_for(self.chunk_cache, cache_key, summary, getattr(response, 'usage', None), started,
+                                 MAP_REDUCE_MODEL)
+        return summary
+
+    def _map_reduce_content(self, email_content, output_language):
+        """Replace an over-long thread with per-chunk summaries that cover all of it."""
+        chunks = chunk_messages(split_messages(email_content), MAP_REDUCE_CHUNK_CHARS)
+        if len(chunks) <= 1:
+            return email_content
+
+        try:
+            lease = self._admit(len(email_content) // 4 + 500 * len(chunks), requests=len(chunks))
+        except Overloaded as e:
+            # The prompt builder's head/tail truncation still fits the thread into one call
+            self.logger.warning(f"Skipping map-reduce: {str(e)}")
+            return email_content
+
+        with lease, metrics.span('map_reduce'), ThreadPoolExecutor(max_workers=min(MAP_REDUCE_CONCURRENCY, len(chunks))) as executor:
+            summaries = list(executor.map(
+                lambda item: self._summarize_chunk(item[1], item[0], len(chunks), output_language),
+                enumerate(chunks)
+            ))
+
+        self.logger.info(f"Map-reduce condensed {len(email_content)} chars in {len(chunks)} chunks")
+        parts = [f"[Long thread condensed from {len(chunks)} parts, most recent first]"]
+        for index, summary in enumerate(summaries):
+            parts.append(f"### Part {index + 1} of {len(chunks)}\n{summary}")
+        return '\n\n'.join(parts)
+
+    def _reuse_similar(self, email_content, attachments, options):
+        """Stored analysis of a near-duplicate email with the same options, or None (attachments
+        always get a fresh analysis)."""
+        if self.similar_lookup is None or attachments:
+            return None
+        try:
+            with metrics.span('similar_lookup'):
+                return self.similar_lookup(email_content, options)
+        except Exception as e:
+            self.logger.error(f"Similarity lookup failed: {str(e)}")
+            return None
+
+    def _thread_context(self, email_content):
         """
-        Analyze email content using OpenAI's GPT-4o model.
-        Falls back to local analysis if no API key is found.
+        Fingerprint the messages of a pasted thread and look up an earlier analysis of its
+        already-seen prefix. Returns (thread metadata, prompt body with only the new messages
+        plus the prior summary) - the prompt body is None when there is nothing to reuse.
         """
-        
+        messages = split_messages(email_content)
+        hashes = chain_hashes(messages)
+        thread = {'hash': hashes[-1] if hashes else None, 'messages': len(messages)}
+        if not (self.client and self.prior_lookup and len(messages) > 1):
+            return thread, None
+
+        try:
+            with metrics.span('prior_lookup'):
+                prior = self.prior_lookup(hashes[:-1])
+        except Exception as e:
+            self.logger.error(f"Prior thread lookup failed: {str(e)}")
+            return thread, None
+        if not prior:
+            return thread, None
+
+        # Messages are in document order (newest first), so the new ones lead the list
+        new_messages = messages[:len(messages) - prior['messages']]
+        thread['prior_summary_id'] = prior['id']
+        thread['new_messages'] = len(new_messages)
+        self.logger.info(f"Incremental analysis: {len(new_messages)} new of {len(messages)} messages")
+
+        prompt_body = f"""[The first {prior['messages']} of {len(messages)} messages of this thread were analyzed before. Only the newer messages are included. Produce the analysis for the whole thread by updating the prior analysis with the new messages.]
+
+Prior summary:
+{prior['summary']}
+
+Prior action items:
+{prior['action_items'] or 'None'}
+
+Prior deadlines:
+{prior['deadlines'] or 'None'}
+
+New messages (newest first):
+""" + '\n\n'.join(message.content for message in new_messages)
+        return thread, prompt_body
+
+    def _prepare_content(self, email_content, output_language, max_tokens=2000):
+        """Content to place in the analysis prompt (map-reduced when it would not fit the body budget)."""
+        if (MAP_REDUCE_ENABLED and self.client
+                and self.prompts.exceeds(email_content, self.prompts.analysis_budget(max_tokens))):
+            return self._map_reduce_content(email_content, output_language)
+        return email_content
+
+    def _analysis_cache_key(self, email_content, attachments, summary_style, output_language, reply_tone):
+        """Content-addressed cache key, or None when caching does not apply."""
+        if self.cache is None or not self.client:
+            return None
+        digests = self._attachment_digests(attachments) if attachments else []
+        return make_cache_key(
+            email_content, digests,
+            summary_style=summary_style,
+            output_language=output_language,
+            reply_tone=reply_tone
+        )
+
+    def _cache_lookup(self, cache_key):
+        with metrics.span('cache_lookup'):
+            cached = self.cache.get(cache_key)
+        metrics.inc('emailwise_cache_lookups_total', result='miss' if cached is None else 'hit')
+        return cached
+
+    def _analysis_request(self, messages, model="gpt-4o", max_tokens=2000):
+        """Keyword arguments for the analysis chat completion call."""
+        return dict(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_tokens=max_tokens,
+            temperature=0.3
+        )
+
+    def _normalize_result(self, result):
+        """Ensure all keys exist in a model result"""
+        display_sentiment = result.get('sentiment', 'Neutral')
+        if result.get('urgency_score', 0) > 7:
+             display_sentiment += " (Urgent)"
+
+        return {
+            "summary": result.get('summary', 'No summary available.'),
+            "action_items": result.get('action_items', []),
+            "deadlines": result.get('deadlines', []),
+            "subject": result.get('subject', 'No Subject'),
+            "priority": result.get('priority', 'Medium'),
+            "sentiment": display_sentiment,
+            "suggested_replies": result.get('suggested_replies', {
+                "option_1": {"label": "Draft", "text": "Could not generate reply."},
+                "option_2": {"label": "Alt", "text": "Could not generate reply."}
+            }),
+            "intent": result.get('intent', 'General'),
+            "urgency_score": result.get('urgency_score', 5),
+            "confidence_score": result.get('confidence_score', 90),
+            "spam_analysis": result.get('spam_analysis', {"is_spam": False, "reason": "No anomalies."}),
+            "decision_helper": result.get('decision_helper', {"pros": [], "cons": [], "risks": []})
+        }
+
+    def _store_in_cache(self, cache_key, analysis, usage, started, model="gpt-4o"):
+        """Cache an API result together with its latency, token and cost footprint."""
+        self._store_in_cache_for(self.cache, cache_key, analysis, usage, started, model)
+
+    def _store_in_cache_for(self, cache, cache_key, value, usage, started, model="gpt-4o"):
+        if cache is None or cache_key is None:
+            return
+        tokens, cost = usage_cost(model, usage)
+        cache.set(
+            cache_key, value,
+            elapsed=time.perf_counter() - started,
+            tokens=tokens,
+            cost=cost
+        )
+
+    def _route(self, email_content, attachments, thread):
+        """Score an email locally and pick its tier. Returns (tier, reason, scored email)."""
+        with metrics.span('routing'):
+            scored = self.local_engine.score_batch([email_content])[0]
+            tier, reason = self.router.decide(
+                scored, self.local_engine, len(email_content),
+                has_attachments=bool(attachments), thread_messages=thread.get('messages', 1)
+            )
+        return tier, reason, scored
+
+    def _routed_local(self, scored, summary_style, reply_tone, thread, reason, started):
+        with metrics.span('local_analysis'):
+            analysis = {**self.local_engine.result_for(scored, summary_style, reply_tone), 'thread': thread,
+                        'routing': {'tier': 'local', 'reason': reason}}
+        self.router.record('local', reason, time.perf_counter() - started)
+        metrics.inc('emailwise_analyses_total', tier='local', reason=reason)
+        if reason in ('api error', 'circuit open', 'overloaded'):
+            metrics.inc('emailwise_fallbacks_total', reason=reason)
+        return analysis
+
+    def _usage_report(self, usage, prompt_info, model):
+        """Per-request token usage, also logged and counted for cost tracking."""
+        report = self.prompts.usage_report(usage, prompt_info)
+        metrics.record_usage(model, report)
+        self.logger.info(
+            f"Tokens: prompt={report['prompt_tokens']} (cached {report['cached_prompt_tokens']}), "
+            f"completion={report['completion_tokens']}, body={report['body_tokens']}"
+            f"{' truncated' if report['body_truncated'] else ''}"
+        )
+        return report
+
+    def _fallback_reason(self, error):
+        if isinstance(error, Overloaded):
+            return 'overloaded'
+        return 'circuit open' if isinstance(error, CircuitOpenError) else 'api error'
+
+    def _record_api_tier(self, tier, reason, model, usage, started):
+        tokens, cost = usage_cost(model, usage)
+        self.router.record(tier, reason, time.perf_counter() - started, tokens, cost)
+        metrics.inc('emailwise_analyses_total', tier=tier, reason=reason)
+
+    def _plan_analysis(self, email_content, attachments, summary_style, output_language, reply_tone):
+        """
+        Everything before the API call: cache, reuse, thread context, attachments, routing, prompt.
+        Returns (result, None) when the email is answered without the API, else (None, plan).
+        """
+        # Stored with the analysis, so a near-duplicate is only reused for the same options
+        options = {'summary_style': summary_style, 'output_language': output_language, 'reply_tone': reply_tone}
+
+        # Serve repeated emails from the result cache before any parsing or API work
+        cache_key = self._analysis_cache_key(email_content, attachments, summary_style, output_language, reply_tone)
+        if cache_key is not None:
+            cached = self._cache_lookup(cache_key)
+            if cached is not None:
+                return {**cached, 'options': options}, None
+
+        # Reuse the analysis of a near-identical past email (templated invoices, alerts)
+        reused = self._reuse_similar(email_content, attachments, options)
+        if reused is not None:
+            return {**reused, 'options': options}, None
+
+        started = time.perf_counter()
+
+        # Only send messages that were not part of an earlier analysis of this thread
+        thread, incremental_body = self._thread_context(email_content)
+
         # Process attachments if present
-        if attachments:
-            attachment_text = self.process_attachments(attachments)
-            email_content += attachment_text
+        attachment_text = self.process_attachments(attachments) if attachments else ''
+        email_content += attachment_text
 
+        tier, reason, scored = self._route(email_content, attachments, thread)
         if not self.client:
             self.logger.warning("No OpenAI API key found. Using local fallback.")
-            return self._local_analysis(email_content, summary_style, reply_tone)
+            return {**self._routed_local(scored, summary_style, reply_tone, thread, 'offline', started),
+                    'options': options}, None
+        if tier == 'local':
+            return {**self._routed_local(scored, summary_style, reply_tone, thread, reason, started),
+                    'options': options}, None
 
+        model, max_tokens = self.router.model_for(tier)
+        plan = {'cache_key': cache_key, 'started': started, 'thread': thread, 'scored': scored, 'tier': tier,
+                'reason': reason, 'model': model, 'summary_style': summary_style, 'reply_tone': reply_tone,
+                'options': options}
         try:
-            # Construct the prompt based on user preferences
-            prompt = f"""
-            You are an elite executive assistant and strategic data analyst. Analyze the following email thread and any attachments.
-            
-            **Configuration:**
-            - **Summary Style:** {summary_style} (detailed=bullet points, quick=1-2 sentences, brief=executive brief)
-            - **Output Language:** {output_language}
-            - **Reply Tone:** {reply_tone}
-            
-            **Output Requirements:**
-            Return a strictly valid JSON object. Do not include markdown formatting (like ```json).
-            
-            **JSON Structure:**
-            {{
-                "summary": "The executive summary...",
-                "action_items": ["Action 1", "Action 2"],
-                "deadlines": ["Deadline 1", "Deadline 2"],
-                "subject": "The email subject...",
-                "priority": "High/Medium/Low",
-                "sentiment": "Positive/Neutral/Negative/Urgent/Angry",
-                "suggested_replies": {{
-                    "option_1": {{ "label": "Direct Reply", "text": "Draft of reply 1..." }},
-                    "option_2": {{ "label": "Alternative Strategy", "text": "Draft of reply 2..." }}
-                }},
-                "intent": "Request/Inquiry/Complaint/Update",
-                "urgency_score": 8,
-                "confidence_score": 95,
-                "spam_analysis": {{
-                    "is_spam": false,
-                    "reason": "Legitimate business correspondence."
-                }},
-                "decision_helper": {{
-                    "pros": ["Benefit 1", "Benefit 2"],
-                    "cons": ["Drawback 1", "Drawback 2"],
-                    "risks": ["Risk 1", "Risk 2"]
-                }}
-            }}
-            
-            **Analysis Guidelines:**
-            1. **Summary**: Adapt length based on 'Summary Style'.
-            2. **Replies**: Generate TWO distinct reply options based on 'Reply Tone'.
-            3. **Urgency**: rate 1-10 based on deadlines and tone.
-            4. **Output Language**: Ensure ALL text values in the JSON are translated to {output_language}, except for specific proper nouns.
-
-            **Email Content:**
-            {self._smart_truncate(email_content)}
-            """
+            body = incremental_body + attachment_text if incremental_body else email_content
+            prompt_content = self._prepare_content(body, output_language, max_tokens)
+            with metrics.span('prompt'):
+                messages, plan['prompt_info'] = self.prompts.analysis_messages(
+                    prompt_content, summary_style, output_language, reply_tone, max_tokens
+                )
+        except Exception as e:
+            return self._plan_fallback(plan, e), None
+        plan['request'] = self._analysis_request(messages, model, max_tokens)
+        plan['estimated_tokens'] = self._estimated_tokens(plan['prompt_info'], max_tokens)
+        return None, plan
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that outputs JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=2000,
-                temperature=0.3
-            )
+    def _complete_analysis(self, plan, content, usage):
+        """Turn the model's JSON answer into the final result; records usage and caches it."""
+        with metrics.span('json_parse'):
+            result = json.loads(content)
+        model = plan['model']
+        analysis = {**self._normalize_result(result), 'thread': plan['thread'], 'options': plan['options'],
+                    'routing': {'tier': plan['tier'], 'reason': plan['reason'], 'model': model},
+                    'usage': self._usage_report(usage, plan['prompt_info'], model)}
+        self._record_api_tier(plan['tier'], plan['reason'], model, usage, plan['started'])
+        self._store_in_cache(plan['cache_key'], analysis, usage, plan['started'], model)
+        return analysis
 
-            result = json.loads(response.choices[0].message.content)
-            
-            # Ensure all keys exist
-            display_sentiment = result.get('sentiment', 'Neutral')
-            if result.get('urgency_score', 0) > 7:
-                 display_sentiment += " (Urgent)"
+    def _plan_fallback(self, plan, error):
+        """Local analysis for a planned API analysis that failed."""
+        if isinstance(error, Overloaded):
+            if error.action == 'reject':
+                raise error
+            self.logger.warning(f"Analyzing locally: {str(error)}")
+        else:
+            self.logger.error(f"Error during AI analysis: {str(error)}")
+        return {**self._routed_local(plan['scored'], plan['summary_style'], plan['reply_tone'], plan['thread'],
+                                     self._fallback_reason(error), plan['started']),
+                'options': plan['options']}
 
+    def analyze_email(self, email_content, attachments=None, summary_style="detailed", output_language="english", reply_tone="professional"):
+        """
+        Analyze email content using OpenAI's GPT-4o model.
+        Falls back to local analysis if no API key is found.
+        """
+        result, plan = self._plan_analysis(email_content, attachments, summary_style, output_language, reply_tone)
+        if plan is None:
+            return result
+
+        try:
+            with self._admit(plan['estimated_tokens']) as lease:
+                with metrics.span('openai'):
+                    response = self.client.chat.completions.create(**plan['request'])
+                lease.record_usage(getattr(response, 'usage', None))
+            return self._complete_analysis(plan, response.choices[0].message.content, getattr(response, 'usage', None))
+        except Exception as e:
+            return self._plan_fallback(plan, e)
+
+    async def analyze_email_async(self, email_content, attachments=None, summary_style="detailed", output_language="english", reply_tone="professional", executor=None):
+        """
+        analyze_email for the ASGI app: the preparation (DB lookups, attachment extraction,
+        routing) and the result handling (cache writes, local fallback) run in an executor
+        and the API call is awaited on the event loop.
+        """
+        import asyncio
+        import contextvars
+        loop = asyncio.get_running_loop()
+        executor = executor or self.async_executor
+        # Run in a copy of this task's context so map-reduce calls are admitted for the same client
+        result, plan = await loop.run_in_executor(
+            executor, contextvars.copy_context().run,
+            self._plan_analysis, email_content, attachments, summary_style, output_language, reply_tone
+        )
+        if plan is None:
+            return result
+
+        try:
+            async with await self._admit_async(plan['estimated_tokens']) as lease:
+                with metrics.span('openai'):
+                    response = await self.async_client.chat.completions.create(**plan['request'])
+                lease.record_usage(getattr(response, 'usage', None))
+            return await loop.run_in_executor(executor, self._complete_analysis, plan,
+                                              response.choices[0].message.content, getattr(response, 'usage', None))
+        except Exception as e:
+            return await loop.run_in_executor(executor, self._plan_fallback, plan, e)
+
+    def _read_upstream(self, tokens, request, events, stop):
+        """Run a streamed API call, queueing ('delta', text) events, then ('usage', usage) or ('error', e)."""
+        try:
+            with self._admit(tokens) as lease:
+                with metrics.span('openai'):
+                    stream = self.client.chat.completions.create(
+                        **request,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                usage = None
+                for chunk in stream:
+                    if stop.is_set():  # The client went away
+                        stream.close()
+                        return
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        events.put(('delta', chunk.choices[0].delta.content))
+                lease.record_usage(usage)
+            events.put(('usage', usage))
+        except Exception as e:
+            events.put(('error', e))
+
+    def _stream_upstream(self, tokens, request):
+        """Yield ('delta', text) as the model writes, then ('usage', usage); raises the call's error.
+
+        The upstream stream is read on its own thread, so the admission lease ends when that
+        stream does rather than when a slow client has read everything it produced.
+        """
+        import queue
+        import contextvars
+        events = queue.Queue()
+        stop = threading.Event()
+        threading.Thread(target=contextvars.copy_context().run, args=(self._read_upstream, tokens, request, events, stop),
+                         name='upstream-stream', daemon=True).start()
+        try:
+            while True:
+                event, data = events.get()
+                if event == 'error':
+                    raise data
+                yield event, data
+                if event == 'usage':
+                    return
+        finally:
+            stop.set()
+
+    def analyze_email_stream(self, email_content, attachments=None, summary_style="detailed", output_language="english", reply_tone="professional"):
+        """
+        Streaming variant of analyze_email.
+        Yields ('field', {'name': ..., 'value': ...}) as soon as each top-level field
+        of the model output is complete, then ('result', analysis) with the final result.
+        If the call fails after fields were sent, yields ('error', {'error': ...}) instead:
+        a local fallback result would contradict the fields the client already has.
+        """
+        result, plan = self._plan_analysis(email_content, attachments, summary_style, output_language, reply_tone)
+        if plan is None:
+            yield 'result', result
+            return
+
+        streamer = JsonFieldStreamer()
+        parts = []
+        fields_sent = False
+        try:
+            for event, data in self._stream_upstream(plan['estimated_tokens'], plan['request']):
+                if event == 'usage':
+                    usage = data
+                    continue
+                parts.append(data)
+                for name, value in streamer.feed(data):
+                    fields_sent = True
+                    yield 'field', {'name': name, 'value': value}
+            analysis = self._complete_analysis(plan, ''.join(parts), usage)
+        except Exception as e:
+            if not fields_sent:
+                analysis = self._plan_fallback(plan, e)
+            else:
+                self.logger.error(f"Error during streamed AI analysis: {str(e)}")
+                yield 'error', {'error': 'The analysis failed part way through, please retry'}
+                return
+
+        yield 'result', analysis
+
+    def _chat_request(self, messages):
+        return dict(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=300
+        )
+
+    def _chat(self, messages, prompt_info):
+        request = self._chat_request(messages)
+        # Chats have no local fallback: Overloaded reaches the app, which answers 429
+        lease = self._admit(self._estimated_tokens(prompt_info, request['max_tokens']))
+        try:
+            with lease:
+                with metrics.span('openai'):
+                    response = self.client.chat.completions.create(**request)
+                lease.record_usage(getattr(response, 'usage', None))
             return {
-                "summary": result.get('summary', 'No summary available.'),
-                "action_items": result.get('action_items', []),
-                "deadlines": result.get('deadlines', []),
-                "subject": result.get('subject', 'No Subject'),
-                "priority": result.get('priority', 'Medium'),
-                "sentiment": display_sentiment,
-                "suggested_replies": result.get('suggested_replies', {
-                    "option_1": {"label": "Draft", "text": "Could not generate reply."},
-                    "option_2": {"label": "Alt", "text": "Could not generate reply."}
-                }),
-                "intent": result.get('intent', 'General'),
-                "urgency_score": result.get('urgency_score', 5),
-                "confidence_score": result.get('confidence_score', 90),
-                "spam_analysis": result.get('spam_analysis', {"is_spam": False, "reason": "No anomalies."}),
-                "decision_helper": result.get('decision_helper', {"pros": [], "cons": [], "risks": []})
+                "answer": response.choices[0].message.content,
+                "usage": self._usage_report(getattr(response, 'usage', None), prompt_info, request['model'])
             }
 
         except Exception as e:
-            self.logger.error(f"Error during AI analysis: {str(e)}")
-            return self._local_analysis(email_content, summary_style, reply_tone)
+            self.logger.error(f"Chat error: {str(e)}")
+            return {"answer": CHAT_ERROR_ANSWER, "failed": True}
+
+    async def _chat_async(self, messages, prompt_info):
+        request = self._chat_request(messages)
+        lease = await self._admit_async(self._estimated_tokens(prompt_info, request['max_tokens']))
+        try:
+            async with lease:
+                with metrics.span('openai'):
+                    response = await self.async_client.chat.completions.create(**request)
+                lease.record_usage(getattr(response, 'usage', None))
+            return {
+                "answer": response.choices[0].message.content,
+                "usage": self._usage_report(getattr(response, 'usage', None), prompt_info, request['model'])
+            }
+
+        except Exception as e:
+            self.logger.error(f"Chat error: {str(e)}")
+            return {"answer": CHAT_ERROR_ANSWER, "failed": True}
+
+    def _chat_stream(self, messages, prompt_info):
+        request = self._chat_request(messages)
+        try:
+            for event, data in self._stream_upstream(self._estimated_tokens(prompt_info, request['max_tokens']), request):
+                if event == 'delta':
+                    yield data
+
+        except Overloaded:
+            raise
+        except Exception as e:
+            self.logger.error(f"Chat stream error: {str(e)}")
+            raise ChatStreamError(CHAT_ERROR_ANSWER) from e
 
     def chat_with_email(self, email_content, query):
         """
@@ -172,75 +688,75 @@ class EmailAnalyzer:
         if not self.client:
              return {"answer": "I can only answer questions in online mode with an API key."}
 
-        try:
-            prompt = f"""
-            Context: The user is asking a question about the following email.
-            Email Content:
-            {self._smart_truncate(email_content)}
-            
-            User Question: {query}
-            
-            Answer strictly based on the email provided. Be concise and helpful.
-            """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300
-            )
-            return {"answer": response.choices[0].message.content}
-            
-        except Exception as e:
-            self.logger.error(f"Chat error: {str(e)}")
-            return {"answer": "I encountered an error trying to answer that."}
+        messages, prompt_info = self.prompts.chat_messages(email_content, query)
+        return self._chat(messages, prompt_info)
+
+    async def chat_with_email_async(self, email_content, query):
+        """chat_with_email for the ASGI app, awaiting the API call on the event loop."""
+        if not self.async_client:
+             return {"answer": "I can only answer questions in online mode with an API key."}
+
+        messages, prompt_info = self.prompts.chat_messages(email_content, query)
+        return await self._chat_async(messages, prompt_info)
+
+    def chat_with_email_stream(self, email_content, query):
+        """
+        Streaming variant of chat_with_email that yields answer text as tokens arrive.
+        Raises ChatStreamError if the call fails, possibly after some tokens were yielded.
+        """
+        if not self.client:
+            yield "I can only answer questions in online mode with an API key."
+            return
+
+        messages, prompt_info = self.prompts.chat_messages(email_content, query)
+        yield from self._chat_stream(messages, prompt_info)
+
+    def _offline_session_answer(self, excerpts):
+        """Without an API key, point at the part of the email that best matches the question."""
+        if not excerpts:
+            return {"answer": "I can only answer questions in online mode with an API key.", "local": True}
+        return {"answer": f"I can only answer questions in online mode, but this part of the email looks relevant:\n\n{excerpts[0]}",
+                "local": True}
+
+    def chat_in_session(self, context, excerpts, turns, query):
+        """
+        Answer a question in a chat session from the stored analysis, the retrieved
+        excerpts and the recent turns [(role, content)] instead of the whole email.
+        """
+        if not self.client:
+            return self._offline_session_answer(excerpts)
+
+        messages, prompt_info = self.prompts.session_chat_messages(context, excerpts, turns, query)
+        return self._chat(messages, prompt_info)
+
+    async def chat_in_session_async(self, context, excerpts, turns, query):
+        """chat_in_session for the ASGI app."""
+        if not self.async_client:
+            return self._offline_session_answer(excerpts)
+
+        messages, prompt_info = self.prompts.session_chat_messages(context, excerpts, turns, query)
+        return await self._chat_async(messages, prompt_info)
+
+    def chat_in_session_stream(self, context, excerpts, turns, query):
+        """Streaming variant of chat_in_session."""
+        if not self.client:
+            yield self._offline_session_answer(excerpts)['answer']
+            return
+
+        messages, prompt_info = self.prompts.session_chat_messages(context, excerpts, turns, query)
+        yield from self._chat_stream(messages, prompt_info)
 
 
 
     def _local_analysis(self, content, style="detailed", tone="professional"):
-        """Fallback rule-based analysis."""
-        lines = content.split('\n')
-        
-        # Simple rule-based extraction
-        subject = next((line.replace('Subject:', '').strip() for line in lines if 'Subject:' in line), "Unknown Subject")
-        
-        # Mock varied responses based on input to show UI changes
-        is_urgent = "urgent" in content.lower() or "asap" in content.lower()
-        
-        return {
-            "summary": "State-of-the-art offline mode active. Connect OpenAI API key for neural analysis. (This is a local fallback summary)",
-            "action_items": [line.strip() for line in lines if line.strip().startswith('-') or line.strip().startswith('*')][:3],
-            "deadlines": ["Tomorrow EOD (Detected locally)"],
-            "subject": subject,
-            "priority": "High" if is_urgent else "Medium",
-            "sentiment": "Urgent" if is_urgent else "Neutral",
-            "suggested_replies": {
-                 "option_1": {
-                     "label": "Offline Reply", 
-                     "text": self._generate_local_reply(tone, is_urgent)
-                 },
-                 "option_2": {
-                     "label": "Placeholder",
-                     "text": "Please configure API key for advanced replies."
-                 }
-            },
-            "intent": "Request" if "?" in content else "Statement",
-            "urgency_score": 8 if is_urgent else 3,
-            "confidence_score": 100,
-            "spam_analysis": {"is_spam": False, "reason": "Local mode check pass."},
-            "decision_helper": {
-                "pros": ["Offline privacy", "Instant result"],
-                "cons": ["Limited insight", "No semantic understanding"],
-                "risks": ["May miss nuances"]
-            }
-        }
+        """Fallback analysis with the CPU-only local engine."""
+        return self.local_engine.analyze(content, style, tone)
 
-    def _generate_local_reply(self, tone, is_urgent):
-        if tone == "strict":
-            return "Noted. Will process."
-        elif tone == "friendly":
-            return "Got it! Thanks for sending this over. I'll take a look!"
-        else:
-            return "Received. I will review and respond shortly."
+    def analyze_local_batch(self, contents, summary_style="detailed", reply_tone="professional"):
+        """Analyze many emails at once with the local engine (offline batch path)."""
+        results = self.local_engine.analyze_batch(contents, summary_style, reply_tone)
+        for content, result in zip(contents, results):
+            messages = split_messages(content)
+            hashes = chain_hashes(messages)
+            result['thread'] = {'hash': hashes[-1] if hashes else None, 'messages': len(messages)}
+        return results
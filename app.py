@@ -1,17 +1,32 @@
 import os
+import json
+import time
 import logging
-from flask import Flask, render_template, request, jsonify
+import tempfile
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-from datetime import datetime
-from ai_analyzer import EmailAnalyzer
+from datetime import datetime, timedelta
+from ai_analyzer import EmailAnalyzer, ChatStreamError
+from jobs import JobQueue, TERMINAL_STATUSES
+from ingest import IngestService
+from admission import Overloaded, set_client
+from streaming import sse_event
+from metrics import metrics, server_timing, SamplingProfiler
 from dotenv import load_dotenv
 
 load_dotenv()
 
+if __name__ == '__main__':
+    # models.py does 'from app import db'; make that find this module instead of importing it twice
+    import sys
+    sys.modules['app'] = sys.modules['__main__']
+
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 class Base(DeclarativeBase):
     pass
@@ -36,10 +51,258 @@ db.init_app(app)
 # Initialize AI analyzer
 email_analyzer = EmailAnalyzer()
 
+# Background workers for /api/analyze?async=1
+job_queue = JobQueue.from_env(app, email_analyzer)
+
+# Mailbox polling, enabled by INGEST_SOURCES
+ingest_service = IngestService.from_env()
+
+# Batch analysis limits
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+
+# Per-request sampling profiler, enabled by sending 'X-Profile: <PROFILE_TOKEN>'
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'emailwise-profiles')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+
 with app.app_context():
-    # Import models to ensure tables are created
+    # Importing the app does not touch the database: the schema is created and upgraded
+    # once by 'flask --app app init-db' (see init_db), not by every worker on startup
     import models
+    import search_index
+    import body_store
+    import rollups
+    metrics.instrument_engine(db.engine)
+    # Email bodies live compressed in their own table, written on insert
+    body_store.register(models.EmailSummary)
+    search_index.register(models.EmailSummary)
+    # Per-day dashboard counts, adjusted on every insert and status change
+    rollups.register(models.EmailSummary)
+
+    # Local embedding index for similar-email lookup and near-duplicate reuse (loaded on first search)
+    import similarity
+    vector_index = similarity.VectorIndex(similarity.embedder_from_env(),
+                                          refresh_interval=float(os.environ.get('SIMILARITY_REFRESH_INTERVAL', 2)))
+    similarity.register(models.EmailSummary, vector_index)
+
+def init_db():
+    """Create missing tables, apply migrations and backfill derived data (idempotent)"""
+    import migrations
     db.create_all()
+    migrations.upgrade(db)
+    body_store.migrate(db)
+    search_index.setup(db)
+    similarity.backfill(db, vector_index)
+    rollups.setup(db)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema; run once per deploy, before starting the workers."""
+    import click
+    init_db()
+    click.echo(f"Database ready: {db.engine.url.render_as_string(hide_password=True)}")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recount the /api/stats rollups from the stored analyses."""
+    import click
+    click.echo(f"Counted {rollups.rebuild(db)} analyses")
+
+SIMILARITY_REUSE_THRESHOLD = float(os.environ.get('SIMILARITY_REUSE_THRESHOLD', 0) or 0)
+# Near-duplicates checked for one with matching options before a reuse is given up
+SIMILARITY_REUSE_CANDIDATES = int(os.environ.get('SIMILARITY_REUSE_CANDIDATES', 5))
+
+def _loads_or_empty(value):
+    try:
+        return json.loads(value) if value else {}
+    except ValueError:
+        return {}
+
+def build_summary(email_content, analysis_data):
+    """Map an analysis result onto a new (unsaved) EmailSummary row"""
+    import json
+    from models import EmailSummary
+    summary = EmailSummary()
+    summary.email_content = email_content
+    
+    # Handle list fields (summary, actions, deadlines)
+    summary.summary = '\n'.join(analysis_data.get('summary', [])) if isinstance(analysis_data.get('summary'), list) else analysis_data.get('summary', '')
+    summary.action_items = '\n'.join(analysis_data.get('action_items', []))
+    summary.deadlines = '\n'.join(analysis_data.get('deadlines', []))
+    
+    summary.sentiment = analysis_data.get('sentiment', 'Neutral')
+    summary.priority = analysis_data.get('priority', 'Medium')
+    
+    # New Intelligence Fields
+    summary.intent = analysis_data.get('intent', 'General')
+    summary.urgency_score = analysis_data.get('urgency_score', 0)
+    
+    summary.risk_assessment = json.dumps(analysis_data.get('decision_helper', {})) # Mapped decision_helper to risk_assessment field
+    summary.spam_analysis = json.dumps(analysis_data.get('spam_analysis', {}))
+    summary.confidence_score = analysis_data.get('confidence_score', 0.0)
+    
+    # Handle replies
+    suggested_replies = analysis_data.get('suggested_replies', {})
+    # Save primary reply text to legacy field for safety
+    summary.suggested_reply = suggested_replies.get('option_1', {}).get('text', '')
+    summary.suggested_replies = json.dumps(suggested_replies)
+    
+    options = analysis_data.get('options')
+    summary.analysis_options = options_key(options) if options else None
+    
+    thread = analysis_data.get('thread') or {}
+    summary.thread_hash = thread.get('hash')
+    summary.message_count = thread.get('messages')
+    
+    summary.created_at = datetime.utcnow()
+    return summary
+
+def find_prior_thread_analysis(chain_hashes):
+    """Most complete earlier analysis of a prefix of this thread, used for incremental analysis"""
+    from models import EmailSummary
+    # Runs from batch worker threads too, so it brings its own app context
+    with app.app_context():
+        rows = (
+            db.session.query(
+                EmailSummary.id, EmailSummary.thread_hash, EmailSummary.summary,
+                EmailSummary.action_items, EmailSummary.deadlines
+            )
+            .filter(EmailSummary.thread_hash.in_(chain_hashes))
+            .order_by(EmailSummary.created_at.desc())
+            .all()
+        )
+    if not rows:
+        return None
+    
+    position = {thread_hash: index for index, thread_hash in enumerate(chain_hashes)}
+    best = max(rows, key=lambda row: position[row.thread_hash])
+    return {
+        'id': best.id,
+        'messages': position[best.thread_hash] + 1,
+        'summary': best.summary or '',
+        'action_items': best.action_items or '',
+        'deadlines': best.deadlines or '',
+    }
+
+email_analyzer.prior_lookup = find_prior_thread_analysis
+
+def summary_to_analysis(summary):
+    """Rebuild an analysis result from a stored EmailSummary row"""
+    risk_data = _loads_or_empty(summary.risk_assessment)
+    return {
+        'summary': summary.summary.split('\n') if summary.summary else [],
+        'action_items': summary.action_items.split('\n') if summary.action_items else [],
+        'deadlines': summary.deadlines.split('\n') if summary.deadlines else [],
+        'sentiment': summary.sentiment,
+        'priority': summary.priority,
+        'intent': summary.intent,
+        'urgency_score': summary.urgency_score,
+        'confidence_score': summary.confidence_score,
+        'suggested_replies': _loads_or_empty(summary.suggested_replies),
+        'spam_analysis': _loads_or_empty(summary.spam_analysis),
+        'decision_helper': risk_data,
+    }
+
+def options_key(options):
+    """Stored form of an analysis's options, e.g. 'detailed|english|professional'"""
+    return '|'.join(str(options.get(name) or '').strip().lower()
+                    for name in ('summary_style', 'output_language', 'reply_tone'))[:150]
+
+def find_similar_analysis(email_content, options):
+    """Stored analysis of a near-identical email made with the same options, if one scores
+    above SIMILARITY_REUSE_THRESHOLD"""
+    from models import EmailSummary
+    with app.app_context():
+        vector_index.refresh(db.session)
+        matches = [(summary_id, score) for summary_id, score in
+                   vector_index.search(vector_index.embed([email_content]), k=SIMILARITY_REUSE_CANDIDATES)[0]
+                   if score >= SIMILARITY_REUSE_THRESHOLD]
+        if not matches:
+            return None
+        # The best-scoring near-duplicate whose summary style, language and tone match the request
+        candidates = {row.id: row for row in db.session.query(EmailSummary).filter(
+            EmailSummary.id.in_([summary_id for summary_id, _ in matches]),
+            EmailSummary.analysis_options == options_key(options)
+        )}
+        summary_id, score = next(((summary_id, score) for summary_id, score in matches if summary_id in candidates),
+                                 (None, None))
+        if summary_id is None:
+            return None
+        summary = candidates[summary_id]
+        app.logger.info(f"Reusing analysis {summary_id} (similarity {score:.3f})")
+        return {**summary_to_analysis(summary), 'reused_from': {'id': summary_id, 'similarity': round(score, 4)}}
+
+if SIMILARITY_REUSE_THRESHOLD > 0:
+    email_analyzer.similar_lookup = find_similar_analysis
+
+@app.before_request
+def start_job_workers():
+    """Start job workers lazily so each gunicorn worker process runs its own pool"""
+    job_queue.ensure_started()
+    if ingest_service is not None:
+        ingest_service.ensure_started()
+
+@app.before_request
+def identify_client():
+    """Queue this request's API calls under its client: X-Client-Id if sent, else the remote address"""
+    set_client(request.headers.get('X-Client-Id') or request.remote_addr)
+
+def _overloaded_response(error):
+    """429 for a request shed by admission control"""
+    response = jsonify({
+        'success': False,
+        'error': 'The server is busy, please retry later',
+        'retry_after': error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.before_request
+def start_request_metrics():
+    """Start timing the request and, when asked for, sampling its call stacks"""
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+    g.profiler = None
+    if PROFILE_TOKEN and request.headers.get('X-Profile') == PROFILE_TOKEN:
+        g.profiler = SamplingProfiler(interval=PROFILE_INTERVAL).start()
+
+def _save_profile(profiler):
+    """Write a request profile in folded-stack format; returns its id"""
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{os.getpid()}"
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.folded'), 'w') as f:
+        f.write(profiler.folded())
+    top = ', '.join(f"{frame} {share:.0%}" for frame, share in profiler.top(5))
+    app.logger.info(f"Profile {profile_id}: {profiler.samples} samples; top: {top}")
+    return profile_id
+
+@app.after_request
+def record_request_metrics(response):
+    """Request counters/latency, a Server-Timing header with the stage breakdown, and the profile"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('emailwise_http_requests_total', endpoint=endpoint, method=request.method,
+                status=response.status_code)
+    metrics.observe('emailwise_http_request_seconds', time.perf_counter() - started,
+                    endpoint=endpoint, method=request.method)
+
+    timings = metrics.end_request()
+    if timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        try:
+            response.headers['X-Profile-Id'] = _save_profile(profiler.stop())
+        except OSError as e:
+            app.logger.error(f"Could not save profile: {str(e)}")
+
+    metrics.flush()
+    return response
 
 @app.route('/')
 def index():
@@ -83,6 +346,33 @@ def analyze_email():
         output_language = analysis_options.get('outputLanguage', 'english')
         reply_tone = analysis_options.get('replyTone', 'professional')
 
+        # Async mode: hand the work to the job queue and return immediately
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            job_id = job_queue.enqueue(
+                email_content,
+                attachments=attachments,
+                summary_style=summary_style,
+                output_language=output_language,
+                reply_tone=reply_tone
+            )
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f'/api/jobs/{job_id}',
+                'events_url': f'/api/jobs/{job_id}/events'
+            }), 202
+
+        # Streaming mode: emit each field as soon as the model completes it
+        if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return _stream_analysis(
+                email_content,
+                attachments=attachments,
+                summary_style=summary_style,
+                output_language=output_language,
+                reply_tone=reply_tone
+            )
+
         # Analyze email using AI
         analysis_data = email_analyzer.analyze_email(
             email_content, 
@@ -93,37 +383,11 @@ def analyze_email():
         )
         
         # Save to database
-        from models import EmailSummary
-        summary = EmailSummary()
-        summary.email_content = email_content
-        
-        # Handle list fields (summary, actions, deadlines)
-        summary.summary = '\n'.join(analysis_data.get('summary', [])) if isinstance(analysis_data.get('summary'), list) else analysis_data.get('summary', '')
-        summary.action_items = '\n'.join(analysis_data.get('action_items', []))
-        summary.deadlines = '\n'.join(analysis_data.get('deadlines', []))
-        
-        summary.sentiment = analysis_data.get('sentiment', 'Neutral')
-        summary.priority = analysis_data.get('priority', 'Medium')
-        
-        # New Intelligence Fields
-        summary.intent = analysis_data.get('intent', 'General')
-        summary.urgency_score = analysis_data.get('urgency_score', 0)
-        
-        import json
-        summary.risk_assessment = json.dumps(analysis_data.get('decision_helper', {})) # Mapped decision_helper to risk_assessment field
-        summary.spam_analysis = json.dumps(analysis_data.get('spam_analysis', {}))
-        summary.confidence_score = analysis_data.get('confidence_score', 0.0)
-        
-        # Handle replies
-        suggested_replies = analysis_data.get('suggested_replies', {})
-        # Save primary reply text to legacy field for safety
-        summary.suggested_reply = suggested_replies.get('option_1', {}).get('text', '')
-        summary.suggested_replies = json.dumps(suggested_replies)
-        
-        summary.created_at = datetime.utcnow()
+        summary = build_summary(email_content, analysis_data)
         
         db.session.add(summary)
-        db.session.commit()
+        with metrics.span('db_commit'):
+            db.session.commit()
         
         app.logger.info(f"Successfully analyzed email and saved summary with ID: {summary.id}")
         
@@ -136,6 +400,8 @@ def analyze_email():
             'id': summary.id
         })
         
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         app.logger.error(f"Error analyzing email: {str(e)}")
         import traceback
@@ -145,6 +411,304 @@ def analyze_email():
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+def _collect_batch_items():
+    """Gather (email_content, attachments) pairs and options from a batch request"""
+    from mail_parsing import iter_bundle_messages, message_to_text, message_attachments
+    items = []
+    
+    if request.content_type and request.content_type.startswith('multipart/form-data'):
+        try:
+            analysis_options = json.loads(request.form.get('analysis_options', '{}'))
+            emails = json.loads(request.form.get('emails', '[]'))
+        except ValueError:
+            raise ValueError('analysis_options and emails must be valid JSON')
+        
+        # mbox / .eml bundles are parsed one message at a time
+        for bundle in request.files.getlist('bundle'):
+            for message in iter_bundle_messages(bundle):
+                items.append((message_to_text(message), message_attachments(message)))
+                if len(items) + len(emails) > BATCH_MAX_ITEMS:
+                    raise ValueError(f'Batch exceeds the limit of {BATCH_MAX_ITEMS} emails')
+    else:
+        data = request.get_json(silent=True) or {}
+        analysis_options = data.get('analysis_options', {})
+        emails = data.get('emails', [])
+    
+    if not isinstance(emails, list):
+        raise ValueError('emails must be a list')
+    for entry in emails:
+        content = entry.get('email_content', '') if isinstance(entry, dict) else entry
+        items.append(((content or '').strip(), None))
+    
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f'Batch exceeds the limit of {BATCH_MAX_ITEMS} emails')
+    return items, analysis_options
+
+def analyze_items(items, options, concurrency=8):
+    """Analyze (email_content, attachments) pairs; one {'index', 'success', 'data'|'error'} per item"""
+    def run(item):
+        email_content, attachments = item
+        if not email_content:
+            raise ValueError('Email content is required')
+        return email_analyzer.analyze_email(email_content, attachments=attachments, **options)
+    
+    results = [None] * len(items)
+    if email_analyzer.client is None:
+        # Offline: score the whole batch in one pass of the local engine
+        valid = [index for index, (email_content, _) in enumerate(items) if email_content]
+        contents = [items[index][0] + (email_analyzer.process_attachments(items[index][1]) if items[index][1] else '')
+                    for index in valid]
+        analyses = email_analyzer.analyze_local_batch(contents, options['summary_style'], options['reply_tone'])
+        for index, analysis in zip(valid, analyses):
+            results[index] = {'index': index, 'success': True, 'data': {**analysis, 'options': options}}
+        for index, result in enumerate(results):
+            if result is None:
+                results[index] = {'index': index, 'success': False, 'error': 'Email content is required'}
+    else:
+        # Fan out the LLM calls under a bounded concurrency limit; each runs in a copy of this
+        # context so its admission is queued under the requesting client
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, run, item) for item in items]
+            for index, future in enumerate(futures):
+                try:
+                    results[index] = {'index': index, 'success': True, 'data': future.result()}
+                except Exception as e:
+                    app.logger.error(f"Batch item {index} failed: {str(e)}")
+                    results[index] = {'index': index, 'success': False, 'error': str(e)}
+    return results
+
+def save_results(items, results):
+    """Add a summary row for every successful result in one flush; the caller commits"""
+    succeeded = [result for result in results if result['success']]
+    rows = [build_summary(items[result['index']][0], result['data']) for result in succeeded]
+    db.session.add_all(rows)
+    with metrics.span('db_commit'):
+        db.session.flush()
+    return succeeded, rows
+
+def _sse_response(generator):
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _overloaded_event(error):
+    """SSE counterpart of _overloaded_response once the stream's headers are sent"""
+    return sse_event('error', {
+        'success': False,
+        'error': 'The server is busy, please retry later',
+        'retry_after': error.retry_after
+    })
+
+def _stream_analysis(email_content, **options):
+    """SSE response that forwards analysis fields as they arrive, then saves the summary"""
+    def generate():
+        try:
+            for event, data in email_analyzer.analyze_email_stream(email_content, **options):
+                if event == 'field':
+                    yield sse_event('field', data)
+                    continue
+                if event == 'error':
+                    yield sse_event('error', {'success': False, 'error': data['error']})
+                    return
+                
+                summary = build_summary(email_content, data)
+                db.session.add(summary)
+                with metrics.span('db_commit'):
+                    db.session.commit()
+                app.logger.info(f"Successfully analyzed email and saved summary with ID: {summary.id}")
+                
+                data['risk_assessment'] = data.get('decision_helper', {})
+                yield sse_event('done', {'success': True, 'data': data, 'id': summary.id})
+        except Overloaded as e:
+            yield _overloaded_event(e)
+        except Exception as e:
+            app.logger.error(f"Error streaming analysis: {str(e)}")
+            db.session.rollback()
+            yield sse_event('error', {'success': False, 'error': f'An error occurred: {str(e)}'})
+    
+    return _sse_response(generate())
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """API endpoint to analyze many emails (JSON list or mbox/.eml bundle) concurrently"""
+    try:
+        try:
+            items, analysis_options = _collect_batch_items()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if not items:
+            return jsonify({
+                'success': False,
+                'error': 'At least one email is required'
+            }), 400
+        
+        options = {
+            'summary_style': analysis_options.get('summaryStyle', 'detailed'),
+            'output_language': analysis_options.get('outputLanguage', 'english'),
+            'reply_tone': analysis_options.get('replyTone', 'professional'),
+        }
+        
+        results = analyze_items(items, options, concurrency=BATCH_CONCURRENCY)
+        
+        # Persist every successful analysis in a single bulk insert
+        succeeded, rows = save_results(items, results)
+        db.session.commit()
+        
+        for result, row in zip(succeeded, rows):
+            result['id'] = row.id
+            result['data']['risk_assessment'] = result['data'].get('decision_helper', {})
+        
+        app.logger.info(f"Batch analyzed {len(rows)}/{len(items)} emails")
+        
+        return jsonify({
+            'success': True,
+            'total': len(items),
+            'succeeded': len(rows),
+            'failed': len(items) - len(rows),
+            'results': results
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error analyzing batch: {str(e)}")
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'An error occurred: {str(e)}'
+        }), 500
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """API endpoint to poll the status/result of an async analysis job"""
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        app.logger.error(f"Error retrieving job {job_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while retrieving the job.'
+        }), 500
+
+@app.route('/api/jobs/<job_id>/events')
+def stream_job(job_id):
+    """Server-Sent Events stream that emits job status changes until it finishes"""
+    if job_queue.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    poll_interval = float(os.environ.get('JOB_EVENTS_POLL_INTERVAL', 0.5))
+    max_wait = float(os.environ.get('JOB_EVENTS_MAX_WAIT', 300))
+    
+    def generate():
+        deadline = time.monotonic() + max_wait
+        last_status = None
+        while True:
+            job = job_queue.get(job_id)
+            if job['status'] != last_status:
+                last_status = job['status']
+                event = 'result' if last_status in TERMINAL_STATUSES else 'status'
+                yield sse_event(event, job)
+            if last_status in TERMINAL_STATUSES:
+                return
+            if time.monotonic() > deadline:
+                # Let the client reconnect or fall back to polling
+                yield sse_event('timeout', {})
+                return
+            time.sleep(poll_interval)
+            yield ": keep-alive\n\n"
+    
+    return _sse_response(generate())
+
+def open_chat_session(session_id, summary_id):
+    """The chat session session_id, else the latest one for summary_id or a new one; None if not found"""
+    from models import ChatSession, EmailSummary
+    from chat_sessions import new_session
+    if session_id:
+        session = db.session.get(ChatSession, session_id)
+        if session is None or (summary_id and session.summary_id != summary_id):
+            return None
+        return session
+    session = (db.session.query(ChatSession).filter_by(summary_id=summary_id)
+               .order_by(ChatSession.id.desc()).first())
+    if session is not None:
+        return session
+    summary = db.session.get(EmailSummary, summary_id)
+    if summary is None:
+        return None
+    with metrics.span('chat_index'):
+        session = new_session(summary)
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+def recent_chat_turns(session_id, limit):
+    """The last limit turns of a session as (role, content), oldest first"""
+    from models import ChatTurn
+    turns = (db.session.query(ChatTurn.role, ChatTurn.content)
+             .filter(ChatTurn.session_id == session_id)
+             .order_by(ChatTurn.id.desc()).limit(limit).all())
+    return [(turn.role, turn.content) for turn in reversed(turns)]
+
+def save_chat_turns(session, query, answer, usage=None):
+    from models import ChatTurn
+    db.session.add(ChatTurn(session_id=session.id, role='user', content=query))
+    db.session.add(ChatTurn(session_id=session.id, role='assistant', content=answer,
+                            prompt_tokens=(usage or {}).get('prompt_tokens')))
+    session.updated_at = datetime.utcnow()
+    with metrics.span('db_commit'):
+        db.session.commit()
+
+def _session_chat(data, user_query):
+    """Answer a question in a chat session from retrieved excerpts instead of the whole email"""
+    from chat_sessions import BM25Index, CHAT_TOP_K, CHAT_HISTORY_TURNS, session_ids
+    try:
+        session_id, summary_id = session_ids(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    session = open_chat_session(session_id, summary_id)
+    if session is None:
+        return jsonify({
+            'success': False,
+            'error': 'Chat session or summary not found'
+        }), 404
+    
+    turns = recent_chat_turns(session.id, CHAT_HISTORY_TURNS)
+    with metrics.span('retrieval'):
+        excerpts = BM25Index.from_json(session.chunk_index).excerpts(user_query, CHAT_TOP_K)
+    
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        def generate():
+            answer = ''
+            try:
+                for token in email_analyzer.chat_in_session_stream(session.context, excerpts, turns, user_query):
+                    answer += token
+                    yield sse_event('token', {'text': token})
+            except Overloaded as e:
+                yield _overloaded_event(e)
+                return
+            except ChatStreamError as e:
+                # The tokens sent so far are not an answer: keep them out of the session history
+                yield sse_event('error', {'success': False, 'error': str(e)})
+                return
+            if answer:
+                save_chat_turns(session, user_query, answer)
+            yield sse_event('done', {'success': True, 'session_id': session.id})
+        return _sse_response(generate())
+    
+    response = email_analyzer.chat_in_session(session.context, excerpts, turns, user_query)
+    if not response.get('failed'):
+        save_chat_turns(session, user_query, response['answer'], response.get('usage'))
+    
+    return jsonify({
+        'success': True,
+        'answer': response.get('answer', 'I could not generate an answer.'),
+        'session_id': session.id
+    })
+
 @app.route('/api/chat', methods=['POST'])
 def chat_with_email():
     """API endpoint for follow-up chat with email context"""
@@ -153,12 +717,29 @@ def chat_with_email():
         email_content = data.get('email_content', '').strip()
         user_query = data.get('query', '').strip()
         
+        if user_query and (data.get('session_id') or data.get('summary_id')):
+            return _session_chat(data, user_query)
+        
         if not email_content or not user_query:
             return jsonify({
                 'success': False,
                 'error': 'Email content and query are required'
             }), 400
             
+        if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            def generate():
+                try:
+                    for token in email_analyzer.chat_with_email_stream(email_content, user_query):
+                        yield sse_event('token', {'text': token})
+                except Overloaded as e:
+                    yield _overloaded_event(e)
+                    return
+                except ChatStreamError as e:
+                    yield sse_event('error', {'success': False, 'error': str(e)})
+                    return
+                yield sse_event('done', {'success': True})
+            return _sse_response(generate())
+        
         # Use the chat method in analyzer
         response = email_analyzer.chat_with_email(email_content, user_query)
         
@@ -167,13 +748,67 @@ def chat_with_email():
             'answer': response.get('answer', 'I could not generate an answer.')
         })
         
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         app.logger.error(f"Chat error: {str(e)}")
+        db.session.rollback()
         return jsonify({
             'success': False,
             'error': 'Chat service unavailable'
         }), 500
 
+@app.route('/api/chat/sessions/<int:session_id>', methods=['GET'])
+def get_chat_session(session_id):
+    """API endpoint returning a chat session with all of its turns"""
+    try:
+        from models import ChatSession, ChatTurn
+        from chat_sessions import session_to_dict
+        session = db.session.get(ChatSession, session_id)
+        if session is None:
+            return jsonify({
+                'success': False,
+                'error': 'Chat session not found'
+            }), 404
+        turns = db.session.query(ChatTurn).filter_by(session_id=session_id).order_by(ChatTurn.id).all()
+        return jsonify({
+            'success': True,
+            'session': session_to_dict(session, turns)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error fetching chat session: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while fetching the chat session.'
+        }), 500
+
+@app.route('/api/chat/sessions/<int:session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    """API endpoint to delete a chat session and its turns"""
+    try:
+        from models import ChatSession, ChatTurn
+        db.session.query(ChatTurn).filter_by(session_id=session_id).delete()
+        deleted = db.session.query(ChatSession).filter_by(id=session_id).delete()
+        db.session.commit()
+        if not deleted:
+            return jsonify({
+                'success': False,
+                'error': 'Chat session not found'
+            }), 404
+        return jsonify({
+            'success': True,
+            'message': 'Chat session deleted'
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error deleting chat session: {str(e)}")
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while deleting the chat session.'
+        }), 500
+
 @app.route('/api/action', methods=['POST'])
 def perform_action():
     """API endpoint to perform simulated actions (Archive, Snooze, etc.)"""
@@ -222,47 +857,119 @@ def perform_action():
             'error': 'Action failed'
         }), 500
 
+HISTORY_DEFAULT_LIMIT = 10
+HISTORY_MAX_LIMIT = 100
+
+def _encode_cursor(created_at, summary_id):
+    import base64
+    raw = json.dumps([created_at.isoformat(), summary_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    import base64
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, summary_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(summary_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+def _history_query(args):
+    """Column-projected, filtered history query; never loads full email bodies"""
+    from sqlalchemy import tuple_
+    from models import EmailSummary
+    
+    columns = [
+        EmailSummary.id,
+        EmailSummary.preview,
+        EmailSummary.summary,
+        EmailSummary.action_items,
+        EmailSummary.deadlines,
+        EmailSummary.sentiment,
+        EmailSummary.priority,
+        EmailSummary.intent,
+        EmailSummary.urgency_score,
+        EmailSummary.confidence_score,
+        EmailSummary.suggested_reply,
+        EmailSummary.status,
+        EmailSummary.created_at,
+    ]
+    include_details = args.get('fields', 'full') != 'compact'
+    if include_details:
+        columns += [EmailSummary.risk_assessment, EmailSummary.spam_analysis, EmailSummary.suggested_replies]
+    query = db.session.query(*columns)
+    
+    # Multi-value filters accept comma-separated lists, e.g. ?priority=High,Medium
+    for name, column in (('status', EmailSummary.status), ('intent', EmailSummary.intent), ('priority', EmailSummary.priority)):
+        if args.get(name):
+            values = [value.strip() for value in args[name].split(',') if value.strip()]
+            query = query.filter(column.in_(values))
+    if args.get('min_urgency'):
+        query = query.filter(EmailSummary.urgency_score >= int(args['min_urgency']))
+    if args.get('max_urgency'):
+        query = query.filter(EmailSummary.urgency_score <= int(args['max_urgency']))
+    # Creation date range (UTC days, both inclusive)
+    if args.get('from'):
+        query = query.filter(EmailSummary.created_at >= _parse_day(args['from']))
+    if args.get('to'):
+        query = query.filter(EmailSummary.created_at < _parse_day(args['to']) + timedelta(days=1))
+    
+    # Keyset pagination: strictly older than the last row of the previous page
+    if args.get('cursor'):
+        created_at, summary_id = _decode_cursor(args['cursor'])
+        query = query.filter(tuple_(EmailSummary.created_at, EmailSummary.id) < tuple_(created_at, summary_id))
+    
+    return query.order_by(EmailSummary.created_at.desc(), EmailSummary.id.desc()), include_details
+
 @app.route('/api/history')
 def get_history():
-    """API endpoint to get analysis history"""
+    """API endpoint to get analysis history (keyset-paginated, filterable)"""
     try:
-        from models import EmailSummary
-        summaries = EmailSummary.query.order_by(EmailSummary.created_at.desc()).limit(10).all()
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), 1), HISTORY_MAX_LIMIT)
+            query, include_details = _history_query(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        # Fetch one extra row to know whether another page exists
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
         history = []
-        import json
-        for summary in summaries:
-            try:
-                risk_data = json.loads(summary.risk_assessment) if summary.risk_assessment else {}
-                spam_data = json.loads(summary.spam_analysis) if summary.spam_analysis else {}
-                replies_data = json.loads(summary.suggested_replies) if summary.suggested_replies else {}
-            except:
-                risk_data = {}
-                spam_data = {}
-                replies_data = {}
-
-            history.append({
-                'id': summary.id,
-                'email_content': summary.email_content[:100] + '...' if len(summary.email_content) > 100 else summary.email_content,
-                'summary': summary.summary.split('\n') if summary.summary else [],
-                'action_items': summary.action_items.split('\n') if summary.action_items else [],
-                'deadlines': summary.deadlines.split('\n') if summary.deadlines else [],
-                'sentiment': summary.sentiment,
-                'priority': summary.priority, # Legacy
-                'intent': summary.intent,
-                'urgency_score': summary.urgency_score,
-                'risk_assessment': risk_data,
-                'spam_analysis': spam_data,
-                'confidence_score': summary.confidence_score,
-                'suggested_reply': summary.suggested_reply,
-                'suggested_replies': replies_data,
-                'status': getattr(summary, 'status', 'active'), # Safely get status
-                'created_at': summary.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            })
+        for row in rows:
+            preview = row.preview or ''
+            item = {
+                'id': row.id,
+                'email_content': preview[:100] + '...' if len(preview) > 100 else preview,
+                'summary': row.summary.split('\n') if row.summary else [],
+                'action_items': row.action_items.split('\n') if row.action_items else [],
+                'deadlines': row.deadlines.split('\n') if row.deadlines else [],
+                'sentiment': row.sentiment,
+                'priority': row.priority, # Legacy
+                'intent': row.intent,
+                'urgency_score': row.urgency_score,
+                'confidence_score': row.confidence_score,
+                'suggested_reply': row.suggested_reply,
+                'status': row.status or 'active',
+                'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            if include_details:
+                item['risk_assessment'] = _loads_or_empty(row.risk_assessment)
+                item['spam_analysis'] = _loads_or_empty(row.spam_analysis)
+                item['suggested_replies'] = _loads_or_empty(row.suggested_replies)
+            history.append(item)
         
         return jsonify({
             'success': True,
-            'data': history
+            'data': history,
+            'next_cursor': _encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
         })
         
     except Exception as e:
@@ -272,14 +979,315 @@ def get_history():
             'error': 'An error occurred while retrieving history.'
         }), 500
 
+@app.route('/api/stats')
+def get_stats():
+    """API endpoint for inbox statistics (volume by intent, priority, sentiment, status and average urgency over time)"""
+    try:
+        try:
+            end = _parse_day(request.args['to']).date() if request.args.get('to') else datetime.utcnow().date()
+            start = _parse_day(request.args['from']).date() if request.args.get('from') else end - timedelta(days=29)
+            granularity = request.args.get('granularity', 'day')
+            if granularity not in rollups.GRANULARITIES:
+                raise ValueError(f"granularity must be one of {', '.join(rollups.GRANULARITIES)}")
+            if start > end:
+                raise ValueError('from must not be after to')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'data': rollups.stats(db.session, start, end, granularity)
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error computing stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while computing statistics.'
+        }), 500
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_COLUMNS = ['id', 'created_at', 'status', 'intent', 'priority', 'sentiment', 'urgency_score', 'confidence_score',
+                  'summary', 'action_items', 'deadlines', 'suggested_reply', 'preview']
+EXPORT_DETAIL_COLUMNS = ['risk_assessment', 'spam_analysis', 'suggested_replies']
+
+def _export_record(row, include_details, include_body):
+    """One exported analysis: stored columns as they are, JSON columns decoded"""
+    record = {
+        'id': row.id,
+        'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else None,
+        'status': row.status or 'active',
+        'intent': row.intent,
+        'priority': row.priority,
+        'sentiment': row.sentiment,
+        'urgency_score': row.urgency_score,
+        'confidence_score': row.confidence_score,
+        'summary': row.summary,
+        'action_items': row.action_items,
+        'deadlines': row.deadlines,
+        'suggested_reply': row.suggested_reply,
+        'preview': row.preview,
+    }
+    if include_details:
+        record['risk_assessment'] = _loads_or_empty(row.risk_assessment)
+        record['spam_analysis'] = _loads_or_empty(row.spam_analysis)
+        record['suggested_replies'] = _loads_or_empty(row.suggested_replies)
+    if include_body:
+        record['email_content'] = body_store.row_content(row)
+    return record
+
+@app.route('/api/export')
+def export_history():
+    """API endpoint streaming the (filtered) history as NDJSON or CSV, newest first"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': 'format must be ndjson or csv'}), 400
+    try:
+        query, include_details = _history_query(request.args)
+        # No upper bound: exporting the whole history is the point; the rows are streamed
+        limit = max(int(request.args['limit']), 1) if request.args.get('limit') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    include_body = request.args.get('include_body', '').lower() in ('1', 'true', 'yes')
+    if include_body:
+        query = body_store.join_bodies(query)
+    if limit is not None:
+        query = query.limit(limit)
+
+    def generate():
+        import io
+        import csv
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS + (EXPORT_DETAIL_COLUMNS if include_details else [])
+                                + (['email_content'] if include_body else []))
+        if export_format == 'csv':
+            writer.writeheader()
+        exported = 0
+        try:
+            # Rows are fetched from a server-side cursor in batches and written out as they come,
+            # so memory stays flat however many rows there are
+            for row in query.yield_per(EXPORT_BATCH_SIZE):
+                record = _export_record(row, include_details, include_body)
+                if export_format == 'csv':
+                    writer.writerow({key: json.dumps(value) if isinstance(value, dict) else value
+                                     for key, value in record.items()})
+                else:
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                    buffer.write('\n')
+                exported += 1
+                if exported % EXPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+            app.logger.info(f"Exported {exported} analyses as {export_format}")
+        except Exception as e:
+            # The status line is already sent; end an NDJSON stream with an error record
+            app.logger.error(f"Export failed after {exported} rows: {str(e)}")
+            if export_format == 'ndjson':
+                yield buffer.getvalue() + json.dumps({'error': 'Export failed', 'exported': exported}) + '\n'
+    
+    filename = f"emailwise-export-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/history/<int:summary_id>')
+def get_history_item(summary_id):
+    """API endpoint for one stored analysis including the full email body"""
+    try:
+        from models import EmailSummary
+        summary = db.session.get(EmailSummary, summary_id)
+        if summary is None:
+            return jsonify({'success': False, 'error': 'Summary not found'}), 404
+        
+        data = summary_to_analysis(summary)
+        data['risk_assessment'] = data['decision_helper']
+        # The body is only loaded (and decompressed) here
+        with metrics.span('body_load'):
+            email_content = summary.email_content
+        return jsonify({
+            'success': True,
+            'data': {
+                **data,
+                'id': summary.id,
+                'email_content': email_content,
+                'status': summary.status or 'active',
+                'message_count': summary.message_count,
+                'created_at': summary.created_at.strftime('%Y-%m-%d %H:%M:%S') if summary.created_at else None
+            }
+        })
+        
+    except Exception as e:
+        app.logger.error(f"Error retrieving summary {summary_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while retrieving the summary.'
+        }), 500
+
+@app.route('/api/search')
+def search_history():
+    """API endpoint for ranked, highlighted full-text search over analyzed emails"""
+    try:
+        import search_index
+        from models import EmailSummary
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Query parameter q is required'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), HISTORY_MAX_LIMIT)
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'limit and offset must be integers'}), 400
+        
+        try:
+            hits = search_index.search(db.session, query, limit=limit, offset=offset)
+        except NotImplementedError as e:
+            return jsonify({'success': False, 'error': str(e)}), 501
+        
+        # Attach list metadata for the page of hits in one query
+        meta = {}
+        if hits:
+            rows = db.session.query(
+                EmailSummary.id, EmailSummary.intent, EmailSummary.priority,
+                EmailSummary.urgency_score, EmailSummary.status, EmailSummary.created_at
+            ).filter(EmailSummary.id.in_([hit['id'] for hit in hits])).all()
+            meta = {row.id: row for row in rows}
+        
+        results = []
+        for hit in hits:
+            row = meta.get(hit['id'])
+            if row is None:
+                continue
+            results.append({
+                **hit,
+                'intent': row.intent,
+                'priority': row.priority,
+                'urgency_score': row.urgency_score,
+                'status': row.status or 'active',
+                'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            })
+        
+        return jsonify({'success': True, 'data': results})
+        
+    except Exception as e:
+        app.logger.error(f"Error searching history: {str(e)}")
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while searching.'
+        }), 500
+
+@app.route('/api/similar/<int:summary_id>')
+def similar_emails(summary_id):
+    """API endpoint listing past analyses most similar to the given one"""
+    try:
+        from models import EmailSummary
+        try:
+            k = min(max(int(request.args.get('k', 5)), 1), 50)
+            min_score = float(request.args.get('min_score', 0))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'k and min_score must be numbers'}), 400
+        
+        vector_index.refresh(db.session)
+        vector = vector_index.vector_for(summary_id)
+        if vector is None:
+            # Possibly saved by another worker since this one last looked
+            vector_index.refresh(db.session, force=True)
+            vector = vector_index.vector_for(summary_id)
+        if vector is None:
+            return jsonify({'success': False, 'error': 'Summary not found'}), 404
+        
+        matches = [m for m in vector_index.search(vector, k=k, exclude_ids=[summary_id])[0] if m[1] >= min_score]
+        rows = {}
+        if matches:
+            rows = {row.id: row for row in db.session.query(
+                EmailSummary.id, EmailSummary.summary, EmailSummary.intent, EmailSummary.priority,
+                EmailSummary.status, EmailSummary.created_at
+            ).filter(EmailSummary.id.in_([m[0] for m in matches])).all()}
+        
+        results = []
+        for match_id, score in matches:
+            row = rows.get(match_id)
+            if row is None:
+                continue
+            results.append({
+                'id': match_id,
+                'similarity': round(score, 4),
+                'summary': row.summary.split('\n') if row.summary else [],
+                'intent': row.intent,
+                'priority': row.priority,
+                'status': row.status or 'active',
+                'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            })
+        
+        return jsonify({'success': True, 'data': results})
+        
+    except Exception as e:
+        app.logger.error(f"Error finding similar emails: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An error occurred while finding similar emails.'
+        }), 500
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """API endpoint exposing result cache hit/miss counters and savings"""
+    return jsonify({
+        'success': True,
+        'data': email_analyzer.cache_stats()
+    })
+
+@app.route('/api/routing/stats')
+def routing_stats():
+    """API endpoint exposing per-tier (local/small/full) request counts, latency and spend"""
+    return jsonify({
+        'success': True,
+        'data': email_analyzer.routing_stats()
+    })
+
+@app.route('/api/upstream/stats')
+def upstream_stats():
+    """API endpoint exposing OpenAI circuit breaker state and retry/hedge counters"""
+    return jsonify({
+        'success': True,
+        'data': email_analyzer.upstream_stats()
+    })
+
+@app.route('/api/admission/stats')
+def admission_stats():
+    """API endpoint exposing LLM calls in flight, token bucket levels, queue depth and shed counts"""
+    return jsonify({
+        'success': True,
+        'data': email_analyzer.admission_stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint (summed over all gunicorn workers when METRICS_DIR is set)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/history/clear', methods=['POST'])
 def clear_history():
     """API endpoint to clear all analysis history"""
     try:
-        from models import EmailSummary
+        from models import EmailSummary, EmailEmbedding, EmailBody, ChatSession, ChatTurn
         # Delete all records
+        import search_index
+        search_index.clear(db.session)
+        rollups.clear(db.session)
+        db.session.query(ChatTurn).delete()
+        db.session.query(ChatSession).delete()
+        db.session.query(EmailEmbedding).delete()
         db.session.query(EmailSummary).delete()
+        db.session.query(EmailBody).delete()
         db.session.commit()
+        vector_index.reset()
+        # Cached results would otherwise bring the deleted analyses back
+        email_analyzer.clear_caches()
         
         return jsonify({
             'success': True,
@@ -295,5 +1303,7 @@ def clear_history():
         }), 500
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,319 @@
+"""
+ASGI entry point for high LLM concurrency.
+
+/api/analyze, /api/chat and /api/action run as coroutines on AsyncOpenAI and an async database
+driver, so a slow model call holds no thread. Every other route, and ?async=1 / ?stream=1
+requests, is served by the Flask app (app:app keeps working on its own).
+
+Only partly async: work that is CPU-bound or goes through the sync session runs in a thread
+pool instead. That covers prior/similar lookups, attachment extraction, routing and saving an
+analysis, whose mapper events compress, embed and index the body.
+
+    gunicorn -c gunicorn_config.py -k uvicorn.workers.UvicornWorker -w 1 asgi:app
+    uvicorn asgi:app --port 5000
+
+Needs the 'async' extra: starlette, uvicorn, python-multipart and aiosqlite (SQLite) or
+asyncpg (Postgres).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import contextlib
+from datetime import datetime
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount, request_response
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.datastructures import FileStorage
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+# Importing the Flask app registers the models and builds the analyzer; the schema comes from
+# 'flask --app app init-db'
+from app import app as flask_app, db, email_analyzer, build_summary
+from admission import Overloaded, set_client
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Analyses and chats waiting on the model at once; more requests wait for a free slot
+ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 512))
+# Threads for the blocking parts of a request (DB lookups, attachment extraction, routing,
+# admission state and cache writes)
+ASYNC_PREP_THREADS = int(os.environ.get('ASYNC_PREP_THREADS', 8))
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_url(url):
+    """The app's database URL with its async driver, e.g. sqlite:///x.db -> sqlite+aiosqlite:///x.db"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+with flask_app.app_context():
+    # Flask-SQLAlchemy resolves relative SQLite paths, so take the URL from its engine
+    engine = create_async_engine(async_database_url(db.engine.url), pool_recycle=300, pool_pre_ping=True)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+prep_executor = ThreadPoolExecutor(max_workers=ASYNC_PREP_THREADS, thread_name_prefix='analysis-prep')
+inflight = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+wsgi = WSGIMiddleware(flask_app)
+
+
+def _error(message, status):
+    return JSONResponse({'success': False, 'error': message}, status_code=status)
+
+
+def _overloaded(error):
+    """429 for a request shed by admission control"""
+    return JSONResponse({'success': False, 'error': 'The server is busy, please retry later',
+                         'retry_after': error.retry_after},
+                        status_code=429, headers={'Retry-After': str(error.retry_after)})
+
+
+def _identify_client(request):
+    """Same client key as the Flask app: X-Client-Id if sent, else the remote address"""
+    set_client(request.headers.get('x-client-id') or (request.client.host if request.client else None))
+
+
+def _save_summary(email_content, analysis_data):
+    """Insert an analysis through the sync session and return its id.
+
+    The insert's mapper events compress the body, embed it for similarity search and update
+    the full-text index and rollups. That is CPU work and blocking I/O, so the commit runs
+    in prep_executor rather than on the event loop.
+    """
+    with flask_app.app_context():
+        summary = build_summary(email_content, analysis_data)
+        db.session.add(summary)
+        with metrics.span('db_commit'):
+            db.session.commit()
+        return summary.id
+
+
+async def analyze_email(request):
+    """API endpoint to analyze email content with optional attachments"""
+    _identify_client(request)
+    try:
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            form = await request.form()
+            email_content = (form.get('email_content') or '').strip()
+            try:
+                analysis_options = json.loads(form.get('analysis_options') or '{}')
+            except ValueError:
+                analysis_options = {}
+            # Uploads are spooled to disk by the form parser; wrap them like Flask's request.files
+            attachments = [
+                FileStorage(stream=upload.file, filename=upload.filename, content_type=upload.content_type)
+                for upload in form.getlist('attachments') if getattr(upload, 'filename', None)
+            ]
+        else:
+            data = await request.json()
+            email_content = data.get('email_content', '').strip()
+            analysis_options = data.get('analysis_options', {})
+            attachments = None
+
+        if not email_content:
+            return _error('Email content is required', 400)
+
+        async with inflight:
+            analysis_data = await email_analyzer.analyze_email_async(
+                email_content,
+                attachments=attachments or None,
+                summary_style=analysis_options.get('summaryStyle', 'detailed'),
+                output_language=analysis_options.get('outputLanguage', 'english'),
+                reply_tone=analysis_options.get('replyTone', 'professional'),
+                executor=prep_executor
+            )
+
+        summary_id = await asyncio.get_running_loop().run_in_executor(
+            prep_executor, _save_summary, email_content, analysis_data
+        )
+        logger.info(f"Successfully analyzed email and saved summary with ID: {summary_id}")
+
+        analysis_data['risk_assessment'] = analysis_data.get('decision_helper', {})
+        return JSONResponse({'success': True, 'data': analysis_data, 'id': summary_id})
+
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        logger.exception(f"Error analyzing email: {str(e)}")
+        return _error(f'An error occurred: {str(e)}', 500)
+
+
+async def _open_chat_session(session, session_id, summary_id):
+    """Async counterpart of app.open_chat_session"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+    from models import ChatSession, EmailSummary
+    from chat_sessions import new_session
+    if session_id:
+        chat = await session.get(ChatSession, session_id)
+        if chat is None or (summary_id and chat.summary_id != summary_id):
+            return None
+        return chat
+    chat = (await session.execute(
+        select(ChatSession).where(ChatSession.summary_id == summary_id).order_by(ChatSession.id.desc()).limit(1)
+    )).scalar_one_or_none()
+    if chat is not None:
+        return chat
+    summary = await session.get(EmailSummary, summary_id, options=[selectinload(EmailSummary.body)])
+    if summary is None:
+        return None
+    # Chunking and indexing a long email is CPU work; keep it off the event loop
+    chat = await asyncio.get_running_loop().run_in_executor(prep_executor, new_session, summary)
+    session.add(chat)
+    await session.commit()
+    return chat
+
+
+async def _session_chat(data, user_query):
+    from sqlalchemy import select
+    from models import ChatTurn
+    from chat_sessions import BM25Index, CHAT_TOP_K, CHAT_HISTORY_TURNS, session_ids
+    try:
+        session_id, summary_id = session_ids(data)
+    except ValueError as e:
+        return _error(str(e), 400)
+    async with Session() as session:
+        chat = await _open_chat_session(session, session_id, summary_id)
+        if chat is None:
+            return _error('Chat session or summary not found', 404)
+        rows = (await session.execute(
+            select(ChatTurn.role, ChatTurn.content).where(ChatTurn.session_id == chat.id)
+            .order_by(ChatTurn.id.desc()).limit(CHAT_HISTORY_TURNS)
+        )).all()
+        turns = [(row.role, row.content) for row in reversed(rows)]
+        with metrics.span('retrieval'):
+            excerpts = BM25Index.from_json(chat.chunk_index).excerpts(user_query, CHAT_TOP_K)
+
+        async with inflight:
+            response = await email_analyzer.chat_in_session_async(chat.context, excerpts, turns, user_query)
+
+        if not response.get('failed'):
+            session.add(ChatTurn(session_id=chat.id, role='user', content=user_query))
+            session.add(ChatTurn(session_id=chat.id, role='assistant', content=response['answer'],
+                                 prompt_tokens=(response.get('usage') or {}).get('prompt_tokens')))
+            chat.updated_at = datetime.utcnow()
+            with metrics.span('db_commit'):
+                await session.commit()
+    return JSONResponse({'success': True, 'answer': response.get('answer', 'I could not generate an answer.'),
+                         'session_id': chat.id})
+
+
+async def chat_with_email(request):
+    """API endpoint for follow-up chat with email context"""
+    _identify_client(request)
+    try:
+        data = await request.json()
+        email_content = data.get('email_content', '').strip()
+        user_query = data.get('query', '').strip()
+        if user_query and (data.get('session_id') or data.get('summary_id')):
+            return await _session_chat(data, user_query)
+        if not email_content or not user_query:
+            return _error('Email content and query are required', 400)
+
+        async with inflight:
+            response = await email_analyzer.chat_with_email_async(email_content, user_query)
+        return JSONResponse({'success': True, 'answer': response.get('answer', 'I could not generate an answer.')})
+
+    except Overloaded as e:
+        return _overloaded(e)
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        return _error('Chat service unavailable', 500)
+
+
+ACTION_STATUSES = {
+    'archive': ('archived', "Email archived."),
+    'snooze': ('snoozed', "Email snoozed for later."),
+    'delegate': ('delegated', "Marked for delegation."),
+    'mark_read': ('read', "Marked as read."),
+}
+
+
+async def perform_action(request):
+    """API endpoint to perform simulated actions (Archive, Snooze, etc.)"""
+    from models import EmailSummary
+    try:
+        data = await request.json()
+        summary_id = data.get('id')
+        action = data.get('action')
+        if not summary_id or not action:
+            return _error('Missing ID or action', 400)
+
+        async with Session() as session:
+            summary = await session.get(EmailSummary, summary_id)
+            if not summary:
+                return _error('Summary not found', 404)
+            if action not in ACTION_STATUSES:
+                return _error('Invalid action', 400)
+            summary.status, message = ACTION_STATUSES[action]
+            await session.commit()
+        return JSONResponse({'success': True, 'message': message, 'new_status': summary.status})
+
+    except Exception as e:
+        logger.error(f"Error performing action: {str(e)}")
+        return _error('Action failed', 500)
+
+
+class AsyncRoute:
+    """ASGI endpoint that records request metrics and hands ?async=1 / ?stream=1 requests to Flask."""
+
+    def __init__(self, path, endpoint):
+        self.path = path
+        self.app = request_response(endpoint)
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if any(query.get(name, [''])[0].lower() in ('1', 'true', 'yes') for name in ('async', 'stream')):
+            return await wsgi(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.inc('emailwise_http_requests_total', endpoint=self.path, method=scope['method'], status=status)
+            metrics.observe('emailwise_http_request_seconds', time.perf_counter() - started,
+                            endpoint=self.path, method=scope['method'])
+            metrics.flush()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # The async client is created in the serving process, never in a preloading parent
+    email_analyzer.enable_async(prep_executor)
+    yield
+    prep_executor.shutdown(wait=False)
+    if email_analyzer.async_client is not None:
+        await email_analyzer.async_client.client.close()
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/analyze', AsyncRoute('/api/analyze', analyze_email), methods=['POST']),
+        Route('/api/chat', AsyncRoute('/api/chat', chat_with_email), methods=['POST']),
+        Route('/api/action', AsyncRoute('/api/action', perform_action), methods=['POST']),
+        Mount('/', app=wsgi),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,229 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TYPES = ('pdf', 'docx', 'txt')
+
+
+def attachment_kind(filename):
+    """Map a filename to one of the supported extractor kinds, or None."""
+    extension = os.path.splitext((filename or '').lower())[1].lstrip('.')
+    return extension if extension in SUPPORTED_TYPES else None
+
+
+def extract_text(kind, data, char_budget):
+    """Extract at most roughly char_budget characters of text from a file's bytes.
+
+    Runs inside the extraction worker processes, so it must stay a plain module-level function.
+    PDF pages are parsed lazily and extraction stops once the budget is met.
+    """
+    if kind == 'pdf':
+        from pypdf import PdfReader
+        reader = PdfReader(io.BytesIO(data))
+        parts = []
+        collected = 0
+        for page in reader.pages:
+            text = page.extract_text() or ''
+            parts.append(text)
+            collected += len(text) + 1
+            if collected >= char_budget:
+                break
+        return '\n'.join(parts)[:char_budget]
+
+    if kind == 'docx':
+        import mammoth
+        return mammoth.extract_raw_text(io.BytesIO(data)).value[:char_budget]
+
+    if kind == 'txt':
+        # utf-8 is at most 4 bytes per character, so never decode more than needed
+        return data[:char_budget * 4].decode('utf-8', errors='ignore')[:char_budget]
+
+    raise ValueError(f"Unsupported attachment type: {kind}")
+
+
+def _serve(conn):
+    """Extraction worker process: answer (kind, data, char_budget) jobs until the pipe closes."""
+    while True:
+        try:
+            kind, data, char_budget = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            conn.send((True, extract_text(kind, data, char_budget)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {str(e)}"))
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class _Worker:
+    """One extraction process, used for one job at a time so a stuck job can be killed alone."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, kind, data, char_budget, timeout):
+        # The time limit starts here, when a worker takes the job, not when it was queued
+        self.conn.send((kind, data, char_budget))
+        if not self.conn.poll(timeout):
+            raise ExtractionTimeout()
+        try:
+            ok, value = self.conn.recv()
+        except EOFError:
+            raise RuntimeError("Extraction worker exited unexpectedly")
+        if not ok:
+            raise ValueError(value)
+        return value
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class AttachmentExtractor:
+    """Extracts attachment text in worker processes with size/time limits and a content-hash cache.
+
+    At most `workers` extractions run at once per process; a worker that exceeds the time
+    limit is killed and replaced, so a pathological file never keeps a CPU busy.
+    """
+
+    def __init__(self, workers=2, max_bytes=20 * 1024 * 1024, timeout=30.0, char_budget=50000,
+                 cache_entries=256, mp_context='spawn'):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.char_budget = char_budget
+        self.mp_context = mp_context
+        self.cache = LRUCache(max_entries=cache_entries, max_bytes=64 * 1024 * 1024, ttl=86400)
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max(1, workers))
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv('ATTACHMENT_WORKERS', min(4, os.cpu_count() or 1))),
+            max_bytes=int(os.getenv('ATTACHMENT_MAX_BYTES', 20 * 1024 * 1024)),
+            timeout=float(os.getenv('ATTACHMENT_TIMEOUT', 30)),
+            char_budget=int(os.getenv('ATTACHMENT_CHAR_BUDGET', 50000)),
+            mp_context=os.getenv('ATTACHMENT_MP_CONTEXT', 'spawn'),
+        )
+
+    def _check_fork(self):
+        # Worker processes and pipes of the parent are never shared with a forked child
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = []
+                self._slots = threading.BoundedSemaphore(max(1, self.workers))
+                self._pid = os.getpid()
+
+    def _take_worker(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        return _Worker(multiprocessing.get_context(self.mp_context))
+
+    def _extract_in_worker(self, kind, data):
+        """Run one extraction in an idle worker process (started on demand), waiting for a free one."""
+        self._check_fork()
+        slots = self._slots
+        with slots:
+            worker = self._take_worker()
+            try:
+                text = worker.run(kind, data, self.char_budget, self.timeout)
+            except ValueError:
+                # The extractor failed cleanly; the worker is fine
+                self._release_worker(worker)
+                raise
+            except BaseException:
+                # Timed out, died or was interrupted mid-job: its state is unknown
+                worker.kill()
+                raise
+            self._release_worker(worker)
+            return text
+
+    def _release_worker(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def _read_limited(self, file):
+        """Read a file's bytes, refusing anything larger than max_bytes."""
+        data = file.stream.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            raise ValueError(f"File exceeds the {self.max_bytes} byte limit")
+        return data
+
+    def _extract(self, job):
+        filename = job['filename']
+        try:
+            if self.workers <= 0:
+                text = extract_text(job['kind'], job['data'], self.char_budget)
+            else:
+                text = self._extract_in_worker(job['kind'], job['data'])
+            self.cache.set(job['cache_key'], text, size=len(text))
+            return filename, text, None
+        except ExtractionTimeout:
+            logger.error(f"Attachment {filename} exceeded the {self.timeout}s extraction limit")
+            return filename, None, 'timeout'
+        except Exception as e:
+            logger.error(f"Error processing attachment {filename}: {str(e)}")
+            return filename, None, str(e)
+
+    def extract_all(self, files):
+        """Extract every file concurrently.
+
+        Returns a list of (filename, text, error) tuples in input order; text is None
+        for unsupported or failed files.
+        """
+        results = [None] * len(files)
+        pending = []
+
+        for index, file in enumerate(files):
+            kind = attachment_kind(file.filename)
+            if kind is None:
+                logger.warning(f"Unsupported file type: {file.filename}")
+                results[index] = (file.filename, None, 'unsupported')
+                continue
+            try:
+                data = self._read_limited(file)
+            except Exception as e:
+                logger.error(f"Error reading attachment {file.filename}: {str(e)}")
+                results[index] = (file.filename, None, str(e))
+                continue
+
+            cache_key = f"{kind}:{self.char_budget}:{hashlib.sha256(data).hexdigest()}"
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                results[index] = (file.filename, cached, None)
+                continue
+
+            pending.append({'index': index, 'filename': file.filename, 'cache_key': cache_key,
+                            'kind': kind, 'data': data})
+
+        if len(pending) > 1 and self.workers > 1:
+            # One thread per concurrent extraction; each waits on its worker process
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+                extracted = list(executor.map(self._extract, pending))
+        else:
+            extracted = [self._extract(job) for job in pending]
+        for job, result in zip(pending, extracted):
+            results[job['index']] = result
+
+        return results
@@ -0,0 +1,254 @@
+"""
+Generates a reproducible corpus of realistic emails (requests, updates, complaints, spam,
+automated notifications, long reply chains) with PDF/DOCX/TXT attachments.
+
+    python -m benchmarks.corpus --out benchmarks/corpus --count 500 --seed 7
+
+Writes emails.jsonl (one {id, kind, content, attachments} per line), the attachment files
+and corpus.mbox for the batch endpoint.
+"""
+import os
+import json
+import random
+import zipfile
+import argparse
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+PEOPLE = ['Alice Chen', 'Bob Martin', 'Carla Diaz', 'Dev Patel', 'Erin Walsh', 'Farah Khan', 'Greg Olsen',
+          'Hana Sato', 'Ivan Petrov', 'Julia Rossi']
+PROJECTS = ['Q3 budget', 'vendor contract', 'mobile release', 'data migration', 'hiring plan', 'security audit',
+            'customer onboarding', 'board deck', 'pricing update', 'office move']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+FILLER = [
+    "I went through the numbers again this morning and a few items still look off compared to last quarter.",
+    "The team raised a couple of concerns during yesterday's sync that we should address before moving on.",
+    "Legal asked for one more pass on the indemnity clause, mostly around the liability cap.",
+    "We also need to align with finance on the timing of the second payment.",
+    "Marketing would like to see the final copy before anything goes out to customers.",
+    "There is some risk that the vendor slips by a week, so a fallback plan would help.",
+    "Overall progress is good and most of the open questions from last week are resolved.",
+    "I have attached the latest version with tracked changes so you can see what moved.",
+]
+
+
+def _address(name):
+    return f"{name} <{name.split()[0].lower()}@example.com>"
+
+
+def _request(rng, sender, recipient, project):
+    due = rng.choice(WEEKDAYS)
+    body = [f"Hi {recipient.split()[0]},", "",
+            f"Could you review the latest {project} document and send me your comments by {due}?",
+            *rng.sample(FILLER, 3), "",
+            "Specifically, please:",
+            f"- Confirm the totals in section {rng.randint(2, 6)}",
+            "- Flag anything that needs sign-off from leadership", "",
+            "Thanks,", sender.split()[0]]
+    return f"Review needed: {project}", '\n'.join(body)
+
+
+def _update(rng, sender, recipient, project):
+    body = [f"Hi team,", "", f"Quick update on the {project}: we are on track for the milestone this week.",
+            *rng.sample(FILLER, 2), "", "No action needed from you right now.", "", "Best,", sender.split()[0]]
+    return f"Update: {project}", '\n'.join(body)
+
+
+def _complaint(rng, sender, recipient, project):
+    body = ["Hello,", "",
+            f"I am very disappointed with how the {project} has been handled. This is the third time the delivery slipped "
+            "and I still haven't received a clear explanation.",
+            "This is unacceptable and it is now affecting our customers. I need a response within 2 days with a concrete plan.",
+            "", "Regards,", sender]
+    return f"Complaint about the {project}", '\n'.join(body)
+
+
+def _spam(rng, sender, recipient, project):
+    body = ["Dear Friend,", "",
+            "CONGRATULATIONS!!! You have been selected as the WINNER of a $1,000,000 cash prize.",
+            "Click here to claim your prize now: http://claim-prize.example.net/win?id=%d" % rng.randint(1000, 9999),
+            "Verify your account password within 24 hours or the offer expires!", "",
+            "Unsubscribe: http://claim-prize.example.net/unsubscribe"]
+    return "You are a WINNER!!!", '\n'.join(body)
+
+
+def _notification(rng, sender, recipient, project):
+    body = ["This is an automated message, please do not reply.", "",
+            f"Your order #{rng.randint(100000, 999999)} has been shipped and will arrive in 3-5 business days.",
+            "You can track the package from your account page.", "",
+            "Manage preferences | Unsubscribe"]
+    return "Your order has shipped", '\n'.join(body)
+
+
+def _thread(rng, sender, recipient, project, depth=None, start=None):
+    depth = depth or rng.randint(3, 8)
+    start = start or datetime(2026, 3, 2, 9, 0)
+    participants = [sender, recipient]
+    messages = []
+    for index in range(depth):
+        author = participants[index % 2]
+        when = start + timedelta(hours=5 * index)
+        text = f"{rng.choice(FILLER)} {rng.choice(FILLER)}\n\nCan we settle the {project} details by {rng.choice(WEEKDAYS)}?"
+        messages.append((author, when, text))
+    # Newest message first, older ones quoted below it
+    parts = []
+    for level, (author, when, text) in enumerate(reversed(messages)):
+        quote = '> ' * level
+        if level:
+            parts.append(f"{'> ' * (level - 1)}On {when:%a, %b %d, %Y at %I:%M %p}, {_address(author)} wrote:")
+        parts.append('\n'.join(quote + line if line else quote.rstrip() for line in text.split('\n')))
+    return f"Re: {project}", '\n\n'.join(parts)
+
+
+TEMPLATES = [('request', _request, 0.35), ('update', _update, 0.2), ('complaint', _complaint, 0.08),
+             ('spam', _spam, 0.07), ('notification', _notification, 0.12), ('thread', _thread, 0.18)]
+
+
+def make_pdf(lines):
+    """A minimal single-font text PDF (enough for pypdf text extraction)."""
+    pages = [lines[i:i + 45] for i in range(0, len(lines), 45)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_lines in pages:
+        stream = "BT /F1 10 Tf 50 800 Td 14 TL " + ' '.join(
+            f"({line.replace(chr(92), '').replace('(', '[').replace(')', ']')}) '" for line in page_lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1', errors='replace')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_docx(paragraphs):
+    """A minimal .docx with one run per paragraph (enough for mammoth)."""
+    import io
+    body = ''.join(f'<w:p><w:r><w:t xml:space="preserve">{escape(p)}</w:t></w:r></w:p>' for p in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml',
+                      '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                      '</Types>')
+        docx.writestr('_rels/.rels',
+                      '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                      '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+                      '</Relationships>')
+        docx.writestr('word/document.xml',
+                      '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                      f'<w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+
+def attachment_text(rng, project, paragraphs):
+    lines = [f"{project.title()} - working document", ""]
+    for index in range(paragraphs):
+        lines.append(f"Section {index + 1}")
+        lines.extend(rng.sample(FILLER, 3))
+        lines.append(f"Line item total: ${rng.randint(1000, 90000):,}")
+        lines.append("")
+    return lines
+
+
+def generate(count=200, seed=7, attachment_share=0.3, max_attachment_pages=6):
+    """Yield (email dict, {filename: bytes}) pairs."""
+    rng = random.Random(seed)
+    kinds, makers, weights = zip(*[(k, m, w) for k, m, w in TEMPLATES])
+    start = datetime(2026, 3, 2, 8, 0)
+    for index in range(count):
+        sender, recipient = rng.sample(PEOPLE, 2)
+        project = rng.choice(PROJECTS)
+        choice = rng.choices(range(len(kinds)), weights=weights)[0]
+        subject, body = makers[choice](rng, sender, recipient, project)
+        sent = start + timedelta(minutes=37 * index)
+        header = (f"From: {_address(sender)}\nTo: {_address(recipient)}\n"
+                  f"Date: {format_datetime(sent)}\nSubject: {subject}\n\n")
+
+        files = {}
+        if kinds[choice] in ('request', 'update', 'thread') and rng.random() < attachment_share:
+            lines = attachment_text(rng, project, rng.randint(2, max_attachment_pages * 4))
+            kind = rng.choice(['pdf', 'docx', 'txt'])
+            name = f"{index:05d}-{project.replace(' ', '_')}.{kind}"
+            if kind == 'pdf':
+                files[name] = make_pdf(lines)
+            elif kind == 'docx':
+                files[name] = make_docx(lines)
+            else:
+                files[name] = '\n'.join(lines).encode()
+
+        yield {'id': index, 'kind': kinds[choice], 'subject': subject, 'content': header + body,
+               'attachments': sorted(files)}, files
+
+
+def write_corpus(out_dir, count=200, seed=7, attachment_share=0.3):
+    os.makedirs(os.path.join(out_dir, 'attachments'), exist_ok=True)
+    counts = {}
+    with open(os.path.join(out_dir, 'emails.jsonl'), 'w') as index_file, \
+            open(os.path.join(out_dir, 'corpus.mbox'), 'wb') as mbox:
+        for email, files in generate(count, seed, attachment_share):
+            index_file.write(json.dumps(email) + '\n')
+            counts[email['kind']] = counts.get(email['kind'], 0) + 1
+            message = EmailMessage()
+            headers, _, body = email['content'].partition('\n\n')
+            for line in headers.split('\n'):
+                key, _, value = line.partition(': ')
+                message[key] = value
+            message.set_content(body)
+            for name, data in files.items():
+                with open(os.path.join(out_dir, 'attachments', name), 'wb') as f:
+                    f.write(data)
+                subtype = {'pdf': 'pdf', 'docx': 'vnd.openxmlformats-officedocument.wordprocessingml.document'}
+                extension = name.rsplit('.', 1)[1]
+                if extension == 'txt':
+                    message.add_attachment(data.decode(), filename=name)
+                else:
+                    message.add_attachment(data, maintype='application', subtype=subtype[extension], filename=name)
+            mbox.write(b"From benchmark@example.com Mon Mar  2 08:00:00 2026\n")
+            mbox.write(message.as_bytes().replace(b'\nFrom ', b'\n>From ') + b"\n")
+    return counts
+
+
+def load_corpus(out_dir):
+    """Emails of a generated corpus with attachment bytes: list of (email, {filename: bytes})."""
+    items = []
+    with open(os.path.join(out_dir, 'emails.jsonl')) as index_file:
+        for line in index_file:
+            email = json.loads(line)
+            files = {}
+            for name in email['attachments']:
+                with open(os.path.join(out_dir, 'attachments', name), 'rb') as f:
+                    files[name] = f.read()
+            items.append((email, files))
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=os.path.join('benchmarks', 'corpus'))
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--attachment-share', type=float, default=0.3)
+    args = parser.parse_args()
+    counts = write_corpus(args.out, args.count, args.seed, args.attachment_share)
+    print(f"Wrote {args.count} emails to {args.out}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
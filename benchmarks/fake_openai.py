@@ -0,0 +1,182 @@
+"""
+OpenAI-compatible stand-in for benchmarks: serves /v1/chat/completions with configurable
+latency, error rate and streaming, so load tests never spend real API quota.
+
+    python -m benchmarks.fake_openai --port 8100 --latency lognormal:800,0.5 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake gunicorn -c gunicorn_config.py app:app
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_RESULT = {
+    "summary": ["Sender asks for a review of the attached draft.", "Comments are due by Thursday."],
+    "action_items": ["Review the draft", "Send comments to the sender"],
+    "deadlines": ["Thursday"],
+    "subject": "Draft review",
+    "priority": "Medium",
+    "sentiment": "Neutral",
+    "suggested_replies": {
+        "option_1": {"label": "Direct Reply", "text": "Thanks, I will review the draft and send comments by Thursday."},
+        "option_2": {"label": "Alternative Strategy", "text": "Could we go through the draft together on a short call?"}
+    },
+    "intent": "Request",
+    "urgency_score": 5,
+    "confidence_score": 90,
+    "spam_analysis": {"is_spam": False, "reason": "Legitimate business correspondence."},
+    "decision_helper": {"pros": ["Clear ask"], "cons": ["Needs time this week"], "risks": ["Missing the deadline"]}
+}
+CHAT_ANSWER = "The sender is asking you to review the draft and reply with comments by Thursday."
+
+
+def parse_latency(spec):
+    """'fixed:MS', 'uniform:LO,HI' or 'lognormal:MEDIAN_MS,SIGMA' -> function returning seconds."""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda: values[0] / 1000
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal':
+        import math
+        return lambda: random.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency='lognormal:600,0.4', error_rate=0.0, rate_limit_share=0.5,
+                 tokens_per_second=80.0):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share
+        self.tokens_per_second = tokens_per_second
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'streams': 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            return self._send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o', 'object': 'model'}]})
+        if self.path == '/stats':
+            return self._send_json(200, self.server.stats)
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'not found'}})
+
+        server = self.server
+        server.count('requests')
+        time.sleep(server.latency())
+
+        if random.random() < server.error_rate:
+            server.count('errors')
+            if random.random() < server.rate_limit_share:
+                return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}},
+                                       {'Retry-After': '0.2'})
+            return self._send_json(500, {'error': {'message': 'Upstream error', 'type': 'server_error'}})
+
+        is_json = (request.get('response_format') or {}).get('type') == 'json_object'
+        content = json.dumps(ANALYSIS_RESULT) if is_json else CHAT_ANSWER
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in request.get('messages', [])) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                 'total_tokens': prompt_tokens + len(content) // 4,
+                 'prompt_tokens_details': {'cached_tokens': 0}}
+        model = request.get('model', 'gpt-4o')
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+        if request.get('stream'):
+            server.count('streams')
+            return self._stream(completion_id, model, content, usage,
+                                (request.get('stream_options') or {}).get('include_usage'))
+
+        self._send_json(200, {
+            'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage,
+        })
+
+    def _stream(self, completion_id, model, content, usage, include_usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+        delay = 4 / self.server.tokens_per_second  # ~4 characters per token
+        for piece in pieces:
+            send(json.dumps({**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}))
+            time.sleep(delay)
+        send(json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}))
+        if include_usage:
+            send(json.dumps({**base, 'choices': [], 'usage': usage}))
+        send('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def serve(host='127.0.0.1', port=8100, **options):
+    server = FakeOpenAIServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', default='lognormal:600,0.4',
+                        help="fixed:MS | uniform:LO,HI | lognormal:MEDIAN_MS,SIGMA (time to first byte)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429/500')
+    parser.add_argument('--rate-limit-share', type=float, default=0.5, help='share of errors that are 429s')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0, help='streaming speed')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), latency=args.latency, error_rate=args.error_rate,
+                              rate_limit_share=args.rate_limit_share, tokens_per_second=args.tokens_per_second)
+    print(f"Fake OpenAI server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
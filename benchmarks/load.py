@@ -0,0 +1,244 @@
+"""
+Load test: starts the fake OpenAI server and the app (gunicorn with gunicorn_config.py),
+then drives a concurrent mix of /api/analyze, /api/chat and /api/history requests.
+
+    python -m benchmarks.load --concurrency 16 --duration 60 --latency lognormal:800,0.5
+    python -m benchmarks.load --url http://127.0.0.1:5000 --no-fake   # against a running app
+
+Reports p50/p95/p99 latency and requests/second per endpoint; results are written to
+benchmarks/results/load-*.json.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+from benchmarks.common import ROOT, latency_summary, write_results
+from benchmarks.corpus import generate
+from benchmarks import fake_openai
+
+QUESTIONS = ['What is the deadline?', 'Who needs to approve this?', 'Summarize the request in one sentence.']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(server, port, fake_url, workdir, workers=None):
+    """Start the app in a subprocess; gunicorn when available, otherwise the Flask dev server."""
+    env = {
+        **os.environ,
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') if not fake_url else 'fake',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        'ANALYSIS_CACHE_DISABLED': '1',
+        'PORT': str(port),
+    }
+    if fake_url:
+        env['OPENAI_BASE_URL'] = fake_url
+
+    if server == 'gunicorn' and shutil.which('gunicorn'):
+        command = ['gunicorn', '-c', 'gunicorn_config.py', '-b', f'127.0.0.1:{port}', 'app:app']
+        if workers:
+            command[3:3] = ['-w', str(workers)]
+    else:
+        if server == 'gunicorn':
+            print("gunicorn not found, falling back to the Flask server")
+        server = 'flask'
+        command = [sys.executable, '-c',
+                   f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    # Logs go to a file: an unread pipe would fill up and block the app
+    log = open(os.path.join(workdir, 'app.log'), 'wb')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=ROOT, env=env,
+                   stdout=log, stderr=subprocess.STDOUT, check=True)
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    process.log_path = log.name
+    return process, server
+
+
+def wait_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(process.log_path, errors='replace') as log:
+                raise RuntimeError(f"App exited during startup:\n{log.read()[-2000:]}")
+        try:
+            with urllib.request.urlopen(f"{url}/api/cache/stats", timeout=2):
+                return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f"App did not answer within {timeout}s")
+
+
+def stop(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def call(url, path, payload=None, timeout=180):
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(f"{url}{path}", data=data,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = json.loads(response.read() or b'{}')
+            return response.status, body
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+class LoadDriver:
+    """Closed-loop driver: each worker thread sends its next request as soon as the last one returns."""
+
+    def __init__(self, url, emails, mix, concurrency, duration, seed=7):
+        self.url = url
+        self.emails = emails
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name in mix}
+        self.errors = {name: {} for name in mix}
+        self.local_results = 0
+
+    def _request(self, rng, endpoint):
+        email = rng.choice(self.emails)
+        if endpoint == 'analyze':
+            return call(self.url, '/api/analyze', {'email_content': email, 'analysis_options': {}})
+        if endpoint == 'chat':
+            return call(self.url, '/api/chat', {'email_content': email, 'query': rng.choice(QUESTIONS)})
+        return call(self.url, '/api/history?limit=20')
+
+    def _worker(self, index, stop_at):
+        rng = random.Random(self.seed + index)
+        endpoints, weights = zip(*self.mix.items())
+        while time.monotonic() < stop_at:
+            endpoint = rng.choices(endpoints, weights=weights)[0]
+            start = time.perf_counter()
+            try:
+                status, body = self._request(rng, endpoint)
+            except Exception as e:
+                status, body = type(e).__name__, None
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                if status == 200 and body and body.get('success', True):
+                    self.samples[endpoint].append(elapsed)
+                    if (body.get('result') or {}).get('local'):
+                        self.local_results += 1
+                else:
+                    key = str(status)
+                    self.errors[endpoint][key] = self.errors[endpoint].get(key, 0) + 1
+
+    def run(self):
+        stop_at = time.monotonic() + self.duration
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._worker, args=(i, stop_at), daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        endpoints = {}
+        for name, samples in self.samples.items():
+            failed = sum(self.errors[name].values())
+            endpoints[name] = {**latency_summary(samples), 'requests_per_second': round(len(samples) / wall, 2),
+                               'failed': failed, 'errors': self.errors[name]}
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            'wall_seconds': round(wall, 2),
+            'requests': total,
+            'requests_per_second': round(total / wall, 2),
+            'local_fallback_results': self.local_results,
+            'overall': latency_summary([s for samples in self.samples.values() for s in samples]),
+            'endpoints': endpoints,
+        }
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {'analyze', 'chat', 'history'}
+    if unknown:
+        raise ValueError(f"Unknown endpoints in mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='benchmark an already running app instead of starting one')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'], default='gunicorn')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default from gunicorn_config.py)')
+    parser.add_argument('--no-fake', action='store_true', help='do not start the fake OpenAI server')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--mix', default='analyze=6,chat=3,history=1')
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--latency', default='lognormal:600,0.4', help='fake server latency distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    emails = [email['content'] for email, _ in generate(args.emails, attachment_share=0)]
+    fake = process = workdir = None
+    server = 'external'
+    try:
+        fake_url = None
+        if not args.no_fake:
+            fake = fake_openai.serve(port=free_port(), latency=args.latency, error_rate=args.error_rate)
+            fake_url = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+        url = args.url
+        if not url:
+            workdir = tempfile.mkdtemp(prefix='emailwise-load-')
+            port = free_port()
+            process, server = start_app(args.server, port, fake_url, workdir, args.workers)
+            url = f"http://127.0.0.1:{port}"
+            wait_ready(url, process)
+        print(f"Driving {url} ({server}) with {args.concurrency} clients for {args.duration}s, mix {mix}")
+
+        if args.warmup:
+            LoadDriver(url, emails, mix, args.concurrency, args.warmup, seed=1).run()
+        result = LoadDriver(url, emails, mix, args.concurrency, args.duration).run()
+    finally:
+        if process:
+            stop(process)
+        if fake:
+            fake.shutdown()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, stats in result['endpoints'].items():
+        print(f"{name:8s} ok={stats.get('count', 0):6d} failed={stats['failed']:4d}  "
+              f"p50={stats.get('p50_ms', 0):8.1f}ms  p95={stats.get('p95_ms', 0):8.1f}ms  "
+              f"p99={stats.get('p99_ms', 0):8.1f}ms  {stats['requests_per_second']:.1f} req/s")
+    print(f"total    {result['requests']} requests, {result['requests_per_second']} req/s")
+
+    result.update(server=server, concurrency=args.concurrency, duration=args.duration, mix=mix,
+                  fake_openai={'latency': args.latency, 'error_rate': args.error_rate,
+                               'upstream': fake.stats if fake else None})
+    print(f"Results: {write_results('load', result, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
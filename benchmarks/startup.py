@@ -0,0 +1,235 @@
+"""
+Startup benchmark: time to import the app, resident memory per process, and the memory of
+N workers started independently versus forked from one preloaded process (what gunicorn
+does with preload_app).
+
+    python -m benchmarks.startup --runs 5 --workers 4
+    python -m benchmarks.startup --compare HEAD~1        # also measure another commit
+
+Memory figures come from /proc/<pid>/smaps_rollup (Linux): USS is memory private to one
+process, PSS splits shared pages between the processes sharing them, so the sum of PSS
+is what the workers cost together. Results are written to benchmarks/results/startup-*.json.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks.common import ROOT, write_results
+
+HEAVY_MODULES = ('openai', 'httpx', 'pypdf', 'mammoth', 'numpy', 'tiktoken', 'sentence_transformers')
+
+_PRELUDE = r'''
+import gc, json, os, sys, time
+sys.path.insert(0, os.getcwd())
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def warm_up(module):
+    # A worker that has served a request and created its OpenAI client
+    module.app.test_client().get('/api/cache/stats')
+    module.email_analyzer.client
+'''
+
+IMPORT_PROBE = _PRELUDE + r'''
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({'import_seconds': elapsed, 'rss_kb': rss_kb(), 'modules': len(sys.modules),
+                  'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules]}))
+'''
+
+# A worker that imports the app itself, then waits until stdin closes
+WORKER_PROBE = _PRELUDE + r'''
+import app
+warm_up(app)
+os.write(1, f'{os.getpid()}\n'.encode())
+sys.stdin.read()
+'''
+
+# Imports the app once, then forks the workers from it like gunicorn's preload_app
+PRELOAD_PROBE = _PRELUDE + r'''
+import app
+import gunicorn_config
+# The same hooks gunicorn runs around the fork, where this revision has them
+if hasattr(gunicorn_config, 'when_ready'):
+    gunicorn_config.when_ready(None)
+else:
+    gc.freeze()
+children = []
+for _ in range(WORKERS):
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(write_end)
+        if hasattr(gunicorn_config, 'post_fork'):
+            gunicorn_config.post_fork(None, None)
+        warm_up(app)
+        os.write(1, f'{os.getpid()}\n'.encode())  # One write, so lines from forked workers never interleave
+        os.read(read_end, 1)  # Wait until the master exits and the pipe closes
+        os._exit(0)
+    os.close(read_end)
+    children.append(write_end)
+os.write(1, f'master {os.getpid()}\n'.encode())
+sys.stdin.read()
+'''
+
+
+def smaps(pid):
+    """{'rss_kb', 'pss_kb', 'uss_kb'} of a process, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            values = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[-1] == 'kB'}
+    except OSError:
+        return None
+    return {'rss_kb': values.get('Rss', 0), 'pss_kb': values.get('Pss', 0),
+            'uss_kb': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)}
+
+
+def _environment(root, workdir):
+    return {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])),
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') or 'sk-startup-benchmark',
+        'LOG_LEVEL': 'WARNING',
+    }
+
+
+def _script(probe, workers=0):
+    return f"HEAVY_MODULES = {HEAVY_MODULES!r}\nWORKERS = {workers}\n{probe}"
+
+
+def measure_import(root, workdir, runs):
+    samples = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', _script(IMPORT_PROBE)], cwd=root, capture_output=True,
+                                   text=True, env=_environment(root, workdir), timeout=300)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing the app failed:\n{completed.stderr[-2000:]}")
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        'runs': runs,
+        'import_ms_median': round(1000 * statistics.median(s['import_seconds'] for s in samples), 1),
+        'import_ms_min': round(1000 * min(s['import_seconds'] for s in samples), 1),
+        'rss_kb_median': int(statistics.median(s['rss_kb'] for s in samples)),
+        'modules': samples[-1]['modules'],
+        'heavy_modules_loaded': samples[-1]['heavy_modules_loaded'],
+    }
+
+
+def _read_pid(stream):
+    for line in stream:
+        if line.strip().isdigit():
+            return int(line)
+    raise RuntimeError("Worker exited before it was ready")
+
+
+def _summarize(pids, master=None):
+    workers = [smaps(pid) for pid in pids]
+    if any(sample is None for sample in workers):
+        return {'available': False}
+    every = workers + ([smaps(master)] if master else [])
+    return {
+        'available': True,
+        'workers': len(workers),
+        'worker_uss_kb_mean': int(statistics.mean(w['uss_kb'] for w in workers)),
+        'worker_rss_kb_mean': int(statistics.mean(w['rss_kb'] for w in workers)),
+        'total_pss_kb': sum(sample['pss_kb'] for sample in every),
+    }
+
+
+def measure_workers(root, workdir, count):
+    env = _environment(root, workdir)
+
+    independent = [subprocess.Popen([sys.executable, '-c', _script(WORKER_PROBE)], cwd=root, env=env, text=True,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                   for _ in range(count)]
+    try:
+        pids = [_read_pid(process.stdout) for process in independent]
+        separate = _summarize(pids)
+    finally:
+        for process in independent:
+            process.communicate('')
+
+    master = subprocess.Popen([sys.executable, '-c', _script(PRELOAD_PROBE, count)], cwd=root, env=env, text=True,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        pids, master_pid = [], None
+        while master_pid is None or len(pids) < count:
+            line = master.stdout.readline()
+            if not line:
+                raise RuntimeError("Preloaded master exited early")
+            words = line.split()
+            if words[:1] == ['master']:
+                master_pid = int(words[1])
+            elif words and words[0].isdigit():
+                pids.append(int(words[0]))
+        preloaded = _summarize(pids, master_pid)
+    finally:
+        master.communicate('')
+    return {'independent': separate, 'preloaded': preloaded}
+
+
+def measure(root, runs, workers):
+    workdir = tempfile.mkdtemp(prefix='emailwise-startup-')
+    # Revisions without the init-db command create the schema on import instead
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=root,
+                   env=_environment(root, workdir), capture_output=True)
+    try:
+        return {'import': measure_import(root, workdir, runs), 'workers': measure_workers(root, workdir, workers)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure_revision(revision, runs, workers):
+    """Measure another commit from a temporary git worktree."""
+    checkout = tempfile.mkdtemp(prefix='emailwise-rev-')
+    subprocess.run(['git', 'worktree', 'add', '--detach', checkout, revision], cwd=ROOT, check=True,
+                   capture_output=True)
+    try:
+        return measure(checkout, runs, workers)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', checkout], cwd=ROOT, capture_output=True)
+
+
+def _print(label, result):
+    imported, workers = result['import'], result['workers']
+    print(f"{label}: import {imported['import_ms_median']} ms (median), RSS {imported['rss_kb_median'] / 1024:.1f} MiB, "
+          f"heavy modules at import: {', '.join(imported['heavy_modules_loaded']) or 'none'}")
+    for mode in ('independent', 'preloaded'):
+        stats = workers[mode]
+        if stats.get('available'):
+            print(f"  {stats['workers']} workers {mode}: USS/worker {stats['worker_uss_kb_mean'] / 1024:.1f} MiB, "
+                  f"total PSS {stats['total_pss_kb'] / 1024:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to time the import in')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--compare', metavar='REV', help='also measure this git revision')
+    parser.add_argument('--output', help='result file (default benchmarks/results/startup-<timestamp>.json)')
+    args = parser.parse_args()
+
+    results = {'workers': args.workers, 'current': measure(ROOT, args.runs, args.workers)}
+    _print('current', results['current'])
+    if args.compare:
+        results['compare'] = {'revision': args.compare, **measure_revision(args.compare, args.runs, args.workers)}
+        _print(args.compare, results['compare'])
+
+    print(f"Results written to {write_results('startup', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
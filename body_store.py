@@ -0,0 +1,206 @@
+import os
+import zlib
+import hashlib
+import logging
+import sqlalchemy as sa
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 101  # History shows 100 characters and an ellipsis when there is more
+
+
+def _zstd():
+    """zstd module if available: stdlib on Python 3.14+, otherwise the zstandard package."""
+    try:
+        from compression import zstd
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdCompressor(level=9).compress, zstandard.ZstdDecompressor().decompress
+    except ImportError:
+        return None
+
+
+def _codec_from_env():
+    codec = os.getenv('BODY_COMPRESSION', 'zlib').lower()
+    if codec == 'zstd' and _zstd() is None:
+        logger.warning("BODY_COMPRESSION=zstd but no zstd module is available; using zlib")
+        return 'zlib'
+    return codec if codec in ('zlib', 'zstd', 'none') else 'zlib'
+
+
+CODEC = _codec_from_env()
+
+
+def body_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def preview_of(text):
+    return text[:PREVIEW_CHARS]
+
+
+def compress(text, codec=None):
+    """(codec, bytes) for a body; stored raw when compression would not make it smaller."""
+    raw = text.encode('utf-8')
+    codec = codec or CODEC
+    if codec == 'zstd':
+        data = _zstd()[0](raw)
+    elif codec == 'zlib':
+        data = zlib.compress(raw, 6)
+    else:
+        return 'none', raw
+    return (codec, data) if len(data) < len(raw) else ('none', raw)
+
+
+def decompress(codec, data):
+    if codec == 'zlib':
+        raw = zlib.decompress(data)
+    elif codec == 'zstd':
+        module = _zstd()
+        if module is None:
+            raise RuntimeError("Email body is zstd-compressed but no zstd module is installed")
+        raw = module[1](data)
+    else:
+        raw = data
+    return raw.decode('utf-8')
+
+
+def _insert_ignore(connection, table, values):
+    """Insert a body row unless one with the same hash exists (another worker may race us)."""
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        connection.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=['sha256']))
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(sa.insert(table).values(**values))
+    except sa.exc.IntegrityError:
+        pass
+
+
+def store(connection, text):
+    """Store a body once per distinct content; returns its hash.
+
+    The body row is share-locked until the transaction ends, so a concurrent release() of
+    its last other summary waits and then sees the new reference (SQLite serializes writers
+    and ignores the lock clause).
+    """
+    from models import EmailBody
+    table = EmailBody.__table__
+    digest = body_hash(text)
+    locked = sa.select(table.c.sha256).where(table.c.sha256 == digest).with_for_update(read=True)
+    if connection.execute(locked).first() is None:
+        codec, data = compress(text)
+        _insert_ignore(connection, table, {'sha256': digest, 'codec': codec, 'data': data, 'size': len(text)})
+        # Another worker may have won the insert; lock its row as well
+        connection.execute(locked).first()
+    return digest
+
+
+def register(model):
+    """Write the body of every new EmailSummary to the body table as part of its insert, and
+    remove it with the last summary that references it."""
+
+    @event.listens_for(model, 'before_insert')
+    def store_body(mapper, connection, target):
+        text = target.__dict__.get('_body_text')
+        if text is not None and target.body_hash is None:
+            target.body_hash = store(connection, text)
+
+    @event.listens_for(model, 'after_delete')
+    def release_body(mapper, connection, target):
+        if target.body_hash is not None:
+            release(connection, target)
+
+
+def join_bodies(select):
+    """Add the body columns to a select over EmailSummary; read them back with row_content()."""
+    from models import EmailSummary, EmailBody
+    return (select.add_columns(EmailSummary.legacy_content, EmailBody.codec, EmailBody.data)
+            .outerjoin(EmailBody, EmailBody.sha256 == EmailSummary.body_hash))
+
+
+def row_content(row):
+    if row.data is not None:
+        return decompress(row.codec, row.data)
+    return row.legacy_content or ''
+
+
+def release(connection, target):
+    """Delete the body of a deleted summary unless another summary still uses it.
+
+    The body row is locked before the reference check, so a concurrent store() of the same
+    content either finishes first (and its summary counts as a reference) or waits and
+    inserts the body again.
+    """
+    from models import EmailSummary, EmailBody
+    table = EmailBody.__table__
+    row = connection.execute(
+        sa.select(table.c.codec, table.c.data).where(table.c.sha256 == target.body_hash).with_for_update()
+    ).first()
+    if '_body_text' not in target.__dict__:
+        # The search index removes the row after this with the text it indexed, so read it first
+        target.__dict__['_body_text'] = decompress(row.codec, row.data) if row else (target.legacy_content or '')
+    summaries = EmailSummary.__table__
+    in_use = connection.execute(
+        sa.select(summaries.c.id).where(summaries.c.body_hash == target.body_hash).limit(1)
+    ).first()
+    if in_use is None:
+        connection.execute(sa.delete(table).where(table.c.sha256 == target.body_hash))
+
+
+def migrate(db, batch_size=500):
+    """Move bodies stored inline in EmailSummary.email_content to the body table.
+
+    Each batch is its own transaction, so a large table never holds one long write lock and
+    an interrupted run resumes where it stopped (converted rows have a body_hash).
+    """
+    from models import EmailSummary
+
+    summaries = EmailSummary.__table__
+    total = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                sa.select(summaries.c.id, summaries.c.email_content)
+                .where(summaries.c.body_hash.is_(None), summaries.c.id > last_id)
+                .order_by(summaries.c.id)
+                .limit(batch_size)
+            ).all()
+            for row in rows:
+                text = row.email_content or ''
+                conn.execute(
+                    sa.update(summaries).where(summaries.c.id == row.id)
+                    .values(body_hash=store(conn, text), preview=preview_of(text), email_content='')
+                )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        total += len(rows)
+        logger.info(f"Moved {total} email bodies to compressed storage so far")
+    if not total:
+        return 0
+
+    logger.info(f"Moved {total} email bodies to compressed storage")
+    vacuum(db)
+    return total
+
+
+def vacuum(db):
+    """Give the pages freed by a migration back to the file system (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(sa.text('VACUUM'))
+    except sa.exc.OperationalError as e:
+        logger.warning(f"VACUUM after the migration failed: {str(e)}")
@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bump when the analysis prompt or result shape changes so stale entries are ignored
+CACHE_VERSION = "1"
+
+_WHITESPACE_RE = re.compile(r'[ \t\f\v]+')
+
+
+def normalize_body(content):
+    """Normalize an email body so trivially different pastes hash the same."""
+    text = content.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [_WHITESPACE_RE.sub(' ', line).strip() for line in text.split('\n')]
+    return '\n'.join(lines).strip()
+
+
+def make_cache_key(email_content, attachment_digests=(), **options):
+    """Build a content-addressed key from the body, attachment digests and options."""
+    hasher = hashlib.sha256()
+    hasher.update(CACHE_VERSION.encode())
+    hasher.update(b'\0')
+    hasher.update(normalize_body(email_content).encode('utf-8', errors='ignore'))
+    for digest in attachment_digests:
+        hasher.update(b'\0a:')
+        hasher.update(digest.encode())
+    hasher.update(b'\0o:')
+    hasher.update(json.dumps(options, sort_keys=True).encode())
+    return hasher.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with TTL and entry/byte based eviction."""
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, ttl=86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                self._bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size=1):
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class SQLiteCache:
+    """Shared cache tier in a SQLite file so every gunicorn worker sees the same entries.
+
+    Each cache has its own table (and so its own max_entries budget); cache_clears records
+    when a table was last cleared so workers can drop their in-memory copies too.
+    """
+
+    def __init__(self, path, ttl=86400, max_entries=100000, table='analysis_cache'):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_accessed ON {table} (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_clears (name TEXT PRIMARY KEY, cleared_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a fork (preload_app) belongs to the parent; never reuse it
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row[1] < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def _prune(self, conn, now):
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f" SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"DELETE FROM {self.table}")
+                conn.execute("INSERT OR REPLACE INTO cache_clears (name, cleared_at) VALUES (?, ?)",
+                             (self.table, time.time()))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache clear failed: {str(e)}")
+
+    def cleared_at(self):
+        """When the table was last cleared by any worker (0 if never)."""
+        try:
+            row = self._connect().execute("SELECT cleared_at FROM cache_clears WHERE name = ?",
+                                          (self.table,)).fetchone()
+            return row[0] if row else 0.0
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return 0.0
+
+
+class AnalysisCache:
+    """Two-tier cache for analysis results with hit/miss and savings counters."""
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, ttl=86400, shared_path=None,
+                 shared_table='analysis_cache'):
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.shared = SQLiteCache(shared_path, ttl=ttl, table=shared_table) if shared_path else None
+        self._lock = threading.Lock()
+        self._cleared_at = 0.0
+        self._clears_checked = float('-inf')
+        self.stats = {
+            'memory_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'saved_seconds': 0.0,
+            'saved_tokens': 0,
+            'saved_cost_usd': 0.0,
+        }
+
+    @classmethod
+    def from_env(cls, prefix='ANALYSIS_CACHE', table='analysis_cache'):
+        """Cache configured by {prefix}_SIZE, _MAX_BYTES, _TTL and _DB; ANALYSIS_CACHE_DISABLED
+        turns every cache off. Without {prefix}_DB the shared tier uses ANALYSIS_CACHE_DB, in
+        its own table."""
+        if any(os.getenv(f'{name}_DISABLED', '').lower() in ('1', 'true', 'yes') for name in ('ANALYSIS_CACHE', prefix)):
+            return None
+        return cls(
+            max_entries=int(os.getenv(f'{prefix}_SIZE', 512)),
+            max_bytes=int(os.getenv(f'{prefix}_MAX_BYTES', 32 * 1024 * 1024)),
+            ttl=int(os.getenv(f'{prefix}_TTL', 86400)),
+            shared_path=os.getenv(f'{prefix}_DB') or os.getenv('ANALYSIS_CACHE_DB') or None,
+            shared_table=table,
+        )
+
+    def _sync_clears(self):
+        """Drop this worker's in-memory entries once another worker cleared the shared tier."""
+        if self.shared is None or time.monotonic() - self._clears_checked < 1.0:
+            return
+        self._clears_checked = time.monotonic()
+        cleared_at = self.shared.cleared_at()
+        if cleared_at != self._cleared_at:
+            self._cleared_at = cleared_at
+            self.memory.clear()
+
+    def _count(self, name, entry=None):
+        with self._lock:
+            self.stats[name] += 1
+            if entry is not None:
+                self.stats['saved_seconds'] += entry.get('elapsed', 0.0)
+                self.stats['saved_tokens'] += entry.get('tokens', 0)
+                self.stats['saved_cost_usd'] += entry.get('cost', 0.0)
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss."""
+        self._sync_clears()
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count('memory_hits', entry)
+            return copy.deepcopy(entry['result'])
+
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.memory.set(key, entry, size=len(json.dumps(entry)))
+                self._count('shared_hits', entry)
+                return copy.deepcopy(entry['result'])
+
+        self._count('misses')
+        return None
+
+    def set(self, key, result, elapsed=0.0, tokens=0, cost=0.0):
+        """Store a result along with what it cost to compute, for savings accounting."""
+        entry = {'result': copy.deepcopy(result), 'elapsed': elapsed, 'tokens': tokens, 'cost': cost}
+        self.memory.set(key, entry, size=len(json.dumps(entry)))
+        if self.shared is not None:
+            self.shared.set(key, entry)
+        self._count('stores')
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0.0
+        stats['saved_seconds'] = round(stats['saved_seconds'], 3)
+        stats['saved_cost_usd'] = round(stats['saved_cost_usd'], 6)
+        stats['memory_entries'] = len(self.memory)
+        stats['memory_bytes'] = self.memory.size_bytes
+        stats['memory_evictions'] = self.memory.evictions
+        stats['shared_enabled'] = self.shared is not None
+        return stats
@@ -0,0 +1,136 @@
+"""
+Chat sessions about a stored analysis.
+
+A session chunks the email body once and keeps a BM25 index of the chunks, so each question
+sends the model only the stored summary, the few chunks that match the question and the
+latest turns instead of the whole email.
+"""
+import os
+import re
+import json
+import math
+from collections import Counter
+from prompts import clean_email
+from thread_parser import split_messages, chunk_messages
+from local_engine import _STOPWORDS, _stem
+
+CHAT_CHUNK_CHARS = int(os.getenv('CHAT_CHUNK_CHARS', 1500))
+CHAT_TOP_K = int(os.getenv('CHAT_TOP_K', 4))
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', 6))
+
+_TERM_RE = re.compile(r"[a-z0-9][a-z0-9'’.-]*[a-z0-9]|[a-z0-9]")
+
+
+def terms(text):
+    """Lower-cased, stemmed terms without stopwords; numbers and amounts are kept."""
+    return [_stem(term) for term in _TERM_RE.findall(text.lower()) if term not in _STOPWORDS]
+
+
+def chunk_email(text, max_chars=CHAT_CHUNK_CHARS):
+    """Split a cleaned email into retrieval chunks, keeping thread messages together where they fit."""
+    cleaned = clean_email(text)
+    if not cleaned:
+        return []
+    return [chunk.strip() for chunk in chunk_messages(split_messages(cleaned), max_chars) if chunk.strip()]
+
+
+class BM25Index:
+    """Okapi BM25 over a small set of chunks; stored as JSON with its session."""
+
+    def __init__(self, chunks, frequencies, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.frequencies = frequencies  # One {term: count} per chunk
+        self.k1 = k1
+        self.b = b
+        self.lengths = [sum(counts.values()) for counts in frequencies]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in frequencies for term in counts)
+        total = len(chunks)
+        self.idf = {term: math.log(1 + (total - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    @classmethod
+    def build(cls, chunks):
+        return cls(chunks, [dict(Counter(terms(chunk))) for chunk in chunks])
+
+    def to_json(self):
+        return json.dumps({'chunks': self.chunks, 'frequencies': self.frequencies})
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(data['chunks'], data['frequencies'])
+
+    def search(self, query, k=CHAT_TOP_K):
+        """[(chunk index, score)] of the k best matching chunks, best first."""
+        query_terms = set(terms(query))
+        scores = []
+        for index, counts in enumerate(self.frequencies):
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.average_length or 1))
+            score = 0.0
+            for term in query_terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            if score > 0:
+                scores.append((index, score))
+        scores.sort(key=lambda item: -item[1])
+        return scores[:k]
+
+    def excerpts(self, query, k=CHAT_TOP_K):
+        """Best matching chunks in document order; the first chunks when nothing matches."""
+        matches = self.search(query, k)
+        indexes = sorted(index for index, _ in matches) if matches else list(range(min(k, len(self.chunks))))
+        return [self.chunks[index] for index in indexes]
+
+
+def summary_context(summary):
+    """Compact text of a stored analysis that opens every prompt of its chat sessions."""
+    parts = []
+    if summary.summary:
+        parts.append(f"Summary:\n{summary.summary}")
+    if summary.action_items:
+        parts.append(f"Action items:\n{summary.action_items}")
+    if summary.deadlines:
+        parts.append(f"Deadlines:\n{summary.deadlines}")
+    parts.append(f"Priority: {summary.priority} | Intent: {summary.intent} | Sentiment: {summary.sentiment}")
+    return '\n\n'.join(parts)
+
+
+def new_session(summary):
+    """Unsaved ChatSession for a stored analysis, with its body chunked and indexed."""
+    from models import ChatSession
+    index = BM25Index.build(chunk_email(summary.email_content))
+    return ChatSession(summary_id=summary.id, context=summary_context(summary), chunk_index=index.to_json(),
+                       chunk_count=len(index.chunks))
+
+
+def session_ids(data):
+    """(session_id, summary_id) of a chat request, None where absent; ValueError if one is not a positive integer."""
+    ids = []
+    for key in ('session_id', 'summary_id'):
+        value = data.get(key)
+        if value is None or value == '':
+            ids.append(None)
+            continue
+        try:
+            if isinstance(value, (bool, float)):
+                raise TypeError
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            raise ValueError(f'{key} must be a positive integer')
+        if ids[-1] < 1:
+            raise ValueError(f'{key} must be a positive integer')
+    return tuple(ids)
+
+
+def session_to_dict(session, turns):
+    return {
+        'id': session.id,
+        'summary_id': session.summary_id,
+        'created_at': session.created_at.isoformat() if session.created_at else None,
+        'turns': [
+            {'role': turn.role, 'content': turn.content,
+             'created_at': turn.created_at.isoformat() if turn.created_at else None}
+            for turn in turns
+        ],
+    }
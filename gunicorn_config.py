@@ -2,6 +2,11 @@
 """
 Gunicorn configuration for EmailWise production deployment
 """
+import gc
+import os
+import shutil
+import tempfile
+import importlib
 import multiprocessing
 
 # Bind to 0.0.0.0 to allow external access (mimics production)
@@ -14,12 +19,54 @@ workers = 2
 threads = 4
 worker_class = 'gthread'
 
+# Preloading
+# The app is imported once in the master and workers are forked from it, so modules, templates
+# and the local models are shared copy-on-write instead of loaded by every worker. Run
+# 'flask --app app init-db' before starting: importing the app no longer creates the schema.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Imported lazily by the app; with preload_app they are imported in the master instead
+PRELOAD_MODULES = ('openai', 'pypdf', 'mammoth')
+
 # Timeouts
 # OpenAI calls can be slow, especially for "Long Long Emails"
-timeout = 120  # 2 minutes
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))  # 2 minutes; OpenAI call deadlines are derived from it
 keepalive = 5
 
 # Logging
 accesslog = '-'
 errorlog = '-'
 loglevel = 'info'
+
+# Metrics
+# Each worker writes its counters to METRICS_DIR and /metrics sums them, so a scrape that
+# lands on any worker reports the whole server. Start every server run from zero.
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'emailwise-metrics'))
+
+def on_starting(server):
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+def when_ready(server):
+    if not preload_app:
+        return
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    # Building the OpenAI client here imports its HTTP stack in the master; every worker
+    # still creates its own client and connection pool after the fork
+    from app import email_analyzer
+    email_analyzer.client
+    # Move everything loaded so far out of the collector's reach: a collection in a worker
+    # would otherwise write to (and so copy) every shared page holding these objects
+    gc.freeze()
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    # Database connections must not cross a fork; drop the inherited pool without closing
+    # the parent's sockets
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,367 @@
+"""
+Mailbox ingestion: analyze the messages of Maildir directories, mbox files and .eml files or
+folders, resuming after the last message ingested from each source.
+
+    python -m ingest run ~/Maildir /var/mail/alice drop/invoices/   # ingest new messages once
+    python -m ingest watch ~/Maildir --interval 60                   # keep polling
+    python -m ingest status
+    python -m ingest reset /var/mail/alice
+
+A source is a path, optionally prefixed with its kind (maildir:, mbox: or eml:); without a
+prefix, directories with cur/ and new/ are Maildirs, other directories and *.eml files are
+read as .eml messages, and any other file as mbox.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from mail_parsing import iter_mbox_entries, parse_eml, message_to_text, message_attachments
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SOURCE_KINDS = ('maildir', 'mbox', 'eml')
+
+
+class MboxSource:
+    """An mbox file; the watermark is the byte offset after the last ingested message."""
+
+    kind = 'mbox'
+    tracks_files = False
+
+    def __init__(self, path):
+        self.path = path
+        self.key = f'mbox:{path}'
+
+    def _complete_size(self, stream):
+        """(inode, size) of the mbox taken while no delivery is appending to it.
+
+        Mail delivery agents hold an fcntl or flock lock (and often a path.lock dot-lock)
+        while they append, so the size seen under shared locks ends at a complete message.
+        The locks are released straight away; only that prefix is read afterwards.
+        """
+        dot_lock = self.path + '.lock'
+        for _ in range(50):
+            if not os.path.exists(dot_lock):
+                break
+            time.sleep(0.1)
+        else:
+            logger.warning(f"{dot_lock} has been held for 5s; reading {self.path} anyway")
+        if fcntl is None:
+            stat = os.fstat(stream.fileno())
+            return stat.st_ino, stat.st_size
+        fcntl.lockf(stream, fcntl.LOCK_SH)
+        try:
+            fcntl.flock(stream, fcntl.LOCK_SH)
+            stat = os.fstat(stream.fileno())
+            fcntl.flock(stream, fcntl.LOCK_UN)
+        finally:
+            fcntl.lockf(stream, fcntl.LOCK_UN)
+        return stat.st_ino, stat.st_size
+
+    def messages(self, position, seen=None):
+        """Yield (message, position after it) for every message past position."""
+        offset = position.get('offset', 0)
+        with open(self.path, 'rb') as stream:
+            inode, size = self._complete_size(stream)
+            if position and (position.get('inode') != inode or offset > size):
+                logger.warning(f"{self.path} was replaced or truncated; ingesting it from the start")
+                offset = 0
+            stream.seek(offset)
+            for message, end in iter_mbox_entries(stream, offset, end=size):
+                yield message, {'inode': inode, 'offset': end}
+
+
+class DirectorySource:
+    """A Maildir (new/ and cur/) or a folder of .eml files.
+
+    The names of ingested files are recorded (IngestedFile), so a file is picked up
+    whatever its modification time, e.g. when it was copied in with its original one.
+    New files are read in (modification time, name) order. Maildir names are compared
+    without their ':2,flags' suffix, which changes when a message is read or moved from
+    new/ to cur/.
+    """
+
+    tracks_files = True
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.key = f'{kind}:{path}'
+
+    def _files(self):
+        if os.path.isfile(self.path):
+            yield os.path.basename(self.path), self.path
+            return
+        folders = [os.path.join(self.path, 'new'), os.path.join(self.path, 'cur')] if self.kind == 'maildir' else [self.path]
+        for folder in folders:
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.startswith('.'):
+                        continue
+                    if self.kind == 'eml' and not entry.name.lower().endswith('.eml'):
+                        continue
+                    yield entry.name.split(':', 1)[0], entry.path
+
+    def messages(self, position, seen=None):
+        """Yield (message, position) for every file whose name is not in seen."""
+        seen = seen or set()
+        pending = []
+        for name, path in self._files():
+            if name in seen:
+                continue
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:  # Moved (new/ -> cur/) while listing; seen in the other folder
+                continue
+            pending.append((mtime_ns, name, path))
+        # Only names and paths are held in memory; each message is parsed when it is reached
+        for mtime_ns, name, path in sorted(pending):
+            if name in seen:  # Listed in both new/ and cur/ while it was being moved
+                continue
+            seen.add(name)
+            try:
+                with open(path, 'rb') as stream:
+                    message = parse_eml(stream)
+            except FileNotFoundError:
+                continue
+            yield message, {'mtime_ns': mtime_ns, 'name': name}
+
+
+def source_for(spec):
+    """Source object for 'kind:path' or a bare path."""
+    kind, separator, path = spec.partition(':')
+    if not separator or kind not in SOURCE_KINDS:
+        kind, path = None, spec
+    path = os.path.abspath(os.path.expanduser(path))
+    if not os.path.exists(path):
+        raise ValueError(f"Mailbox source not found: {path}")
+    if kind is None:
+        if os.path.isdir(path):
+            is_maildir = os.path.isdir(os.path.join(path, 'cur')) and os.path.isdir(os.path.join(path, 'new'))
+            kind = 'maildir' if is_maildir else 'eml'
+        else:
+            kind = 'eml' if path.lower().endswith('.eml') else 'mbox'
+    return MboxSource(path) if kind == 'mbox' else DirectorySource(path, kind)
+
+
+class Ingestor:
+    """Analyzes new messages of a source in bounded-concurrency batches.
+
+    Every batch is saved with one bulk insert, and the source watermark moves forward in the
+    same transaction, so an interrupted run resumes after the last saved batch.
+    """
+
+    def __init__(self, batch_size=25, concurrency=8, options=None, lock_dir=None):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.options = {'summary_style': 'detailed', 'output_language': 'english', 'reply_tone': 'professional',
+                        **(options or {})}
+        self.lock_dir = lock_dir
+
+    @classmethod
+    def from_env(cls, **overrides):
+        settings = dict(
+            batch_size=int(os.getenv('INGEST_BATCH_SIZE', 25)),
+            concurrency=int(os.getenv('INGEST_CONCURRENCY', 8)),
+            lock_dir=os.getenv('INGEST_LOCK_DIR') or None,
+        )
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**settings)
+
+    def _lock(self, source):
+        """Exclusive lock for one source across processes, or None if another process holds it."""
+        from app import app
+        if fcntl is None:
+            return open(os.devnull)
+        lock_dir = self.lock_dir or os.path.join(app.instance_path, 'ingest_locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        handle = open(os.path.join(lock_dir, hashlib.sha1(source.key.encode()).hexdigest() + '.lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+        return handle
+
+    def run(self, spec, limit=None):
+        """Ingest the messages added to a source since the last run. Returns counts."""
+        from app import app, db
+        from models import IngestWatermark, IngestedFile
+
+        source = source_for(spec)
+        stats = {'source': source.key, 'analyzed': 0, 'failed': 0, 'skipped': False}
+        lock = self._lock(source)
+        if lock is None:
+            logger.info(f"{source.key} is being ingested by another process")
+            return {**stats, 'skipped': True}
+
+        with lock, app.app_context():
+            watermark = db.session.get(IngestWatermark, source.key)
+            position = json.loads(watermark.position) if watermark else {}
+            files = None
+            if source.tracks_files:
+                files = {name for (name,) in db.session.query(IngestedFile.name).filter_by(source=source.key)}
+            batch = []
+            names = []
+            seen = 0
+            for message, position in source.messages(position, files):
+                batch.append((message_to_text(message), message_attachments(message) or None))
+                names.append(position.get('name'))
+                seen += 1
+                if len(batch) >= self.batch_size:
+                    self._save_batch(source, batch, position, stats, names)
+                    batch, names = [], []
+                if limit and seen >= limit:
+                    break
+            if batch:
+                self._save_batch(source, batch, position, stats, names)
+
+        if stats['analyzed'] or stats['failed']:
+            logger.info(f"Ingested {source.key}: {stats['analyzed']} analyzed, {stats['failed']} failed")
+        return stats
+
+    def _save_batch(self, source, batch, position, stats, names):
+        from app import db, analyze_items, save_results
+        from models import IngestWatermark, IngestedFile
+
+        results = analyze_items(batch, self.options, concurrency=self.concurrency)
+        succeeded, rows = save_results(batch, results)
+        failed = len(batch) - len(rows)
+
+        watermark = db.session.get(IngestWatermark, source.key)
+        if watermark is None:
+            watermark = IngestWatermark(source=source.key, messages=0, failed=0)
+            db.session.add(watermark)
+        watermark.position = json.dumps(position)
+        watermark.messages = (watermark.messages or 0) + len(rows)
+        watermark.failed = (watermark.failed or 0) + failed
+        watermark.updated_at = datetime.utcnow()
+        if source.tracks_files:
+            db.session.add_all([IngestedFile(source=source.key, name=name) for name in names])
+        db.session.commit()
+
+        stats['analyzed'] += len(rows)
+        stats['failed'] += failed
+        metrics.inc('emailwise_ingested_messages_total', len(rows), kind=source.kind, result='analyzed')
+        if failed:
+            metrics.inc('emailwise_ingested_messages_total', failed, kind=source.kind, result='failed')
+
+
+class IngestService:
+    """Background thread that ingests INGEST_SOURCES every INGEST_INTERVAL seconds.
+
+    Every gunicorn worker runs one; the per-source lock lets only one of them work on a
+    source at a time.
+    """
+
+    def __init__(self, ingestor, sources, interval=60.0):
+        self.ingestor = ingestor
+        self.sources = sources
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    @classmethod
+    def from_env(cls):
+        sources = [spec.strip() for spec in os.getenv('INGEST_SOURCES', '').split(',') if spec.strip()]
+        if not sources:
+            return None
+        return cls(Ingestor.from_env(), sources, interval=float(os.getenv('INGEST_INTERVAL', 60)))
+
+    def ensure_started(self):
+        """Start the polling thread in the current process (safe to call after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._loop, name='mailbox-ingest', daemon=True).start()
+            self._started_pid = pid
+            logger.info(f"Polling {len(self.sources)} mailbox sources every {self.interval:g}s")
+
+    def _loop(self):
+        while True:
+            for spec in self.sources:
+                try:
+                    self.ingestor.run(spec)
+                except Exception as e:
+                    logger.error(f"Ingesting {spec} failed: {str(e)}")
+            time.sleep(self.interval)
+
+
+def _print_status():
+    from app import app, db
+    from models import IngestWatermark
+    with app.app_context():
+        marks = db.session.query(IngestWatermark).order_by(IngestWatermark.source).all()
+    if not marks:
+        print("No sources ingested yet")
+    for mark in marks:
+        print(f"{mark.source}\n    {mark.messages} analyzed, {mark.failed} failed, "
+              f"last run {mark.updated_at:%Y-%m-%d %H:%M:%S}, position {mark.position}")
+
+
+def _reset(specs):
+    from app import app, db
+    from models import IngestWatermark, IngestedFile
+    with app.app_context():
+        for spec in specs:
+            key = source_for(spec).key
+            deleted = db.session.query(IngestWatermark).filter_by(source=key).delete()
+            db.session.query(IngestedFile).filter_by(source=key).delete()
+            print(f"{key}: {'reset' if deleted else 'no watermark'}")
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('run', 'watch'):
+        command = commands.add_parser(name)
+        command.add_argument('sources', nargs='+')
+        command.add_argument('--limit', type=int, help='stop after this many messages per source')
+        command.add_argument('--batch-size', type=int)
+        command.add_argument('--concurrency', type=int)
+        command.add_argument('--summary-style', default='detailed')
+        command.add_argument('--language', default='english')
+        command.add_argument('--tone', default='professional')
+        if name == 'watch':
+            command.add_argument('--interval', type=float, default=60.0)
+    commands.add_parser('status')
+    commands.add_parser('reset').add_argument('sources', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        return _print_status()
+    if args.command == 'reset':
+        return _reset(args.sources)
+
+    ingestor = Ingestor.from_env(
+        batch_size=args.batch_size, concurrency=args.concurrency,
+        options={'summary_style': args.summary_style, 'output_language': args.language, 'reply_tone': args.tone},
+    )
+    while True:
+        for spec in args.sources:
+            stats = ingestor.run(spec, limit=args.limit)
+            print(f"{stats['source']}: {stats['analyzed']} analyzed, {stats['failed']} failed"
+                  f"{' (locked by another process)' if stats['skipped'] else ''}")
+        if args.command == 'run':
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
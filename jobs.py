@@ -0,0 +1,227 @@
+import os
+import io
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('done', 'failed')
+
+
+class JobQueue:
+    """Persistent analysis job queue backed by the AnalysisJob table.
+
+    Jobs survive restarts: any worker process can claim a queued job, and jobs
+    left 'running' by a crashed worker are re-queued after JOB_STALE_SECONDS.
+    """
+
+    def __init__(self, app, analyzer, workers=2, spool_dir=None, poll_interval=2.0,
+                 stale_seconds=600, max_attempts=3):
+        self.app = app
+        self.analyzer = analyzer
+        self.workers = workers
+        self.spool_dir = spool_dir or os.path.join(app.instance_path, 'job_spool')
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._last_recovery = 0.0
+
+    @classmethod
+    def from_env(cls, app, analyzer):
+        return cls(
+            app, analyzer,
+            workers=int(os.getenv('JOB_WORKERS', 2)),
+            spool_dir=os.getenv('JOB_SPOOL_DIR') or None,
+            poll_interval=float(os.getenv('JOB_POLL_INTERVAL', 2.0)),
+            stale_seconds=int(os.getenv('JOB_STALE_SECONDS', 600)),
+        )
+
+    def ensure_started(self):
+        """Start worker threads in the current process (safe to call after a fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'analysis-job-{i}', daemon=True)
+                thread.start()
+            self._started_pid = pid
+            logger.info(f"Started {self.workers} analysis job workers in process {pid}")
+
+    def enqueue(self, email_content, attachments=None, **options):
+        """Persist a job (spooling attachment bytes to disk) and return its id."""
+        from app import db
+        from models import AnalysisJob
+
+        job_id = uuid.uuid4().hex
+        spooled = []
+        if attachments:
+            job_dir = os.path.join(self.spool_dir, job_id)
+            os.makedirs(job_dir, exist_ok=True)
+            for index, file in enumerate(attachments):
+                path = os.path.join(job_dir, f"{index}_{secure_filename(file.filename) or 'attachment'}")
+                file.save(path)
+                spooled.append({'filename': file.filename, 'path': path})
+
+        job = AnalysisJob(
+            id=job_id,
+            status='queued',
+            payload=json.dumps({'email_content': email_content, 'options': options, 'attachments': spooled}),
+            created_at=datetime.utcnow(),
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self.ensure_started()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return the public view of a job, or None if it does not exist."""
+        from app import db
+        from models import AnalysisJob
+
+        # Drop identity-map state so repeated polling in one request sees fresh rows
+        db.session.expire_all()
+        job = db.session.get(AnalysisJob, job_id)
+        if job is None:
+            return None
+        db.session.commit()
+        return self.to_dict(job)
+
+    @staticmethod
+    def to_dict(job):
+        data = {
+            'id': job.id,
+            'status': job.status,
+            'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+            'started_at': job.started_at.strftime('%Y-%m-%d %H:%M:%S') if job.started_at else None,
+            'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+        }
+        if job.status == 'done':
+            data['summary_id'] = job.summary_id
+            data['data'] = json.loads(job.result) if job.result else {}
+        elif job.status == 'failed':
+            data['error'] = job.error
+        return data
+
+    def depth(self):
+        """Number of jobs waiting to be picked up."""
+        from app import db
+        from models import AnalysisJob
+
+        with self.app.app_context():
+            return db.session.query(AnalysisJob).filter(AnalysisJob.status == 'queued').count()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    job_id = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+                        continue
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running; returns its id or None."""
+        from app import db
+        from models import AnalysisJob
+
+        self._recover_stale()
+
+        candidates = (
+            db.session.query(AnalysisJob.id)
+            .filter(AnalysisJob.status == 'queued')
+            .order_by(AnalysisJob.created_at)
+            .limit(5)
+            .all()
+        )
+        for (job_id,) in candidates:
+            claimed = (
+                db.session.query(AnalysisJob)
+                .filter(AnalysisJob.id == job_id, AnalysisJob.status == 'queued')
+                .update({
+                    'status': 'running',
+                    'started_at': datetime.utcnow(),
+                    'attempts': AnalysisJob.attempts + 1,
+                }, synchronize_session=False)
+            )
+            db.session.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def _recover_stale(self):
+        """Re-queue jobs whose worker died mid-run (or fail them after max_attempts)."""
+        from app import db
+        from models import AnalysisJob
+
+        now = time.time()
+        if now - self._last_recovery < self.stale_seconds / 4:
+            return
+        self._last_recovery = now
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        stale = (
+            db.session.query(AnalysisJob)
+            .filter(AnalysisJob.status == 'running', AnalysisJob.started_at < cutoff)
+        )
+        stale.filter(AnalysisJob.attempts < self.max_attempts).update(
+            {'status': 'queued'}, synchronize_session=False)
+        stale.filter(AnalysisJob.attempts >= self.max_attempts).update(
+            {'status': 'failed', 'error': 'Job timed out', 'finished_at': datetime.utcnow()},
+            synchronize_session=False)
+        db.session.commit()
+
+    def _run(self, job_id):
+        from app import db, build_summary
+        from models import AnalysisJob
+
+        job = db.session.get(AnalysisJob, job_id)
+        payload = json.loads(job.payload)
+        email_content = payload['email_content']
+        attachments = []
+        for item in payload.get('attachments', []):
+            if os.path.exists(item['path']):
+                with open(item['path'], 'rb') as f:
+                    attachments.append(FileStorage(stream=io.BytesIO(f.read()), filename=item['filename']))
+
+        try:
+            analysis_data = self.analyzer.analyze_email(
+                email_content, attachments=attachments or None, **payload.get('options', {})
+            )
+            summary = build_summary(email_content, analysis_data)
+            db.session.add(summary)
+            db.session.flush()
+
+            analysis_data['risk_assessment'] = analysis_data.get('decision_helper', {})
+            job.status = 'done'
+            job.summary_id = summary.id
+            job.result = json.dumps(analysis_data)
+            logger.info(f"Job {job_id} finished with summary ID: {summary.id}")
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(AnalysisJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Job {job_id} failed: {str(e)}")
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
@@ -0,0 +1,345 @@
+import os
+import time
+import random
+import logging
+import asyncio
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Keep in step with gunicorn_config.timeout: an API call must give up early enough
+# for the request to fall back to local analysis before the worker is killed
+WORKER_TIMEOUT = float(os.getenv('GUNICORN_TIMEOUT', 120))
+
+
+def retryable_errors():
+    """SDK exceptions worth retrying; openai is imported on first use to keep app startup light."""
+    import openai
+    return (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: open after N failures, one probe call after the cooldown."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """End a probe that told us nothing about upstream health."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    metrics.inc('emailwise_upstream_breaker_opens_total')
+                    logger.warning(f"OpenAI circuit breaker opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def gauge(self):
+        """emailwise_upstream_breaker_state samples: 1 for the current state, 0 for the others."""
+        with self._lock:
+            state = self.state
+        return [({'state': name}, 1 if name == state else 0) for name in ('closed', 'half_open', 'open')]
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)) if self.state == 'open' else 0.0
+            return {'state': self.state, 'consecutive_failures': self.failures,
+                    'times_opened': self.times_opened, 'retry_in_seconds': round(retry_in, 1)}
+
+
+def _options_from_env():
+    """(httpx client settings, ResilientClient options) shared by the sync and async clients."""
+    import httpx
+    deadline = float(os.getenv('OPENAI_DEADLINE', WORKER_TIMEOUT * 0.6))
+    max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', 64))
+    attempt_timeout = float(os.getenv('OPENAI_ATTEMPT_TIMEOUT', min(60.0, deadline)))
+    http = dict(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv('OPENAI_MAX_KEEPALIVE', 32)),
+            keepalive_expiry=float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 60)),
+        ),
+        timeout=httpx.Timeout(attempt_timeout, connect=float(os.getenv('OPENAI_CONNECT_TIMEOUT', 5))),
+    )
+    options = dict(
+        deadline=deadline,
+        attempt_timeout=attempt_timeout,
+        max_retries=int(os.getenv('OPENAI_MAX_RETRIES', 2)),
+        backoff_base=float(os.getenv('OPENAI_BACKOFF_BASE', 0.5)),
+        backoff_cap=float(os.getenv('OPENAI_BACKOFF_CAP', 8)),
+        hedge_after=float(os.getenv('OPENAI_HEDGE_AFTER', 0)),
+        hedge_max_ratio=float(os.getenv('OPENAI_HEDGE_MAX_RATIO', 0.1)),
+        # Every hedged call runs on a pool thread, so a pool smaller than the connection
+        # pool would cap concurrent API calls below what the HTTP client allows
+        hedge_workers=int(os.getenv('OPENAI_HEDGE_WORKERS', max_connections)),
+    )
+    return http, options
+
+
+def breaker_from_env():
+    return CircuitBreaker(
+        failure_threshold=int(os.getenv('OPENAI_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.getenv('OPENAI_BREAKER_COOLDOWN', 30)),
+    )
+
+
+class ResilientClient:
+    """Wraps an OpenAI client with per-call deadlines, jittered retries, hedging and a circuit breaker.
+
+    Exposes the same ``chat.completions.create(**kwargs)`` entry point as the SDK client, so
+    callers do not change. Streaming calls are retried only until the stream is opened and
+    are never hedged.
+    """
+
+    hedge_in_threads = True
+
+    def __init__(self, client, deadline=90.0, attempt_timeout=60.0, max_retries=2, backoff_base=0.5,
+                 backoff_cap=8.0, hedge_after=0.0, hedge_max_ratio=0.1, hedge_workers=64, breaker=None):
+        self.client = client
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+        self.hedge_max_ratio = hedge_max_ratio
+        self.breaker = breaker or CircuitBreaker()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self._hedge_pool = (ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='openai-hedge')
+                            if hedge_after > 0 and self.hedge_in_threads else None)
+        self._retryable = retryable_errors()
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'succeeded': 0, 'failed': 0, 'retries': 0, 'short_circuited': 0,
+                       'hedges_launched': 0, 'hedges_won': 0, 'retry_reasons': {}}
+
+    @classmethod
+    def from_env(cls, api_key, breaker=None):
+        from openai import OpenAI, DefaultHttpxClient
+        http, options = _options_from_env()
+        # One pooled HTTP client per process, shared by all request and job threads.
+        # OPENAI_BASE_URL points the client at any OpenAI-compatible server (e.g. benchmarks/fake_openai.py)
+        client = OpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None,
+                        http_client=DefaultHttpxClient(**http), max_retries=0)
+        return cls(client, breaker=breaker or breaker_from_env(), **options)
+
+    # Stats keys mirrored to Prometheus counters as (metric, labels)
+    _METRICS = {
+        'succeeded': ('emailwise_upstream_calls_total', {'result': 'succeeded'}),
+        'failed': ('emailwise_upstream_calls_total', {'result': 'failed'}),
+        'short_circuited': ('emailwise_upstream_calls_total', {'result': 'short_circuited'}),
+        'hedges_launched': ('emailwise_upstream_hedges_total', {'result': 'launched'}),
+        'hedges_won': ('emailwise_upstream_hedges_total', {'result': 'won'}),
+    }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+        if key in self._METRICS:
+            name, labels = self._METRICS[key]
+            metrics.inc(name, amount, **labels)
+
+    def _retry_delay(self, attempt, error):
+        """Full-jitter exponential backoff; a server's Retry-After wins when it is longer."""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def _attempt(self, kwargs, timeout):
+        return self.client.chat.completions.create(**kwargs, timeout=timeout)
+
+    def _hedged_attempt(self, kwargs, timeout):
+        """Send a duplicate request if the first has not answered after hedge_after seconds."""
+        with self._lock:
+            may_hedge = self._stats['hedges_launched'] < self.hedge_max_ratio * max(self._stats['calls'], 1)
+        primary = self._hedge_pool.submit(self._attempt, kwargs, timeout)
+        done, _ = wait([primary], timeout=min(self.hedge_after, timeout))
+        if done or not may_hedge:
+            return primary.result()
+
+        self._count('hedges_launched')
+        hedge = self._hedge_pool.submit(self._attempt, kwargs, max(timeout - self.hedge_after, 1.0))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedges_won')
+                    # The slower request finishes in the background; its result is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _start_call(self):
+        """Count the call and return its deadline, or raise when the breaker is open."""
+        self._count('calls')
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise CircuitOpenError("OpenAI circuit breaker is open")
+        return time.monotonic() + self.deadline
+
+    def _succeeded(self):
+        self.breaker.record_success()
+        self._count('succeeded')
+
+    def _retry_delay_or_raise(self, attempt, error, deadline):
+        """Seconds to wait before retry number attempt + 1; re-raises when out of retries or time."""
+        import openai
+        reason = str(getattr(error, 'status_code', None) or type(error).__name__)
+        if isinstance(error, openai.APITimeoutError):
+            metrics.inc('emailwise_upstream_timeouts_total')
+        delay = self._retry_delay(attempt, error)
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            self.breaker.record_failure()
+            self._count('failed')
+            raise error
+        with self._lock:
+            self._stats['retries'] += 1
+            self._stats['retry_reasons'][reason] = self._stats['retry_reasons'].get(reason, 0) + 1
+        metrics.inc('emailwise_upstream_retries_total', reason=reason)
+        logger.warning(f"OpenAI call failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    def _failed(self, error):
+        import openai
+        if isinstance(error, openai.APIStatusError):
+            # A 4xx answer (bad request, auth) means the upstream itself is reachable
+            self.breaker.record_success()
+        else:
+            self.breaker.release()
+        self._count('failed')
+
+    def create(self, **kwargs):
+        """chat.completions.create with deadline, retries, hedging and the breaker applied."""
+        deadline = self._start_call()
+        hedge = self._hedge_pool is not None and not kwargs.get('stream')
+        attempt = 0
+        while True:
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            try:
+                response = self._hedged_attempt(kwargs, timeout) if hedge else self._attempt(kwargs, timeout)
+                self._succeeded()
+                return response
+            except self._retryable as e:
+                time.sleep(self._retry_delay_or_raise(attempt, e, deadline))
+                attempt += 1
+            except Exception as e:
+                self._failed(e)
+                raise
+
+    def snapshot(self):
+        with self._lock:
+            stats = {**self._stats, 'retry_reasons': dict(self._stats['retry_reasons'])}
+        return {
+            **stats,
+            'breaker': self.breaker.snapshot(),
+            'deadline_seconds': self.deadline,
+            'max_retries': self.max_retries,
+            'hedge_after_seconds': self.hedge_after,
+        }
+
+
+class AsyncResilientClient(ResilientClient):
+    """ResilientClient for AsyncOpenAI: the same deadlines, retries, hedging and breaker, but
+    ``await client.chat.completions.create(**kwargs)`` and the slower hedged request is cancelled."""
+
+    hedge_in_threads = False
+
+    @classmethod
+    def from_env(cls, api_key, breaker=None):
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        http, options = _options_from_env()
+        client = AsyncOpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None,
+                             http_client=DefaultAsyncHttpxClient(**http), max_retries=0)
+        return cls(client, breaker=breaker or breaker_from_env(), **options)
+
+    async def _attempt(self, kwargs, timeout):
+        return await self.client.chat.completions.create(**kwargs, timeout=timeout)
+
+    async def _hedged_attempt(self, kwargs, timeout):
+        with self._lock:
+            may_hedge = self._stats['hedges_launched'] < self.hedge_max_ratio * max(self._stats['calls'], 1)
+        primary = asyncio.ensure_future(self._attempt(kwargs, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=min(self.hedge_after, timeout))
+        if done or not may_hedge:
+            return await primary
+
+        self._count('hedges_launched')
+        hedge = asyncio.ensure_future(self._attempt(kwargs, max(timeout - self.hedge_after, 1.0)))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedges_won')
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def create(self, **kwargs):
+        deadline = self._start_call()
+        hedge = self.hedge_after > 0 and not kwargs.get('stream')
+        attempt = 0
+        while True:
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            try:
+                response = await (self._hedged_attempt(kwargs, timeout) if hedge else self._attempt(kwargs, timeout))
+                self._succeeded()
+                return response
+            except self._retryable as e:
+                await asyncio.sleep(self._retry_delay_or_raise(attempt, e, deadline))
+                attempt += 1
+            except asyncio.CancelledError:
+                # The client went away; this says nothing about upstream health
+                self.breaker.release()
+                raise
+            except Exception as e:
+                self._failed(e)
+                raise
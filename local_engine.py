@@ -0,0 +1,570 @@
+import re
+import math
+import calendar
+import numpy as np
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+
+# ---------------------------------------------------------------------------
+# Text cleanup and sentence splitting
+# ---------------------------------------------------------------------------
+
+_HEADER_RE = re.compile(r'^(?:From|To|Cc|Bcc|Sent|Date|Subject|Reply-To):.*$', re.MULTILINE | re.IGNORECASE)
+_SUBJECT_RE = re.compile(r'^Subject:[ \t]*(.+)$', re.MULTILINE | re.IGNORECASE)
+_DATE_HEADER_RE = re.compile(r'^(?:Date|Sent):[ \t]*(.+)$', re.MULTILINE | re.IGNORECASE)
+_QUOTED_RE = re.compile(r'^[ \t]*>.*$', re.MULTILINE)
+_REPLY_HEADER_RE = re.compile(r'^On .{1,200}wrote:\s*$', re.MULTILINE | re.IGNORECASE)
+_SIGNOFF_RE = re.compile(
+    r'^(?:thanks|thank you|best|regards|best regards|kind regards|cheers|sincerely|sent from my \w+)[ ,!.]*$',
+    re.IGNORECASE
+)
+_GREETING_RE = re.compile(r'^(?:hi|hello|hey|dear|good (?:morning|afternoon|evening))\b[^.!?\n]{0,40}[,!]?$', re.IGNORECASE)
+_BULLET_RE = re.compile(r'^\s*(?:[-*•]|\d{1,2}[.)])\s+(.+)$')
+# Sentence ends are punctuation followed by whitespace, so '2.3' and URLs stay whole
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+_WORD_RE = re.compile(r"[a-z][a-z'’]+")
+_URL_RE = re.compile(r'https?://\S+|www\.\S+', re.IGNORECASE)
+_CAPS_WORD_RE = re.compile(r'\b[A-Z]{3,}\b')
+_ANY_WORD_RE = re.compile(r'\b[A-Za-z]{3,}\b')
+
+_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my myself no nor not now of off on once only or
+other our ours out over own same she should so some such than that the their theirs them then there these they
+this those through to too under until up very was we were what when where which while who whom why will with
+would you your yours yourself also get got let us im ive dont thats hi hello thanks thank regards best please
+""".split())
+
+
+def _stem(word):
+    """Very light suffix stripping so 'invoices'/'invoice' share a term."""
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _own_text(content):
+    """The newest message's text without headers, quoted replies and the quoted chain below it."""
+    match = _REPLY_HEADER_RE.search(content)
+    text = content[:match.start()] if match else content
+    text = _HEADER_RE.sub('', text)
+    text = _QUOTED_RE.sub('', text)
+    return text if text.strip() else _HEADER_RE.sub('', content)
+
+
+def split_sentences(text, max_sentences=200):
+    """Sentences and bullet lines of a body, skipping greetings and sign-offs."""
+    sentences = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or _GREETING_RE.match(line) or _SIGNOFF_RE.match(line):
+            continue
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            sentences.append(bullet.group(1).strip())
+            continue
+        for sentence in _SENTENCE_END_RE.split(line):
+            sentence = sentence.strip()
+            if len(sentence) > 3:
+                sentences.append(sentence)
+        if len(sentences) >= max_sentences:
+            break
+    return sentences[:max_sentences]
+
+
+# ---------------------------------------------------------------------------
+# Extractive summarization (TF-IDF sentence vectors + TextRank)
+# ---------------------------------------------------------------------------
+
+def rank_sentences(sentences, damping=0.85, iterations=30):
+    """Score sentences with TextRank over TF-IDF cosine similarity, plus a lead-position prior."""
+    count = len(sentences)
+    if count == 0:
+        return np.zeros(0)
+    if count == 1:
+        return np.ones(1)
+
+    vocabulary = {}
+    rows, cols = [], []
+    for index, sentence in enumerate(sentences):
+        for word in _WORD_RE.findall(sentence.lower()):
+            if word in _STOPWORDS:
+                continue
+            rows.append(index)
+            cols.append(vocabulary.setdefault(_stem(word), len(vocabulary)))
+    if not vocabulary:
+        return np.linspace(1.0, 0.5, count)
+
+    tf = np.zeros((count, len(vocabulary)), dtype=np.float32)
+    np.add.at(tf, (np.asarray(rows), np.asarray(cols)), 1.0)
+    df = np.count_nonzero(tf, axis=0)
+    weights = np.log1p(tf) * (np.log((1 + count) / (1 + df)) + 1.0)
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = weights / norms
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0.0)
+    out_weight = similarity.sum(axis=1, keepdims=True)
+    out_weight[out_weight == 0] = 1.0
+    transition = (similarity / out_weight).T
+
+    scores = np.full(count, 1.0 / count, dtype=np.float32)
+    for _ in range(iterations):
+        scores = (1 - damping) / count + damping * (transition @ scores)
+
+    # The opening of the newest message usually carries the point of the email
+    position = 1.0 + 0.5 / np.sqrt(np.arange(1, count + 1))
+    return scores * count * position
+
+
+def summarize(sentences, style='detailed'):
+    """Top-ranked sentences in document order: a bullet list for 'detailed', a short paragraph otherwise."""
+    limit = {'quick': 2, 'brief': 3}.get(style, 5)
+    if not sentences:
+        return 'No summary available.' if style in ('quick', 'brief') else []
+    scores = rank_sentences(sentences)
+    chosen = sorted(np.argsort(-scores)[:limit])
+    picked = [sentences[index] for index in chosen]
+    if style in ('quick', 'brief'):
+        return ' '.join(sentence if sentence[-1] in '.!?' else sentence + '.' for sentence in picked)
+    return picked
+
+
+# ---------------------------------------------------------------------------
+# Deadline extraction
+# ---------------------------------------------------------------------------
+
+_MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+_MONTHS['sept'] = 9
+_WEEKDAYS = {name.lower(): index for index, name in enumerate(calendar.day_name)}
+_WEEKDAYS.update({name.lower(): index for index, name in enumerate(calendar.day_abbr)})
+
+_MONTH_P = r'(?P<month>' + '|'.join(sorted(_MONTHS, key=len, reverse=True)) + r')\.?'
+_WEEKDAY_P = r'(?P<weekday>' + '|'.join(sorted(_WEEKDAYS, key=len, reverse=True)) + r')\.?'
+_DAY_P = r'(?P<day>[0-3]?\d)(?:st|nd|rd|th)?'
+
+_DATE_PATTERNS = [
+    ('iso', rf'(?P<year>\d{{4}})-(?P<month>\d{{1,2}})-(?P<day>\d{{1,2}})'),
+    ('numeric', r'(?P<month>[01]?\d)/(?P<day>[0-3]?\d)(?:/(?P<year>\d{2,4}))?'),
+    ('month_day', rf'{_MONTH_P}\s+{_DAY_P}(?:,?\s+(?P<year>\d{{4}}))?'),
+    ('day_month', rf'{_DAY_P}\s+(?:of\s+)?{_MONTH_P}(?:,?\s+(?P<year>\d{{4}}))?'),
+    ('weekday', rf'(?P<rel>next|this|coming)?\s*{_WEEKDAY_P}'),
+    ('today', r'today|tonight|eod|end of (?:the )?day|cob|close of business|by noon'),
+    ('tomorrow', r'tomorrow'),
+    ('end_week', r'end of (?:the |this )?week|eow|this week'),
+    ('next_week', r'next week'),
+    ('end_month', r'end of (?:the |this )?month|eom'),
+    ('within', r'(?:within|in)\s+(?P<amount>\d{1,3}|a|one|two|three|few)\s+(?P<unit>hour|day|business day|week|month)s?'),
+    ('asap', r'asap|as soon as possible|immediately|right away'),
+]
+_INNER_GROUP_RE = re.compile(r'\(\?P<\w+>')
+# Group names must be unique in one pattern: the combined scanner only names each kind,
+# and every kind keeps its own compiled copy to pull out the parts
+_DATE_RE = re.compile(
+    r'(?<!\w)(?=[a-z0-9])(?:' + '|'.join(f'(?P<{name}>{_INNER_GROUP_RE.sub("(?:", pattern)})' for name, pattern in _DATE_PATTERNS) + r')\b'
+)
+_PART_RES = {name: re.compile(rf'^(?:{pattern})$', re.IGNORECASE) for name, pattern in _DATE_PATTERNS}
+_DEADLINE_CUE_RE = re.compile(
+    r'\b(?:by|before|due|until|no later than|deadline|expires?|expiring|submit|send|deliver|complete|finish|'
+    r'respond|reply|pay|renew|confirm|need|required|must|latest)\b',
+    re.IGNORECASE
+)
+_NUMBER_WORDS = {'a': 1, 'one': 1, 'two': 2, 'three': 3, 'few': 3}
+
+
+def reference_date(content):
+    """The email's own Date: header when parseable, else now (so 'tomorrow' resolves correctly)."""
+    match = _DATE_HEADER_RE.search(content)
+    if match:
+        try:
+            return parsedate_to_datetime(match.group(1).strip()).replace(tzinfo=None)
+        except (TypeError, ValueError, IndexError):
+            pass
+    return datetime.now()
+
+
+def _safe_date(year, month, day):
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+
+def _resolve(kind, text, reference):
+    """Turn one matched date expression into a datetime relative to the reference date."""
+    today = reference.replace(hour=0, minute=0, second=0, microsecond=0)
+    parts = _PART_RES[kind].match(text.strip())
+    groups = parts.groupdict() if parts else {}
+
+    if kind in ('iso', 'numeric', 'month_day', 'day_month'):
+        month = groups.get('month') or ''
+        month = int(month) if month.isdigit() else _MONTHS.get(month.lower().rstrip('.'))
+        if not month or not groups.get('day'):
+            return None
+        year = groups.get('year')
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            return _safe_date(year, month, int(groups['day']))
+        # A date without a year is the next occurrence of it
+        resolved = _safe_date(today.year, month, int(groups['day']))
+        if resolved and resolved < today - timedelta(days=30):
+            resolved = _safe_date(today.year + 1, month, int(groups['day']))
+        return resolved
+    if kind == 'weekday':
+        weekday = _WEEKDAYS.get(groups.get('weekday', '').lower().rstrip('.'))
+        if weekday is None:
+            return None
+        ahead = (weekday - today.weekday()) % 7 or 7
+        if (groups.get('rel') or '').lower() == 'next' and ahead < 7 and today.weekday() < weekday:
+            ahead += 7
+        return today + timedelta(days=ahead)
+    if kind in ('today', 'asap'):
+        return today
+    if kind == 'tomorrow':
+        return today + timedelta(days=1)
+    if kind == 'end_week':
+        return today + timedelta(days=(4 - today.weekday()) % 7)
+    if kind == 'next_week':
+        return today + timedelta(days=7 - today.weekday())
+    if kind == 'end_month':
+        return today.replace(day=calendar.monthrange(today.year, today.month)[1])
+    if kind == 'within':
+        amount = groups.get('amount', '1').lower()
+        amount = int(amount) if amount.isdigit() else _NUMBER_WORDS.get(amount, 1)
+        unit = groups.get('unit', 'day').lower()
+        days = {'hour': amount / 24, 'day': amount, 'business day': amount * 7 / 5,
+                'week': amount * 7, 'month': amount * 30}[unit]
+        return today + timedelta(days=math.ceil(days))
+    return None
+
+
+def extract_deadlines(sentences, reference, limit=5):
+    """Date mentions with their resolved date, deadline-like ones first.
+
+    Returns (labels, days until the nearest deadline or None).
+    """
+    found = []
+    seen = set()
+    for position, sentence in enumerate(sentences):
+        cue = bool(_DEADLINE_CUE_RE.search(sentence))
+        for match in _DATE_RE.finditer(sentence.lower()):
+            kind = match.lastgroup
+            resolved = _resolve(kind, match.group(0), reference)
+            if resolved is None or (kind == 'asap' and not cue):
+                continue
+            key = resolved.date()
+            if key in seen:
+                continue
+            seen.add(key)
+            context = sentence if len(sentence) <= 90 else sentence[:87].rstrip() + '...'
+            found.append((not cue, position, resolved, f"{context} ({resolved:%a %Y-%m-%d})", cue))
+
+    found.sort(key=lambda item: (item[0], item[1]))
+    today = reference.replace(hour=0, minute=0, second=0, microsecond=0)
+    upcoming = [(item[2] - today).days for item in found if item[4]]
+    nearest = min(upcoming) if upcoming else None
+    return [item[3] for item in found[:limit]], nearest
+
+
+# ---------------------------------------------------------------------------
+# Action items
+# ---------------------------------------------------------------------------
+
+_ACTION_VERBS = (
+    'send|review|approve|sign|submit|confirm|update|schedule|call|email|prepare|share|check|complete|finish|'
+    'fix|pay|book|reply|respond|forward|upload|provide|attach|follow up|set up|let me know|make sure|remember|'
+    'ensure|verify|join|attend|register|fill out|read|draft|arrange|contact|renew|cancel|deliver'
+)
+_ACTION_RE = re.compile(
+    rf'^(?:(?:please|kindly|pls)\s+|(?:can|could|would|will) you\s+(?:please\s+)?|'
+    rf'(?:i|we) (?:need|would like|want) you to\s+|you (?:need|have|must) to\s+|'
+    rf"(?:don'?t|do not) forget to\s+|action required:?\s*)?(?:{_ACTION_VERBS})\b",
+    re.IGNORECASE
+)
+_ACTION_CUE_RE = re.compile(
+    r'\b(?:please|kindly|can you|could you|would you|need(?:s)? (?:you )?to|must|action required|'
+    r'make sure|don\'?t forget|remember to|to-?do|follow up)\b',
+    re.IGNORECASE
+)
+
+
+def extract_action_items(text, sentences, limit=5):
+    """Bullet points and imperative/request sentences, in document order."""
+    items = []
+    seen = set()
+
+    def add(item):
+        item = item.strip().rstrip('.').strip()
+        key = item.lower()
+        if 3 < len(item) <= 200 and key not in seen:
+            seen.add(key)
+            items.append(item if len(item) <= 140 else item[:137].rstrip() + '...')
+
+    for line in text.split('\n'):
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            add(bullet.group(1))
+    for sentence in sentences:
+        if _ACTION_RE.match(sentence) or (_ACTION_CUE_RE.search(sentence) and not sentence.endswith('?')):
+            add(sentence)
+    return items[:limit]
+
+
+# ---------------------------------------------------------------------------
+# Linear scoring models (urgency, intent, sentiment, spam)
+# ---------------------------------------------------------------------------
+
+# Keyword groups are matched in one pass; counts become log1p features
+_KEYWORD_GROUPS = {
+    'urgent': r'urgent(?:ly)?|asap|immediately|right away|critical|emergency|time[- ]sensitive|high priority|top priority|as soon as possible',
+    'deadline': r'deadline|due|no later than|overdue|expir(?:es|ed|ing|ation)|final notice|last chance',
+    'incident': r'outage|down(?:time)?|incident|failure|failed|broken|crash(?:ed|ing)?|breach|escalat\w*|blocker|sev[- ]?[12]',
+    'request': r'please|kindly|could you|can you|would you|will you|i need|we need|need you to|let me know|make sure|requir(?:ed|es)|request(?:ing|ed)?',
+    'inquiry': r'wondering|curious|question|clarif\w+|is there|are there|do you know|any idea|what|how|why|which',
+    'complaint': r'disappoint\w*|unacceptable|frustrat\w*|complain\w*|poor service|terrible|worst|refund|not happy|unhappy|still waiting|never received|not working',
+    'update': r'update[ds]?|fyi|for your information|heads up|status|progress|completed|finished|shipped|released|announc\w*|newsletter|summary|report|recap',
+    'positive': r'thanks|thank you|great|appreciate\w*|glad|happy|excellent|awesome|congrat\w*|pleased|well done|love|wonderful',
+    'negative': r'unfortunately|sorry|problem|issue|concern\w*|delay(?:ed|s)?|mistake|wrong|bad|worried|regret|cannot|can\'t',
+    'angry': r'furious|outrage\w*|ridiculous|unacceptable|absurd|sick of|fed up|how dare|demand|immediately or',
+    'spam_money': r'free|winner|won|prize|lottery|million|cash|bitcoin|crypto|investment opportunity|100% free|risk[- ]free|guaranteed|earn \$\d+|double your',
+    'spam_action': r'click here|click below|act now|limited time|order now|buy now|claim (?:your|now)|verify your (?:account|identity|password)|confirm your (?:account|password|details)|update your (?:payment|billing)',
+    'spam_phish': r'password|login details|ssn|social security|bank account|wire transfer|gift cards?|account (?:suspended|locked|closed|compromised)',
+    'automated': r'no-?reply|do not reply|automated (?:message|email|notification)|this is an automated|notification|unsubscribe|opt[- ]out|view (?:it )?in (?:your )?browser|manage (?:your )?preferences|order confirmation|has (?:been )?shipped|receipt|verification code|password reset',
+    'cold_greeting': r'dear (?:friend|customer|sir|madam|user|beneficiary|account holder)',
+    'meeting': r'meeting|call|meet|schedule|calendar|invite|agenda|zoom|teams',
+}
+# Scanning lowercased text case-sensitively, anchored at word starts, is several times faster
+_KEYWORD_RE = re.compile(
+    r'(?<![\w$])(?=[a-z$0-9])(?:' + '|'.join(f'(?P<{name}>{pattern})' for name, pattern in _KEYWORD_GROUPS.items()) + r')\b'
+)
+FEATURES = list(_KEYWORD_GROUPS) + ['question', 'exclaim', 'caps', 'links', 'deadline_soon', 'bias']
+INTENTS = ['Request', 'Inquiry', 'Complaint', 'Update']
+SENTIMENTS = ['Positive', 'Neutral', 'Negative', 'Angry', 'Urgent']
+OUTPUTS = ['urgency'] + [f'intent:{name}' for name in INTENTS] + [f'sentiment:{name}' for name in SENTIMENTS] + ['spam']
+
+# Hand-set weights (feature -> {output: weight}); there is no labelled data to fit them on
+_WEIGHTS = {
+    'urgent': {'urgency': 2.2, 'sentiment:Urgent': 1.4, 'spam': 0.3},
+    'deadline': {'urgency': 0.9, 'intent:Request': 0.4, 'sentiment:Urgent': 0.4},
+    'incident': {'urgency': 1.4, 'sentiment:Negative': 0.6, 'sentiment:Urgent': 0.6},
+    'request': {'urgency': 0.3, 'intent:Request': 1.3},
+    'inquiry': {'intent:Inquiry': 0.6},
+    'complaint': {'urgency': 0.8, 'intent:Complaint': 1.8, 'sentiment:Negative': 0.8},
+    'update': {'intent:Update': 1.1, 'sentiment:Neutral': 0.2},
+    'positive': {'sentiment:Positive': 1.0, 'urgency': -0.3},
+    'negative': {'sentiment:Negative': 1.0, 'urgency': 0.3},
+    'angry': {'urgency': 1.0, 'intent:Complaint': 1.0, 'sentiment:Angry': 2.0},
+    'spam_money': {'spam': 1.3},
+    'spam_action': {'spam': 1.4},
+    'spam_phish': {'spam': 1.0},
+    'automated': {'urgency': -0.8, 'intent:Update': 0.8, 'spam': 0.2},
+    'cold_greeting': {'spam': 1.8},
+    'meeting': {'intent:Request': 0.3},
+    'question': {'intent:Inquiry': 1.2, 'intent:Request': 0.3},
+    'exclaim': {'urgency': 0.4, 'sentiment:Angry': 0.4, 'sentiment:Positive': 0.2, 'spam': 0.4},
+    'caps': {'urgency': 1.5, 'sentiment:Angry': 1.5, 'spam': 2.5},
+    'links': {'spam': 0.6},
+    'deadline_soon': {'urgency': 3.0, 'sentiment:Urgent': 0.8},
+    'bias': {'urgency': 2.0, 'intent:Update': 0.2, 'sentiment:Neutral': 0.7, 'spam': -3.5},
+}
+WEIGHTS = np.zeros((len(FEATURES), len(OUTPUTS)), dtype=np.float32)
+for _feature, _targets in _WEIGHTS.items():
+    for _output, _weight in _targets.items():
+        WEIGHTS[FEATURES.index(_feature), OUTPUTS.index(_output)] = _weight
+
+_SPAM_REASONS = {
+    'spam_money': 'prize/money bait',
+    'spam_action': 'pressure to click or act',
+    'spam_phish': 'requests credentials or payment details',
+    'cold_greeting': 'generic greeting',
+    'caps': 'excessive capitals',
+    'links': 'many links',
+    'urgent': 'artificial urgency',
+}
+
+
+def feature_row(text, nearest_deadline):
+    """One row of the feature matrix for an email body."""
+    counts = dict.fromkeys(_KEYWORD_GROUPS, 0)
+    for match in _KEYWORD_RE.finditer(text.lower()):
+        counts[match.lastgroup] += 1
+    words = len(_ANY_WORD_RE.findall(text)) or 1
+    row = [math.log1p(counts[name]) for name in _KEYWORD_GROUPS]
+    row += [
+        math.log1p(text.count('?')),
+        math.log1p(text.count('!')),
+        min(1.0, 4 * len(_CAPS_WORD_RE.findall(text)) / words),
+        math.log1p(len(_URL_RE.findall(text))),
+        0.0 if nearest_deadline is None else max(0.0, 1.0 - max(nearest_deadline, 0) / 7),
+        1.0,
+    ]
+    return row
+
+
+def _softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+# ---------------------------------------------------------------------------
+# Replies and decision helper
+# ---------------------------------------------------------------------------
+
+def _replies(tone, subject, action_items, deadlines, urgent, intent):
+    topic = f'"{subject}"' if subject and subject != 'No Subject' else 'this'
+    first_action = action_items[0][0].lower() + action_items[0][1:] if action_items else None
+    when = ' today' if urgent else ' shortly'
+    if tone == 'strict':
+        direct = f"Noted regarding {topic}. I will {'handle: ' + first_action if first_action else 'review it'} and confirm{when}."
+        alternative = "Received. Please send any remaining details in writing before I proceed."
+    elif tone == 'friendly':
+        direct = f"Thanks so much for the note about {topic}! I'm on it{' and will ' + first_action if first_action else ''} - I'll get back to you{when}."
+        alternative = "Got it, thanks! Could we grab a few minutes to go over the details together?"
+    else:
+        direct = f"Thank you for your email regarding {topic}. I will {'take care of the following: ' + first_action if first_action else 'review it'} and follow up{when}."
+        alternative = "Thank you for reaching out. Could you share a bit more detail so I can respond fully?"
+    if deadlines:
+        direct += " I have noted the timeline you mentioned."
+    if intent == 'Complaint':
+        alternative = "I'm sorry for the trouble this has caused. I'm looking into it now and will update you with a resolution."
+    return {
+        "option_1": {"label": "Direct Reply", "text": direct},
+        "option_2": {"label": "Alternative Strategy", "text": alternative},
+    }
+
+
+def _decision_helper(action_items, deadlines, nearest, spam_probability, intent, urgency):
+    pros, cons, risks = [], [], []
+    if action_items:
+        pros.append(f"{len(action_items)} clear action item{'s' if len(action_items) > 1 else ''} identified")
+        cons.append("Requires follow-up work")
+    if deadlines:
+        pros.append("Timeline is explicit")
+    if intent == 'Update':
+        pros.append("Informational - little or no action needed")
+    if intent == 'Complaint':
+        cons.append("Relationship may need repair")
+        risks.append("Escalation if the complaint is not addressed promptly")
+    if nearest is not None and nearest <= 2:
+        risks.append("Deadline is imminent" if nearest >= 0 else "Deadline may already have passed")
+    if urgency >= 8 and not deadlines:
+        risks.append("Urgent tone without an explicit deadline")
+    if spam_probability >= 0.5:
+        risks.append("Possible phishing or spam - verify the sender before acting")
+    if not cons:
+        cons.append("Local analysis may miss nuance")
+    if not risks:
+        risks.append("No significant risks detected")
+    return {"pros": pros or ["Straightforward message"], "cons": cons, "risks": risks}
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+
+class LocalAnalyzer:
+    """CPU-only analysis used offline and when the OpenAI API fails.
+
+    Per-email text work (sentence ranking, regex extraction) is done in Python/NumPy;
+    urgency, intent, sentiment and spam for a whole batch come from one matrix product.
+    """
+
+    def __init__(self, max_chars=20000):
+        self.max_chars = max_chars
+
+    def analyze(self, content, style="detailed", tone="professional"):
+        return self.analyze_batch([content], style, tone)[0]
+
+    def analyze_batch(self, contents, style="detailed", tone="professional"):
+        return [self.result_for(item, style, tone) for item in self.score_batch(contents)]
+
+    def score_batch(self, contents):
+        """Parse and score emails without building full results (used for routing as well).
+
+        Returns one dict per email with the parsed text, deadlines and the model outputs.
+        """
+        parsed = []
+        rows = []
+        for content in contents:
+            content = (content or '')[:self.max_chars]
+            subject_match = _SUBJECT_RE.search(content)
+            text = _own_text(content)
+            sentences = split_sentences(text)
+            deadlines, nearest = extract_deadlines(sentences, reference_date(content))
+            parsed.append({
+                'subject': subject_match.group(1).strip() if subject_match else None,
+                'text': text,
+                'sentences': sentences,
+                'deadlines': deadlines,
+                'nearest': nearest,
+                'words': len(_ANY_WORD_RE.findall(text)),
+            })
+            rows.append(feature_row(text, nearest))
+
+        features = np.asarray(rows, dtype=np.float32).reshape(len(rows), len(FEATURES))
+        outputs = features @ WEIGHTS
+        urgency = np.clip(np.rint(outputs[:, 0]), 1, 10).astype(int)
+        intents = _softmax(outputs[:, 1:1 + len(INTENTS)])
+        sentiments = _softmax(outputs[:, 1 + len(INTENTS):-1])
+        spam = 1.0 / (1.0 + np.exp(-outputs[:, -1]))
+
+        for index, item in enumerate(parsed):
+            item.update({
+                'features': features[index],
+                'urgency': int(urgency[index]),
+                'intent_probabilities': intents[index],
+                'intent': INTENTS[int(np.argmax(intents[index]))],
+                'sentiment': SENTIMENTS[int(np.argmax(sentiments[index]))],
+                'spam_probability': float(spam[index]),
+            })
+        return parsed
+
+    def feature(self, item, name):
+        """Raw (log1p) value of one named feature of a scored email."""
+        return float(item['features'][FEATURES.index(name)])
+
+    def result_for(self, item, style="detailed", tone="professional"):
+        """Full analysis result for one email returned by score_batch."""
+        features = item['features']
+        urgency = item['urgency']
+        intents = item['intent_probabilities']
+        intent = item['intent']
+        sentiment = item['sentiment']
+        spam_probability = item['spam_probability']
+        sentences = item['sentences']
+        summary = summarize(sentences, style)
+        action_items = extract_action_items(item['text'], sentences)
+        subject = item['subject'] or (sentences[0][:80] if sentences else 'No Subject')
+        is_spam = spam_probability >= 0.5
+
+        contributions = features * WEIGHTS[:, -1]
+        triggered = [_SPAM_REASONS[FEATURES[i]] for i in np.argsort(-contributions)[:3]
+                     if contributions[i] > 0.3 and FEATURES[i] in _SPAM_REASONS]
+        if is_spam:
+            reason = f"Spam signals: {', '.join(triggered) or 'suspicious wording'} ({spam_probability:.0%})."
+        else:
+            reason = f"No strong spam signals ({spam_probability:.0%} spam likelihood, local check)."
+
+        # Local confidence is capped well below what the model reports
+        confidence = int(round(35 + 40 * float(intents.max()) + min(10, len(sentences))))
+
+        return {
+            "summary": summary,
+            "action_items": action_items,
+            "deadlines": item['deadlines'],
+            "subject": subject,
+            "priority": "High" if urgency >= 7 else "Medium" if urgency >= 4 else "Low",
+            "sentiment": sentiment,
+            "suggested_replies": _replies(tone, subject, action_items, item['deadlines'], urgency >= 7, intent),
+            "intent": intent,
+            "urgency_score": urgency,
+            "confidence_score": min(confidence, 85),
+            "spam_analysis": {"is_spam": is_spam, "reason": reason},
+            "decision_helper": _decision_helper(action_items, item['deadlines'], item['nearest'],
+                                                spam_probability, intent, urgency),
+            "local": True,
+        }
@@ -0,0 +1,120 @@
+import io
+import re
+import html
+import logging
+from email import policy
+from email.parser import BytesFeedParser
+from werkzeug.datastructures import FileStorage
+
+logger = logging.getLogger(__name__)
+
+_MBOX_FROM_RE = re.compile(rb'^From \S+')
+_TAG_RE = re.compile(r'<[^>]+>')
+_STYLE_RE = re.compile(r'<(script|style)[^>]*>.*?</\1>', re.IGNORECASE | re.DOTALL)
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def _new_parser():
+    return BytesFeedParser(policy=policy.default)
+
+
+def iter_mbox_entries(stream, offset=0, end=None):
+    """Yield (message, end offset) pairs from an mbox stream positioned at offset.
+
+    The end offset is where the next message starts, so it can be stored as a
+    watermark and passed back to resume reading after that message. Reading stops
+    at end when given, ignoring anything appended after it.
+    """
+    parser = None
+    previous_blank = True
+    position = offset
+    for line in stream:
+        if end is not None:
+            if position >= end:
+                break
+            line = line[:end - position]
+        if previous_blank and _MBOX_FROM_RE.match(line):
+            if parser is not None:
+                yield parser.close(), position
+            parser = _new_parser()
+            previous_blank = False
+            position += len(line)
+            continue
+        position += len(line)
+        if parser is None:
+            # Content before the first "From " line: treat the stream as a single message
+            parser = _new_parser()
+        if line.startswith(b'>From '):
+            line = line[1:]
+        parser.feed(line)
+        previous_blank = line in (b'\n', b'\r\n')
+    if parser is not None:
+        yield parser.close(), position
+
+
+def iter_mbox_messages(stream):
+    """Yield messages from an mbox stream one at a time without reading the whole file."""
+    for message, _ in iter_mbox_entries(stream):
+        yield message
+
+
+def parse_eml(stream):
+    """Parse a single RFC 822 message from a binary stream."""
+    parser = _new_parser()
+    for block in iter(lambda: stream.read(65536), b''):
+        parser.feed(block)
+    return parser.close()
+
+
+def iter_bundle_messages(file):
+    """Yield messages from an uploaded .eml or mbox bundle."""
+    filename = (file.filename or '').lower()
+    if filename.endswith('.eml'):
+        yield parse_eml(file.stream)
+    else:
+        yield from iter_mbox_messages(file.stream)
+
+
+def _html_to_text(markup):
+    text = _STYLE_RE.sub('', markup)
+    text = re.sub(r'<br\s*/?>|</p>|</div>', '\n', text, flags=re.IGNORECASE)
+    text = html.unescape(_TAG_RE.sub('', text))
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def message_to_text(message):
+    """Render headers and the best text body of a message as paste-style email text."""
+    lines = []
+    for header in ('From', 'To', 'Cc', 'Date', 'Subject'):
+        value = message.get(header)
+        if value:
+            lines.append(f"{header}: {value}")
+
+    body = message.get_body(preferencelist=('plain', 'html'))
+    text = ''
+    if body is not None:
+        try:
+            text = body.get_content()
+        except (LookupError, UnicodeError) as e:
+            logger.warning(f"Could not decode message body: {str(e)}")
+            payload = body.get_payload(decode=True) or b''
+            text = payload.decode('utf-8', errors='ignore')
+        if body.get_content_type() == 'text/html':
+            text = _html_to_text(text)
+
+    return '\n'.join(lines) + '\n\n' + text.strip()
+
+
+def message_attachments(message):
+    """Return attachments of a message as FileStorage objects for EmailAnalyzer.process_attachments."""
+    files = []
+    for part in message.iter_attachments():
+        filename = part.get_filename()
+        if not filename:
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        files.append(FileStorage(stream=io.BytesIO(payload), filename=filename,
+                                 content_type=part.get_content_type()))
+    return files
@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'emailwise_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'emailwise_http_request_seconds': ('histogram', 'Time until the response is returned (first byte for streams).',
+                                       DEFAULT_BUCKETS),
+    'emailwise_stage_seconds': ('histogram', 'Duration of one stage of an analysis or chat request.', DEFAULT_BUCKETS),
+    'emailwise_db_query_seconds': ('histogram', 'Database statement execution time by statement type.',
+                                   (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)),
+    'emailwise_tokens_total': ('counter', 'OpenAI tokens by model and kind (prompt, completion, cached).', None),
+    'emailwise_analyses_total': ('counter', 'Analyses by routing tier and reason.', None),
+    'emailwise_fallbacks_total': ('counter', 'Analyses answered locally because the API was unavailable.', None),
+    'emailwise_cache_lookups_total': ('counter', 'Analysis result cache lookups by result.', None),
+    'emailwise_ingested_messages_total': ('counter', 'Mailbox messages ingested by source kind and result.', None),
+    'emailwise_admission_inflight': ('gauge', 'LLM calls holding an admission slot, all workers.', None),
+    'emailwise_admission_queue_depth': ('gauge', 'Requests queued for an admission slot, all workers.', None),
+    'emailwise_admission_wait_seconds': ('histogram', 'Time from asking for an admission slot to getting one.',
+                                         DEFAULT_BUCKETS),
+    'emailwise_admission_shed_total': ('counter', 'Requests refused an admission slot by reason and action.', None),
+    'emailwise_upstream_calls_total': ('counter', 'OpenAI calls by result (succeeded, failed, short_circuited).', None),
+    'emailwise_upstream_retries_total': ('counter', 'OpenAI call retries by reason.', None),
+    'emailwise_upstream_timeouts_total': ('counter', 'OpenAI call attempts that timed out.', None),
+    'emailwise_upstream_hedges_total': ('counter', 'Hedged OpenAI requests by result (launched, won).', None),
+    'emailwise_upstream_breaker_opens_total': ('counter', 'Times the OpenAI circuit breaker opened.', None),
+    'emailwise_upstream_breaker_state': ('gauge', 'OpenAI circuit breaker state of the worker that served the scrape '
+                                                  '(1 for the current state).', None),
+}
+
+_request_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """Counters and histograms for this process, exported in Prometheus text format.
+
+    With a directory configured every process (gunicorn worker) periodically writes its values
+    to ``metrics-<pid>.json`` there, and ``render()`` sums the files of all processes, so a
+    scrape that lands on any worker sees totals for the whole server.
+    """
+
+    def __init__(self, directory=None, flush_interval=2.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._gauges = {}
+        self._reset()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv('METRICS_DIR') or None,
+            flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 2)),
+        )
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+        self._dirty = False
+
+    def _check_fork(self):
+        # A forked worker starts from zero; the parent's values are reported by the parent
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_fork()
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+            self._dirty = True
+
+    def gauge(self, name, callback):
+        """Report a gauge from callback() -> [(labels dict, value)], called on every render.
+
+        Gauges are read at scrape time from state every process can see (such as a shared
+        file), so unlike counters they are not summed over the per-process files.
+        """
+        self._gauges[name] = callback
+
+    @contextmanager
+    def span(self, stage):
+        """Time a block as one stage; also recorded for the current request's Server-Timing header."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('emailwise_stage_seconds', elapsed, stage=stage)
+            timings = getattr(_request_local, 'timings', None)
+            if timings is not None:
+                timings.append((stage, elapsed))
+
+    def begin_request(self):
+        _request_local.timings = []
+
+    def end_request(self):
+        """Stage timings collected on this thread since begin_request()."""
+        timings = getattr(_request_local, 'timings', None) or []
+        _request_local.timings = None
+        return timings
+
+    def record_usage(self, model, report):
+        """Token counters from a usage report (see PromptBuilder.usage_report)."""
+        for kind, field in (('prompt', 'prompt_tokens'), ('completion', 'completion_tokens'),
+                            ('cached', 'cached_prompt_tokens')):
+            if report.get(field):
+                self.inc('emailwise_tokens_total', report[field], model=model, kind=kind)
+
+    def instrument_engine(self, engine):
+        """Time every statement executed through a SQLAlchemy engine."""
+        from sqlalchemy import event
+
+        # The start time lives on the statement's execution context, which is discarded with it,
+        # so a failed statement (no after_cursor_execute) leaves nothing behind on the connection
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                context.metrics_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, 'metrics_started', None)
+            if started is None:
+                return
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+            self.observe('emailwise_db_query_seconds', time.perf_counter() - started, operation=operation)
+
+    # -------------------------------------------------------------------------
+    # Cross-process aggregation
+    # -------------------------------------------------------------------------
+
+    def _state(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(state)] for (name, labels), state in self._histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this process's values to the metrics directory (at most every flush_interval seconds)."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and (not self._dirty or now - self._last_flush < self.flush_interval):
+            return
+        self._last_flush = now
+        self._dirty = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+            temporary = f'{path}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(self._state(), f)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics file: {str(e)}")
+
+    def _collect(self):
+        """Sum the values of all processes writing to the directory (or just this one)."""
+        states = [self._state()]
+        if self.directory and os.path.isdir(self.directory):
+            own = f'metrics-{os.getpid()}.json'
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json') or filename == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        counters, histograms = {}, {}
+        for state in states:
+            for name, labels, value in state['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in state['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    total[index] += value
+        return counters, histograms
+
+    def _read_gauge(self, name):
+        callback = self._gauges.get(name)
+        if callback is None:
+            return []
+        try:
+            return callback()
+        except Exception as e:
+            logger.warning(f"Could not read gauge {name}: {str(e)}")
+            return []
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) of all processes."""
+        self.flush(force=True)
+        counters, histograms = self._collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                continue
+            if kind == 'gauge':
+                for labels, value in self._read_gauge(name):
+                    lines.append(f'{name}{_format_labels(_label_key(labels))} {_format_value(value)}')
+                continue
+            for (metric, labels), state in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, state):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {state[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(state[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {state[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(timings):
+    """Server-Timing header value for a request's stage timings (repeated stages are summed)."""
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ', '.join(f'{stage};dur={elapsed * 1000:.1f}' for stage, elapsed in totals.items())
+
+
+class SamplingProfiler:
+    """Samples one thread's call stack at a fixed interval; output is in folded-stack format
+    (one 'outer;inner;leaf count' line per distinct stack, as read by flamegraph tools)."""
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=64):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if stack:
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in
+                         sorted(self.stacks.items(), key=lambda item: -item[1])) + '\n'
+
+    def top(self, n=10):
+        """Functions with the most samples at the top of the stack: [(frame, share)]."""
+        leaves = {}
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        ranked = sorted(leaves.items(), key=lambda item: -item[1])[:n]
+        return [(leaf, round(count / max(self.samples, 1), 3)) for leaf, count in ranked]
+
+
+metrics = Metrics.from_env()
+atexit.register(metrics.flush, True)
@@ -4,7 +4,10 @@ from datetime import datetime
 class EmailSummary(db.Model):
     """Model to store email analysis history"""
     id = db.Column(db.Integer, primary_key=True)
-    email_content = db.Column(db.Text, nullable=False)
+    # Bodies live in EmailBody; rows from before that keep theirs here until migrated ('' afterwards)
+    legacy_content = db.Column('email_content', db.Text, nullable=False, default='')
+    body_hash = db.Column(db.String(64), db.ForeignKey('email_body.sha256'), index=True)
+    preview = db.Column(db.String(101))  # First characters of the body for history lists
     summary = db.Column(db.Text)
     action_items = db.Column(db.Text)
     deadlines = db.Column(db.Text)
@@ -21,7 +24,149 @@ class EmailSummary(db.Model):
     confidence_score = db.Column(db.Float)
     status = db.Column(db.String(50), default='active')  # active, archived, snoozed, delegated
     
+    # Summary style, output language and reply tone the analysis was made with (see app.options_key)
+    analysis_options = db.Column(db.String(150))
+    
+    # Thread tracking for incremental analysis of growing reply chains
+    thread_hash = db.Column(db.String(64), index=True)  # Chain hash of all messages in the pasted thread
+    message_count = db.Column(db.Integer)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Composite indexes backing keyset pagination (created_at, id) with optional filters
+    __table_args__ = (
+        db.Index('ix_email_summary_created_id', 'created_at', 'id'),
+        db.Index('ix_email_summary_status_created', 'status', 'created_at', 'id'),
+        db.Index('ix_email_summary_intent_created', 'intent', 'created_at', 'id'),
+        db.Index('ix_email_summary_priority_created', 'priority', 'created_at', 'id'),
+        db.Index('ix_email_summary_urgency_created', 'urgency_score', 'created_at'),
+    )
+    
+    body = db.relationship('EmailBody', lazy='select', viewonly=True)
+    
+    @property
+    def email_content(self):
+        """Full email body, loaded and decompressed on first access"""
+        text = self.__dict__.get('_body_text')
+        if text is None:
+            text = self.body.text if self.body is not None else (self.legacy_content or '')
+            self.__dict__['_body_text'] = text
+        return text
+    
+    @email_content.setter
+    def email_content(self, text):
+        # The body row itself is written on insert (see body_store.register)
+        from body_store import preview_of
+        self.__dict__['_body_text'] = text
+        self.preview = preview_of(text)
+        self.body_hash = None
+    
     def __repr__(self):
         return f'<EmailSummary {self.id}>'
+
+class EmailBody(db.Model):
+    """Compressed email body, stored once per distinct content"""
+    sha256 = db.Column(db.String(64), primary_key=True)  # Hash of the UTF-8 body
+    codec = db.Column(db.String(10), nullable=False)  # zlib, zstd or none
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer)  # Uncompressed length in characters
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def text(self):
+        from body_store import decompress
+        return decompress(self.codec, self.data)
+    
+    def __repr__(self):
+        return f'<EmailBody {self.sha256[:12]}>'
+
+class EmailEmbedding(db.Model):
+    """Embedding vector of an analyzed email for similarity search"""
+    summary_id = db.Column(db.Integer, primary_key=True)  # EmailSummary.id
+    embedder = db.Column(db.String(100), nullable=False)  # Embedder name, vectors are only comparable within one
+    vector = db.Column(db.LargeBinary, nullable=False)  # float32 array bytes
+    
+    def __repr__(self):
+        return f'<EmailEmbedding {self.summary_id}>'
+
+class AnalysisJob(db.Model):
+    """Queued analysis request processed by the background job workers"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    payload = db.Column(db.Text, nullable=False)  # JSON: email content, options, spooled attachments
+    result = db.Column(db.Text)  # JSON analysis result once done
+    error = db.Column(db.Text)
+    summary_id = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_analysis_job_status_created', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<AnalysisJob {self.id} {self.status}>'
+
+class IngestWatermark(db.Model):
+    """How far a mailbox source has been ingested, so re-runs only process new messages"""
+    source = db.Column(db.String(600), primary_key=True)  # kind:absolute path, e.g. mbox:/var/mail/alice
+    position = db.Column(db.Text, nullable=False)  # JSON, meaning depends on the source kind
+    messages = db.Column(db.Integer, default=0)  # Messages ingested from this source so far
+    failed = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<IngestWatermark {self.source}>'
+
+class IngestedFile(db.Model):
+    """A Maildir or .eml file already read from a source, so later runs skip it whatever its mtime"""
+    source = db.Column(db.String(600), primary_key=True)  # IngestWatermark.source
+    name = db.Column(db.String(255), primary_key=True)  # File name, without the Maildir ':2,flags' suffix
+    
+    def __repr__(self):
+        return f'<IngestedFile {self.source} {self.name}>'
+
+class ChatSession(db.Model):
+    """Conversation about one stored analysis, with the email body chunked and indexed for retrieval"""
+    id = db.Column(db.Integer, primary_key=True)
+    summary_id = db.Column(db.Integer, nullable=False, index=True)  # EmailSummary.id
+    context = db.Column(db.Text, nullable=False)  # Stored analysis sent with every question
+    chunk_index = db.Column(db.Text, nullable=False)  # JSON BM25 index of the body chunks
+    chunk_count = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChatSession {self.id} for {self.summary_id}>'
+
+class ChatTurn(db.Model):
+    """One question or answer of a chat session"""
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, nullable=False)  # ChatSession.id
+    role = db.Column(db.String(10), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    prompt_tokens = db.Column(db.Integer)  # Prompt size of the request that produced an answer
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_chat_turn_session_id', 'session_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<ChatTurn {self.session_id}:{self.id} {self.role}>'
+
+class SummaryRollup(db.Model):
+    """Analyses per creation day by intent, priority, sentiment and status, kept current by rollups.register"""
+    day = db.Column(db.Date, primary_key=True)  # UTC day of EmailSummary.created_at
+    dimension = db.Column(db.String(20), primary_key=True)  # all, intent, priority, sentiment, status
+    value = db.Column(db.String(50), primary_key=True)  # '' for the 'all' total
+    count = db.Column(db.Integer, nullable=False, default=0)
+    urgency_sum = db.Column(db.Integer, nullable=False, default=0)
+    urgency_count = db.Column(db.Integer, nullable=False, default=0)  # Rows with an urgency score
+    
+    def __repr__(self):
+        return f'<SummaryRollup {self.day} {self.dimension}={self.value}: {self.count}>'
@@ -0,0 +1,269 @@
+import os
+import re
+import logging
+from thread_parser import BOUNDARY_RE
+
+logger = logging.getLogger(__name__)
+
+# Static instructions come first and never change between calls, so the provider can
+# reuse its cached prefix; per-request settings and the email follow in the user message
+ANALYSIS_INSTRUCTIONS = """You are an elite executive assistant and strategic data analyst. Analyze the email thread (and any attachment excerpts) in the user message.
+
+Return one valid JSON object only, no markdown, with exactly these keys:
+summary: string (detailed = bullet points, quick = 1-2 sentences, brief = executive brief)
+action_items: string[]
+deadlines: string[]
+subject: string
+priority: "High"|"Medium"|"Low"
+sentiment: "Positive"|"Neutral"|"Negative"|"Urgent"|"Angry"
+suggested_replies: {"option_1": {"label": string, "text": string}, "option_2": {"label": string, "text": string}}
+intent: "Request"|"Inquiry"|"Complaint"|"Update"
+urgency_score: integer 1-10, based on deadlines and tone
+confidence_score: integer 0-100
+spam_analysis: {"is_spam": boolean, "reason": string}
+decision_helper: {"pros": string[], "cons": string[], "risks": string[]}
+
+Guidelines:
+1. Adapt the summary length to the requested summary style.
+2. Write two distinct reply options in the requested reply tone.
+3. Write every text value in the requested output language, except proper nouns.
+4. Parts marked [removed] or [truncated] were cut to save space; do not speculate about them."""
+
+CHUNK_INSTRUCTIONS = """You condense parts of long email threads (messages and attachment excerpts) for a later analysis step.
+Keep every request, decision, question, deadline, date, amount, name and commitment.
+Write compact bullet points in the requested language. Do not add commentary."""
+
+CHAT_INSTRUCTIONS = """You are a helpful assistant answering questions about one email.
+Answer strictly based on the email provided. Be concise and helpful."""
+
+SESSION_CHAT_INSTRUCTIONS = """You are a helpful assistant answering questions about one email in an ongoing conversation.
+You get an analysis of the email and, with each question, the excerpts of the email that best match it.
+Answer strictly based on these. If they do not contain the answer, say so. Be concise and helpful."""
+
+# ---------------------------------------------------------------------------
+# Noise trimming
+# ---------------------------------------------------------------------------
+
+_BASE64_BLOCK_RE = re.compile(r'(?:^[ \t>]*[A-Za-z0-9+/=]{60,}[ \t]*\n){3,}', re.MULTILINE)
+_DATA_URI_RE = re.compile(r'data:[\w/+.-]+;base64,[A-Za-z0-9+/=]{100,}')
+_MIME_HEADER_RE = re.compile(
+    r'^[ \t>]*(?:Content-(?:Type|Transfer-Encoding|Disposition|ID)|MIME-Version|X-[\w-]+):.*\n'
+    r'(?:[ \t]+.*\n)*',
+    re.MULTILINE | re.IGNORECASE
+)
+_MIME_BOUNDARY_RE = re.compile(r'^[ \t>]*--[=_A-Za-z0-9.:-]{12,}(?:--)?[ \t]*$\n?', re.MULTILINE)
+_RECIPIENT_HEADER_RE = re.compile(r'^[ \t>]*(?:To|Cc|Bcc|Reply-To):.*\n(?:[ \t]+.*\n)*', re.MULTILINE | re.IGNORECASE)
+_MOBILE_FOOTER_RE = re.compile(r'^[ \t>]*(?:Sent from my [\w ]+|Get Outlook for \w+|Sent via \w+)[ \t]*$\n?', re.MULTILINE | re.IGNORECASE)
+_LONG_URL_RE = re.compile(r'https?://([^/\s]+)/\S{80,}')
+_DISCLAIMER_RE = re.compile(
+    r'confidential|privileged|intended (?:solely |only )?for|if you (?:have received|are not the intended)|'
+    r'disclaimer|unauthori[sz]ed (?:use|disclosure|review)|virus|legally binding|please notify the sender',
+    re.IGNORECASE
+)
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n[ \t>]*\n')
+_BLANK_LINES_RE = re.compile(r'\n[ \t]*(?:\n[ \t]*){2,}')
+_SIGNATURE_DELIMITER = re.compile(r'^[ \t>]*-- ?$')
+_MESSAGE_START_RE = re.compile(r'^[ \t>]*(?:From|Sent|Date|Subject):', re.IGNORECASE)
+
+
+def _strip_signatures(text, max_lines=10):
+    """Drop '-- ' signature blocks: up to max_lines, or until the next quoted message starts."""
+    kept = []
+    remaining = 0
+    for line in text.split('\n'):
+        if remaining:
+            if not (BOUNDARY_RE.match(line) or _MESSAGE_START_RE.match(line)):
+                remaining -= 1
+                continue
+            remaining = 0
+        if _SIGNATURE_DELIMITER.match(line):
+            remaining = max_lines
+            continue
+        kept.append(line)
+    return '\n'.join(kept)
+
+
+def _drop_disclaimers(text):
+    """Remove long legal-boilerplate paragraphs (two or more disclaimer phrases)."""
+    paragraphs = _PARAGRAPH_SPLIT_RE.split(text)
+    kept = [p for p in paragraphs if len(p) < 150 or len(_DISCLAIMER_RE.findall(p)) < 2]
+    return '\n\n'.join(kept) if len(kept) != len(paragraphs) else text
+
+
+def clean_email(text):
+    """Remove content that costs tokens but carries no meaning for the analysis."""
+    text = text.replace('\r\n', '\n')
+    text = _BASE64_BLOCK_RE.sub('[binary data removed]\n', text)
+    text = _DATA_URI_RE.sub('[inline image removed]', text)
+    text = _MIME_HEADER_RE.sub('', text)
+    text = _MIME_BOUNDARY_RE.sub('', text)
+    text = _RECIPIENT_HEADER_RE.sub('', text)
+    text = _MOBILE_FOOTER_RE.sub('', text)
+    text = _LONG_URL_RE.sub(r'[link: \1]', text)
+    text = _strip_signatures(text)
+    text = _drop_disclaimers(text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
+    return text.strip()
+
+
+# ---------------------------------------------------------------------------
+# Token counting
+# ---------------------------------------------------------------------------
+
+# CJK characters are about a token each; other words split into pieces of up to four characters
+_ROUGH_TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|\w{1,4}|[^\w\s]')
+
+
+class RoughTokenizer:
+    """Approximate counts (PROMPT_TOKENIZER=rough): BPE-like pieces of up to four word characters."""
+
+    name = 'rough'
+
+    def count(self, text):
+        return len(_ROUGH_TOKEN_RE.findall(text))
+
+    def head_tail(self, text, head_tokens, tail_tokens):
+        pieces = list(_ROUGH_TOKEN_RE.finditer(text))
+        head_end = pieces[head_tokens - 1].end() if head_tokens else 0
+        tail_start = pieces[-tail_tokens].start() if tail_tokens else len(text)
+        return text[:head_end], text[tail_start:]
+
+
+class TiktokenTokenizer:
+    """Exact token counts for OpenAI models (optional dependency)."""
+
+    def __init__(self, encoding_name='o200k_base'):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = encoding_name
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def head_tail(self, text, head_tokens, tail_tokens):
+        tokens = self.encoding.encode(text, disallowed_special=())
+        head = self.encoding.decode(tokens[:head_tokens])
+        tail = self.encoding.decode(tokens[len(tokens) - tail_tokens:]) if tail_tokens else ''
+        return head, tail
+
+
+def tokenizer_from_env():
+    """tiktoken (a declared dependency) unless PROMPT_TOKENIZER=rough opts out of exact counts."""
+    if os.getenv('PROMPT_TOKENIZER', 'tiktoken').lower() == 'rough':
+        return RoughTokenizer()
+    encoding = os.getenv('PROMPT_ENCODING', 'o200k_base')
+    try:
+        return TiktokenTokenizer(encoding)
+    except Exception as e:
+        # A broken install, or no network to fetch the encoding file on first use
+        logger.error(f"Could not load tiktoken encoding {encoding} ({str(e)}); prompt budgets use an approximate "
+                     f"token count. Set PROMPT_TOKENIZER=rough to use the estimate deliberately.")
+        return RoughTokenizer()
+
+
+# ---------------------------------------------------------------------------
+# Prompt builder
+# ---------------------------------------------------------------------------
+
+class PromptBuilder:
+    """Builds cache-friendly chat messages with the email body fitted to a token budget."""
+
+    def __init__(self, tokenizer, body_tokens=12000, chat_body_tokens=8000, context_tokens=128000):
+        self.tokenizer = tokenizer
+        self.body_tokens = body_tokens
+        self.chat_body_tokens = chat_body_tokens
+        self.context_tokens = context_tokens
+        self.instruction_tokens = tokenizer.count(ANALYSIS_INSTRUCTIONS)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            tokenizer_from_env(),
+            body_tokens=int(os.getenv('PROMPT_BODY_TOKENS', 12000)),
+            chat_body_tokens=int(os.getenv('PROMPT_CHAT_BODY_TOKENS', 8000)),
+            context_tokens=int(os.getenv('PROMPT_CONTEXT_TOKENS', 128000)),
+        )
+
+    def fit(self, text, budget):
+        """Clean the text and cut it to budget tokens, keeping 20% head and 80% tail.
+
+        Returns (text, info) where info records token counts before and after.
+        """
+        cleaned = clean_email(text)
+        tokens = self.tokenizer.count(cleaned)
+        info = {'raw_chars': len(text), 'removed_chars': len(text) - len(cleaned),
+                'body_tokens': tokens, 'truncated': False}
+        if tokens <= budget:
+            return cleaned, info
+
+        # The tail usually holds the most recent messages of a thread
+        head, tail = self.tokenizer.head_tail(cleaned, int(budget * 0.2), budget - int(budget * 0.2))
+        info.update(body_tokens=budget, truncated=True, original_body_tokens=tokens)
+        return f"{head}\n...[truncated {tokens - budget} tokens]...\n{tail}", info
+
+    def analysis_budget(self, max_tokens=2000):
+        """Tokens the email body may take in an analysis prompt."""
+        return min(self.body_tokens, self.context_tokens - self.instruction_tokens - max_tokens - 200)
+
+    def exceeds(self, text, budget):
+        """Whether the cleaned text needs more than budget tokens (truncation would lose content)."""
+        if len(text) <= budget:
+            return False  # A token spans at least one character
+        return self.tokenizer.count(clean_email(text)) > budget
+
+    def analysis_messages(self, email_content, summary_style, output_language, reply_tone, max_tokens=2000):
+        """(messages, info) for an analysis call."""
+        body, info = self.fit(email_content, self.analysis_budget(max_tokens))
+        settings = f"Summary style: {summary_style}\nOutput language: {output_language}\nReply tone: {reply_tone}"
+        messages = [
+            {"role": "system", "content": ANALYSIS_INSTRUCTIONS},
+            {"role": "user", "content": f"{settings}\n\nEmail content:\n{body}"},
+        ]
+        return messages, info
+
+    def chat_messages(self, email_content, query):
+        """(messages, info) for a question about an email; the email precedes the question
+        so follow-up questions about the same email share the cached prefix."""
+        body, info = self.fit(email_content, self.chat_body_tokens)
+        messages = [
+            {"role": "system", "content": CHAT_INSTRUCTIONS},
+            {"role": "user", "content": f"Email content:\n{body}\n\nQuestion: {query}"},
+        ]
+        return messages, info
+
+    def session_chat_messages(self, context, excerpts, turns, query):
+        """(messages, info) for a question in a chat session.
+
+        The analysis of the email comes first and stays the same for every question of the
+        session, followed by the earlier turns [(role, content)], so only the excerpts and
+        the question are new in each request.
+        """
+        body = '\n\n'.join(f"[{number}] {excerpt}" for number, excerpt in enumerate(excerpts, 1))
+        messages = [
+            {"role": "system", "content": SESSION_CHAT_INSTRUCTIONS},
+            {"role": "user", "content": f"Analysis of the email:\n{context}"},
+        ]
+        messages.extend({"role": role, "content": content} for role, content in turns)
+        messages.append({"role": "user", "content": f"Relevant excerpts of the email:\n{body or '(none)'}\n\nQuestion: {query}"})
+        info = {'raw_chars': len(body), 'removed_chars': 0, 'body_tokens': self.tokenizer.count(body), 'truncated': False}
+        return messages, info
+
+    def chunk_messages(self, chunk, index, total, output_language):
+        """Messages for the map step of map-reduce summarization."""
+        return [
+            {"role": "system", "content": CHUNK_INSTRUCTIONS},
+            {"role": "user", "content": f"Language: {output_language}\nPart {index + 1} of {total}:\n\n{clean_email(chunk)}"},
+        ]
+
+    def usage_report(self, usage, info):
+        """Token usage of one request, including the provider's cached prompt tokens."""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+            'completion_tokens': getattr(usage, 'completion_tokens', None),
+            'cached_prompt_tokens': getattr(details, 'cached_tokens', None) if details else None,
+            'body_tokens': info['body_tokens'],
+            'body_truncated': info['truncated'],
+            'removed_noise_chars': info['removed_chars'],
+            'tokenizer': self.tokenizer.name,
+        }
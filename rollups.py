@@ -0,0 +1,208 @@
+"""
+Per-day rollups of the stored analyses for inbox dashboards.
+
+Every EmailSummary insert, update and delete adjusts the counts of its creation day by
+intent, priority, sentiment and status (plus a total), together with the urgency scores, so
+statistics over any date range are read from a few rows per day instead of the history.
+"""
+import logging
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('intent', 'priority', 'sentiment', 'status')
+GRANULARITIES = ('day', 'week', 'month')
+TOTAL = 'all'
+
+_MEASURES = ('count', 'urgency_sum', 'urgency_count')
+
+
+def _value(dimension, value):
+    if dimension == 'status':
+        value = value or 'active'
+    elif dimension == 'sentiment' and value:
+        value = value.split(' (', 1)[0]  # 'Negative (Urgent)' counts as Negative; urgency has its own measure
+    return (value or 'Unknown')[:50]
+
+
+def _keys(values):
+    """(dimension, value) pairs an analysis with these column values is counted under."""
+    return [(TOTAL, '')] + [(dimension, _value(dimension, values.get(dimension))) for dimension in DIMENSIONS]
+
+
+def _day(created_at):
+    return (created_at or datetime.utcnow()).date()
+
+
+def _deltas(deltas, day, values, sign):
+    urgency = values.get('urgency_score')
+    for key in _keys(values):
+        measures = deltas.setdefault((day,) + key, [0, 0, 0])
+        measures[0] += sign
+        if urgency is not None:
+            measures[1] += sign * int(urgency)
+            measures[2] += sign
+
+
+_UPSERT = sa.text(
+    "INSERT INTO summary_rollup (day, dimension, value, count, urgency_sum, urgency_count)"
+    " VALUES (:day, :dimension, :value, :count, :urgency_sum, :urgency_count)"
+    " ON CONFLICT (day, dimension, value) DO UPDATE SET"
+    " count = summary_rollup.count + excluded.count,"
+    " urgency_sum = summary_rollup.urgency_sum + excluded.urgency_sum,"
+    " urgency_count = summary_rollup.urgency_count + excluded.urgency_count"
+).bindparams(sa.bindparam('day', type_=sa.Date))
+
+
+def _apply(connection, deltas):
+    """Add {(day, dimension, value): [count, urgency_sum, urgency_count]} to the rollup table."""
+    from models import SummaryRollup
+    # A fixed order, so concurrent transactions lock the rows in the same sequence
+    rows = [{'day': day, 'dimension': dimension, 'value': value, **dict(zip(_MEASURES, measures))}
+            for (day, dimension, value), measures in sorted(deltas.items()) if any(measures)]
+    if not rows:
+        return
+
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        # Plain SQL: compiled once, unlike a dialect insert() with a multi-row VALUES clause
+        connection.execute(_UPSERT, rows)
+        return
+
+    table = SummaryRollup.__table__
+    for row in rows:
+        key = sa.and_(table.c.day == row['day'], table.c.dimension == row['dimension'], table.c.value == row['value'])
+        updated = connection.execute(
+            sa.update(table).where(key).values({name: table.c[name] + row[name] for name in _MEASURES})
+        ).rowcount
+        if not updated:
+            connection.execute(sa.insert(table).values(**row))
+
+
+def _current(target):
+    return {name: getattr(target, name) for name in DIMENSIONS + ('urgency_score',)}
+
+
+def register(model):
+    """Keep the rollups in step with EmailSummary inserts, updates (status changes) and deletes."""
+
+    @event.listens_for(model, 'after_insert')
+    def count_row(mapper, connection, target):
+        deltas = {}
+        _deltas(deltas, _day(target.created_at), _current(target), 1)
+        _apply(connection, deltas)
+
+    @event.listens_for(model, 'after_update')
+    def move_row(mapper, connection, target):
+        state = sa.inspect(target)
+        new = _current(target)
+        old = dict(new)
+        for name in new:
+            history = state.attrs[name].history
+            if history.has_changes() and history.deleted:
+                old[name] = history.deleted[0]
+        if old == new:
+            return
+        deltas = {}
+        day = _day(target.created_at)
+        _deltas(deltas, day, old, -1)
+        _deltas(deltas, day, new, 1)
+        _apply(connection, deltas)
+
+    @event.listens_for(model, 'after_delete')
+    def uncount_row(mapper, connection, target):
+        deltas = {}
+        _deltas(deltas, _day(target.created_at), _current(target), -1)
+        _apply(connection, deltas)
+
+
+def clear(session):
+    """Empty the rollups (bulk deletes bypass the mapper events)."""
+    from models import SummaryRollup
+    session.execute(sa.delete(SummaryRollup))
+
+
+def rebuild(db, batch_size=5000):
+    """Recount every stored summary; streams the rows, so memory depends on days and values only."""
+    from models import EmailSummary, SummaryRollup
+
+    deltas = {}
+    columns = [getattr(EmailSummary, name) for name in DIMENSIONS + ('urgency_score', 'created_at')]
+    with db.engine.begin() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(sa.select(*columns))
+        total = 0
+        for row in result:
+            values = row._asdict()
+            _deltas(deltas, _day(values.pop('created_at')), values, 1)
+            total += 1
+        conn.execute(sa.delete(SummaryRollup.__table__))
+        _apply(conn, deltas)
+    logger.info(f"Rebuilt analytics rollups from {total} stored summaries")
+    return total
+
+
+def setup(db):
+    """Build the rollups of an existing database the first time they are needed."""
+    from models import EmailSummary, SummaryRollup
+    with db.engine.connect() as conn:
+        has_rollups = conn.execute(sa.select(SummaryRollup.day).limit(1)).first() is not None
+        has_summaries = conn.execute(sa.select(EmailSummary.id).limit(1)).first() is not None
+    if has_summaries and not has_rollups:
+        rebuild(db)
+
+
+def period_of(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _average(urgency_sum, urgency_count):
+    return round(urgency_sum / urgency_count, 2) if urgency_count else None
+
+
+def stats(session, start, end, granularity='day'):
+    """Counts and average urgency per period between two dates (inclusive) from the rollups."""
+    from models import SummaryRollup
+
+    rows = session.execute(
+        sa.select(SummaryRollup.day, SummaryRollup.dimension, SummaryRollup.value, SummaryRollup.count,
+                  SummaryRollup.urgency_sum, SummaryRollup.urgency_count)
+        .where(SummaryRollup.day >= start, SummaryRollup.day <= end)
+    ).all()
+
+    periods = {}
+    totals = {}
+    for row in rows:
+        if not row.count:
+            continue
+        for bucket in (periods.setdefault(period_of(row.day, granularity), {}), totals):
+            measures = bucket.setdefault((row.dimension, row.value), [0, 0, 0])
+            measures[0] += row.count
+            measures[1] += row.urgency_sum
+            measures[2] += row.urgency_count
+
+    def summarize(bucket, per_value_urgency):
+        count, urgency_sum, urgency_count = bucket.get((TOTAL, ''), (0, 0, 0))
+        summary = {'count': count, 'avg_urgency': _average(urgency_sum, urgency_count)}
+        for dimension in DIMENSIONS:
+            values = sorted(((value, measures) for (name, value), measures in bucket.items() if name == dimension),
+                            key=lambda item: -item[1][0])
+            if per_value_urgency:
+                summary[dimension] = {value: {'count': measures[0], 'avg_urgency': _average(measures[1], measures[2])}
+                                      for value, measures in values}
+            else:
+                summary[dimension] = {value: measures[0] for value, measures in values}
+        return summary
+
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'granularity': granularity,
+        'totals': summarize(totals, True),
+        'series': [{'period': period.isoformat(), **summarize(bucket, False)}
+                   for period, bucket in sorted(periods.items())],
+    }
@@ -0,0 +1,127 @@
+import os
+import threading
+from collections import deque
+
+TIERS = ('local', 'small', 'full')
+
+# USD per 1K (prompt, completion) tokens; unknown models are priced like gpt-4o
+MODEL_PRICING = {
+    'gpt-4o': (float(os.getenv('OPENAI_PROMPT_COST_PER_1K', 0.0025)),
+               float(os.getenv('OPENAI_COMPLETION_COST_PER_1K', 0.01))),
+    'gpt-4o-mini': (float(os.getenv('OPENAI_SMALL_PROMPT_COST_PER_1K', 0.00015)),
+                    float(os.getenv('OPENAI_SMALL_COMPLETION_COST_PER_1K', 0.0006))),
+}
+
+
+def usage_cost(model, usage):
+    """(total tokens, USD cost) of a completion's usage object."""
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    prompt_price, completion_price = MODEL_PRICING.get(model, MODEL_PRICING['gpt-4o'])
+    return prompt_tokens + completion_tokens, (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class TierRouter:
+    """Decides per email whether the local engine, a small model or the full model analyzes it.
+
+    Decisions use the local engine's scores, so routing costs well under a millisecond.
+    """
+
+    def __init__(self, enabled=True, small_model='gpt-4o-mini', full_model='gpt-4o', small_max_tokens=1200,
+                 full_max_tokens=2000, local_max_words=15, spam_threshold=0.85, small_max_chars=6000,
+                 full_min_urgency=7, full_min_messages=3, window=1000):
+        self.enabled = enabled
+        self.small_model = small_model
+        self.full_model = full_model
+        self.small_max_tokens = small_max_tokens
+        self.full_max_tokens = full_max_tokens
+        self.local_max_words = local_max_words
+        self.spam_threshold = spam_threshold
+        self.small_max_chars = small_max_chars
+        self.full_min_urgency = full_min_urgency
+        self.full_min_messages = full_min_messages
+        self._lock = threading.Lock()
+        self._stats = {tier: {'requests': 0, 'seconds': 0.0, 'tokens': 0, 'cost_usd': 0.0,
+                              'latencies': deque(maxlen=window), 'reasons': {}} for tier in TIERS}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('ROUTING_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            small_model=os.getenv('ROUTING_SMALL_MODEL', 'gpt-4o-mini'),
+            full_model=os.getenv('ROUTING_FULL_MODEL', 'gpt-4o'),
+            small_max_tokens=int(os.getenv('ROUTING_SMALL_MAX_TOKENS', 1200)),
+            full_max_tokens=int(os.getenv('ROUTING_FULL_MAX_TOKENS', 2000)),
+            local_max_words=int(os.getenv('ROUTING_LOCAL_MAX_WORDS', 15)),
+            spam_threshold=float(os.getenv('ROUTING_SPAM_THRESHOLD', 0.85)),
+            small_max_chars=int(os.getenv('ROUTING_SMALL_MAX_CHARS', 6000)),
+            full_min_urgency=int(os.getenv('ROUTING_FULL_MIN_URGENCY', 7)),
+            full_min_messages=int(os.getenv('ROUTING_FULL_MIN_MESSAGES', 3)),
+        )
+
+    def model_for(self, tier):
+        """(model, max_tokens) used for an API tier."""
+        if tier == 'small':
+            return self.small_model, self.small_max_tokens
+        return self.full_model, self.full_max_tokens
+
+    def decide(self, scored, engine, content_chars, has_attachments=False, thread_messages=1):
+        """Pick a tier for one email scored by LocalAnalyzer.score_batch. Returns (tier, reason)."""
+        if not self.enabled:
+            return 'full', 'routing disabled'
+
+        # Attachments and threads can hide the real request, so they never stay local
+        if not has_attachments and thread_messages <= 1:
+            if scored['spam_probability'] >= self.spam_threshold:
+                return 'local', 'spam'
+            asks = engine.feature(scored, 'request') > 0 or engine.feature(scored, 'question') > 0
+            if engine.feature(scored, 'automated') > 0 and not asks and scored['urgency'] < self.full_min_urgency:
+                return 'local', 'automated notification'
+            calm = scored['urgency'] <= 3 and scored['sentiment'] in ('Positive', 'Neutral')
+            if scored['words'] <= self.local_max_words and calm and not asks and not scored['deadlines']:
+                return 'local', 'short acknowledgement'
+
+        if has_attachments:
+            return 'full', 'attachments'
+        if content_chars > self.small_max_chars:
+            return 'full', 'long content'
+        if thread_messages >= self.full_min_messages:
+            return 'full', 'multi-message thread'
+        if scored['urgency'] >= self.full_min_urgency:
+            return 'full', 'high urgency'
+        if scored['intent'] == 'Complaint' or scored['sentiment'] == 'Angry':
+            return 'full', 'complaint'
+        return 'small', 'routine'
+
+    def record(self, tier, reason, elapsed, tokens=0, cost=0.0):
+        with self._lock:
+            stats = self._stats[tier]
+            stats['requests'] += 1
+            stats['seconds'] += elapsed
+            stats['tokens'] += tokens
+            stats['cost_usd'] += cost
+            stats['latencies'].append(elapsed)
+            stats['reasons'][reason] = stats['reasons'].get(reason, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            total = sum(stats['requests'] for stats in self._stats.values())
+            tiers = {}
+            for tier, stats in self._stats.items():
+                latencies = sorted(stats['latencies'])
+                tiers[tier] = {
+                    'requests': stats['requests'],
+                    'share': round(stats['requests'] / total, 4) if total else 0.0,
+                    'avg_latency_ms': round(1000 * stats['seconds'] / stats['requests'], 2) if stats['requests'] else 0.0,
+                    'p50_latency_ms': round(1000 * latencies[len(latencies) // 2], 2) if latencies else 0.0,
+                    'p95_latency_ms': round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else 0.0,
+                    'tokens': stats['tokens'],
+                    'cost_usd': round(stats['cost_usd'], 6),
+                    'reasons': dict(stats['reasons']),
+                }
+        return {
+            'enabled': self.enabled,
+            'models': {'small': self.small_model, 'full': self.full_model},
+            'requests': total,
+            'tiers': tiers,
+        }
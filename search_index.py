@@ -0,0 +1,281 @@
+import re
+import html
+import logging
+import sqlalchemy as sa
+from sqlalchemy import event
+import body_store
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'email_search'
+
+# Highlight markers are control characters so stored email text can be HTML-escaped safely
+_START, _STOP = '\x02', '\x03'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def supported(bind):
+    return _dialect(bind) in ('sqlite', 'postgresql')
+
+
+def _terms(query):
+    """Lowercased query words; the last one also matches as a prefix, as in the FTS5 query."""
+    return [token.lower() for token in _TOKEN_RE.findall(query)]
+
+
+def _mark(text, terms):
+    """Wrap the words of text that match a term (or start with it) in highlight markers.
+
+    The index keeps no copy of the text, so snippets are built here from the stored body and
+    summary of each result; prefix matching also catches most stemmed forms.
+    """
+    def replace(match):
+        word = match.group(0)
+        return f'{_START}{word}{_STOP}' if _matched_term(word, terms) else word
+    return _TOKEN_RE.sub(replace, text)
+
+
+def _matched_term(word, terms):
+    lowered = word.lower()
+    return next((term for term in terms if lowered.startswith(term)), None)
+
+
+def _snippet(text, terms, words=16):
+    """About `words` words of text around the matches, highlighted, with '…' where cut.
+
+    The window starts at the match that has the most different terms within reach.
+    """
+    tokens = list(_TOKEN_RE.finditer(text))
+    if not tokens:
+        return ''
+    matches = [(index, term) for index, term in
+               ((index, _matched_term(token.group(0), terms)) for index, token in enumerate(tokens)) if term]
+    lead = words // 4  # Words of context before the first match
+    best, best_terms = 0, 0
+    for position, (index, _) in enumerate(matches):
+        covered = set()
+        for other, term in matches[position:]:
+            if other >= index + words - lead:
+                break
+            covered.add(term)
+        if len(covered) > best_terms:
+            best, best_terms = index, len(covered)
+    start = max(0, min(best - lead, len(tokens) - words))
+    end = min(len(tokens), start + words)
+    begin = tokens[start].start() if start else 0
+    finish = tokens[end - 1].end() if end < len(tokens) else len(text)
+    return ('…' if start else '') + _mark(text[begin:finish], terms) + ('…' if end < len(tokens) else '')
+
+
+def _render_highlight(text):
+    """HTML-escape indexed text and turn the highlight markers into <mark> tags."""
+    if not text:
+        return ''
+    return html.escape(text).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _is_current(conn):
+    """Whether an existing index already has the layout without a copy of the text."""
+    if _dialect(conn) == 'sqlite':
+        sql = conn.execute(sa.text("SELECT sql FROM sqlite_master WHERE name = :name"),
+                           {'name': SEARCH_TABLE}).scalar() or ''
+        return "content=''" in sql.replace(' ', '')
+    columns = {column['name'] for column in sa.inspect(conn).get_columns(SEARCH_TABLE)}
+    return 'email_content' not in columns
+
+
+def setup(db):
+    """Create the full-text index for the current backend and backfill it on first use.
+
+    The index holds only the search terms (a contentless FTS5 table or a tsvector); the text
+    itself stays in the deduplicated, compressed body table and the summaries.
+    """
+    engine = db.engine
+    if not supported(engine):
+        logger.warning(f"Full-text search is not available on {_dialect(engine)}")
+        return
+
+    created = not sa.inspect(engine).has_table(SEARCH_TABLE)
+    upgraded = False
+    with engine.begin() as conn:
+        if not created and not _is_current(conn):
+            if _dialect(engine) == 'sqlite':
+                # Indexes from before kept a full copy of every body; rebuilt below without it
+                conn.execute(sa.text(f"DROP TABLE {SEARCH_TABLE}"))
+                created = True
+            else:
+                conn.execute(sa.text(f"ALTER TABLE {SEARCH_TABLE} DROP COLUMN email_content,"
+                                     " DROP COLUMN summary, DROP COLUMN action_items"))
+            upgraded = True
+            logger.info("Removed the copy of the email text from the full-text index")
+        if _dialect(engine) == 'sqlite':
+            conn.execute(sa.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                " email_content, summary, action_items, content='', tokenize='porter unicode61')"
+            ))
+        else:
+            conn.execute(sa.text(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                " summary_id INTEGER PRIMARY KEY,"
+                " document tsvector NOT NULL)"
+            ))
+            conn.execute(sa.text(
+                f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+            ))
+    if created:
+        rebuild(db)
+    if upgraded:
+        body_store.vacuum(db)
+
+
+def _params(summary_id, email_content, summary, action_items):
+    return {
+        'id': summary_id,
+        'email_content': email_content or '',
+        'summary': summary or '',
+        'action_items': action_items or '',
+    }
+
+
+def _insert(conn, summary_id, email_content, summary, action_items):
+    params = _params(summary_id, email_content, summary, action_items)
+    if _dialect(conn) == 'sqlite':
+        conn.execute(sa.text(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, email_content, summary, action_items)"
+            " VALUES (:id, :email_content, :summary, :action_items)"
+        ), params)
+    else:
+        # Summary matches outrank action items, which outrank body matches
+        conn.execute(sa.text(
+            f"INSERT INTO {SEARCH_TABLE} (summary_id, document)"
+            " VALUES (:id,"
+            " setweight(to_tsvector('english', :summary), 'A') ||"
+            " setweight(to_tsvector('english', :action_items), 'B') ||"
+            " setweight(to_tsvector('english', :email_content), 'C'))"
+            " ON CONFLICT (summary_id) DO NOTHING"
+        ), params)
+
+
+def _delete(conn, summary_id, email_content, summary, action_items):
+    if _dialect(conn) == 'sqlite':
+        # A contentless table forgets a row through the 'delete' command with the values it indexed
+        conn.execute(sa.text(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, email_content, summary, action_items)"
+            " VALUES ('delete', :id, :email_content, :summary, :action_items)"
+        ), _params(summary_id, email_content, summary, action_items))
+    else:
+        conn.execute(sa.text(f"DELETE FROM {SEARCH_TABLE} WHERE summary_id = :id"), {'id': summary_id})
+
+
+def _delete_all(conn):
+    if _dialect(conn) == 'sqlite':
+        conn.execute(sa.text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('delete-all')"))
+    else:
+        conn.execute(sa.text(f"DELETE FROM {SEARCH_TABLE}"))
+
+
+def register(model):
+    """Keep the index in sync with EmailSummary inserts and deletes."""
+
+    @event.listens_for(model, 'after_insert')
+    def index_row(mapper, connection, target):
+        if supported(connection):
+            _insert(connection, target.id, target.email_content, target.summary, target.action_items)
+
+    @event.listens_for(model, 'after_delete')
+    def unindex_row(mapper, connection, target):
+        if supported(connection):
+            _delete(connection, target.id, target.email_content, target.summary, target.action_items)
+
+
+def clear(session):
+    """Empty the index (bulk deletes bypass the mapper events)."""
+    if supported(session.get_bind()):
+        _delete_all(session.connection())
+
+
+def rebuild(db, batch_size=1000):
+    """Re-index every stored summary in batches."""
+    from models import EmailSummary
+
+    with db.engine.begin() as conn:
+        _delete_all(conn)
+        last_id = 0
+        total = 0
+        while True:
+            rows = conn.execute(
+                body_store.join_bodies(sa.select(EmailSummary.id, EmailSummary.summary, EmailSummary.action_items))
+                .where(EmailSummary.id > last_id)
+                .order_by(EmailSummary.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                _insert(conn, row.id, body_store.row_content(row), row.summary, row.action_items)
+            last_id = rows[-1].id
+            total += len(rows)
+    logger.info(f"Indexed {total} summaries for full-text search")
+
+
+def _fts5_query(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    tokens = _TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*']
+    return ' '.join(terms)
+
+
+def search(session, query, limit=20, offset=0):
+    """Ranked full-text search; returns dicts with id, score and highlighted snippets."""
+    from models import EmailSummary
+
+    bind = session.get_bind()
+    if not supported(bind):
+        raise NotImplementedError(f"Full-text search is not available on {_dialect(bind)}")
+
+    if _dialect(bind) == 'sqlite':
+        match = _fts5_query(query)
+        if match is None:
+            return []
+        rows = session.execute(sa.text(
+            f"SELECT rowid AS id, bm25({SEARCH_TABLE}, 1.0, 4.0, 2.0) AS score"
+            f" FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"
+            " ORDER BY score LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset}).all()
+        # bm25() is lower-is-better; flip it so higher scores are better on both backends
+        scores = [(row.id, round(-row.score, 4)) for row in rows]
+    else:
+        rows = session.execute(sa.text(
+            "SELECT s.summary_id AS id, ts_rank_cd(s.document, q) AS score"
+            f" FROM {SEARCH_TABLE} s, websearch_to_tsquery('english', :query) q"
+            " WHERE s.document @@ q"
+            " ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        ), {'query': query, 'limit': limit, 'offset': offset}).all()
+        scores = [(row.id, round(float(row.score), 4)) for row in rows]
+    if not scores:
+        return []
+
+    # Snippets only for the page of results, from the stored bodies and summaries
+    texts = {row.id: row for row in session.execute(
+        body_store.join_bodies(sa.select(EmailSummary.id, EmailSummary.summary))
+        .where(EmailSummary.id.in_([summary_id for summary_id, _ in scores]))
+    )}
+    terms = _terms(query)
+    results = []
+    for summary_id, score in scores:
+        row = texts.get(summary_id)
+        if row is None:
+            continue
+        results.append({
+            'id': summary_id,
+            'score': score,
+            'snippet': _render_highlight(_snippet(body_store.row_content(row), terms)),
+            'summary': _render_highlight(_mark(row.summary or '', terms)),
+        })
+    return results
@@ -0,0 +1,256 @@
+import os
+import re
+import time
+import zlib
+import logging
+import threading
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import event
+from cache import normalize_body
+import body_store
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class HashingEmbedder:
+    """Hashed word and character n-gram vectors: CPU-only, no model download, stable across processes."""
+
+    name = 'hashing-v1'
+
+    def __init__(self, dim=1024, char_ngrams=(3, 4, 5), max_chars=8000):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.max_chars = max_chars
+
+    def _features(self, text):
+        text = normalize_body(text)[:self.max_chars].lower()
+        words = _WORD_RE.findall(text)
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        joined = ' '.join(words)
+        for n in self.char_ngrams:
+            features += [joined[i:i + n] for i in range(0, max(len(joined) - n + 1, 0))]
+        return features
+
+    def embed_batch(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            # crc32 is stable across processes, unlike hash()
+            hashes = np.fromiter((zlib.crc32(f.encode('utf-8', errors='ignore')) for f in features),
+                                 dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dim, signs)
+        # Sublinear term frequency, then L2-normalize so dot product is cosine similarity
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model (optional dependency), run on CPU."""
+
+    def __init__(self, model_name='all-MiniLM-L6-v2'):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.name = f'st:{model_name}'
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed_batch(self, texts):
+        return self.model.encode(list(texts), batch_size=32, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+def embedder_from_env():
+    kind = os.getenv('EMBEDDER', 'hashing')
+    if kind == 'sentence-transformers':
+        try:
+            return SentenceTransformerEmbedder(os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'))
+        except ImportError:
+            logger.warning("sentence-transformers is not installed; using the hashing embedder")
+    return HashingEmbedder(dim=int(os.getenv('EMBEDDING_DIM', 1024)))
+
+
+class VectorIndex:
+    """In-memory matrix of EmailSummary embeddings with batched cosine top-k search.
+
+    Vectors are persisted in the EmailEmbedding table; each process loads them lazily and
+    catches up on rows written by other workers at most every refresh_interval seconds, or
+    on the next query after one of its own inserts. The matrix grows by doubling its
+    capacity, so catching up copies only the new rows.
+    """
+
+    def __init__(self, embedder, block_size=65536, refresh_interval=2.0):
+        self.embedder = embedder
+        self.block_size = block_size
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._clear()
+
+    def __len__(self):
+        return self._size
+
+    def embed(self, texts):
+        return self.embedder.embed_batch(texts)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._size = 0
+        self._last_id = 0
+        self._checked_at = float('-inf')
+        self._stale = True
+
+    def mark_stale(self):
+        """Make the next refresh() query the table (called after a local insert)."""
+        self._stale = True
+
+    def _snapshot(self):
+        """(ids, matrix) views of the loaded rows; appends never touch rows already loaded."""
+        with self._lock:
+            return self._ids[:self._size], self._matrix[:self._size]
+
+    def _append(self, ids, vectors):
+        needed = self._size + len(ids)
+        if needed > len(self._ids):
+            capacity = max(needed, 2 * len(self._ids), 1024)
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_matrix = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+            grown_ids[:self._size] = self._ids[:self._size]
+            grown_matrix[:self._size] = self._matrix[:self._size]
+            self._ids, self._matrix = grown_ids, grown_matrix
+        self._ids[self._size:needed] = ids
+        self._matrix[self._size:needed] = vectors
+        self._size = needed
+        self._last_id = max(self._last_id, int(max(ids)))
+
+    def refresh(self, session, batch_size=5000, force=False):
+        """Load embeddings stored since the last refresh (including other workers' inserts)."""
+        from models import EmailEmbedding
+
+        with self._lock:
+            now = time.monotonic()
+            due = force or now - self._checked_at >= self.refresh_interval
+            if not (due or self._stale):
+                return
+            self._stale = False
+            if due:
+                # Rows disappear (and ids can be reused) when the history is cleared; start over then
+                stored, newest = session.execute(
+                    sa.select(sa.func.count(), sa.func.max(EmailEmbedding.summary_id))
+                    .where(EmailEmbedding.embedder == self.embedder.name)
+                ).one()
+                if stored < self._size or (newest or 0) < self._last_id:
+                    self._clear()
+                    self._stale = False
+                self._checked_at = now
+            while True:
+                rows = session.execute(
+                    sa.select(EmailEmbedding.summary_id, EmailEmbedding.vector)
+                    .where(EmailEmbedding.summary_id > self._last_id,
+                           EmailEmbedding.embedder == self.embedder.name)
+                    .order_by(EmailEmbedding.summary_id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    return
+                vectors = np.frombuffer(b''.join(row.vector for row in rows), dtype=np.float32)
+                self._append([row.summary_id for row in rows], vectors.reshape(len(rows), self.embedder.dim))
+
+    def vector_for(self, summary_id):
+        ids, matrix = self._snapshot()
+        positions = np.nonzero(ids == summary_id)[0]
+        return matrix[positions[0]] if len(positions) else None
+
+    def search(self, queries, k=5, exclude_ids=()):
+        """Top-k cosine matches for a (n, dim) batch of query vectors.
+
+        Returns one list of (summary_id, score) per query, best first.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        ids, matrix = self._snapshot()
+        if len(ids) == 0:
+            return [[] for _ in range(len(queries))]
+
+        fetch = min(k + len(exclude_ids), len(ids))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_positions = np.zeros((len(queries), 0), dtype=np.int64)
+        # Score the matrix block by block so memory stays bounded on large indexes
+        for start in range(0, len(ids), self.block_size):
+            scores = queries @ matrix[start:start + self.block_size].T
+            take = min(fetch, scores.shape[1])
+            top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            best_scores = np.hstack([best_scores, np.take_along_axis(scores, top, axis=1)])
+            best_positions = np.hstack([best_positions, top + start])
+
+        excluded = set(exclude_ids)
+        results = []
+        for row in range(len(queries)):
+            order = np.argsort(-best_scores[row])
+            matches = []
+            for position in order:
+                summary_id = int(ids[best_positions[row, position]])
+                if summary_id in excluded:
+                    continue
+                matches.append((summary_id, float(best_scores[row, position])))
+                if len(matches) == k:
+                    break
+            results.append(matches)
+        return results
+
+
+def register(model, index):
+    """Embed and store every new EmailSummary as part of its insert."""
+    from models import EmailEmbedding
+
+    @event.listens_for(model, 'after_insert')
+    def embed_row(mapper, connection, target):
+        vector = index.embed([target.email_content or ''])[0]
+        connection.execute(sa.insert(EmailEmbedding.__table__).values(
+            summary_id=target.id,
+            embedder=index.embedder.name,
+            vector=vector.astype(np.float32).tobytes(),
+        ))
+        index.mark_stale()
+
+
+def backfill(db, index, batch_size=500):
+    """Embed stored summaries that have no vector for the current embedder yet."""
+    from models import EmailSummary, EmailEmbedding
+
+    total = 0
+    with db.engine.begin() as conn:
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                body_store.join_bodies(sa.select(EmailSummary.id))
+                .outerjoin(EmailEmbedding, sa.and_(EmailEmbedding.summary_id == EmailSummary.id,
+                                                   EmailEmbedding.embedder == index.embedder.name))
+                .where(EmailSummary.id > last_id, EmailEmbedding.summary_id.is_(None))
+                .order_by(EmailSummary.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            vectors = index.embed([body_store.row_content(row) for row in rows])
+            # Vectors from a previous embedder are replaced
+            conn.execute(sa.delete(EmailEmbedding.__table__)
+                         .where(EmailEmbedding.summary_id.in_([row.id for row in rows])))
+            conn.execute(sa.insert(EmailEmbedding.__table__), [
+                {'summary_id': row.id, 'embedder': index.embedder.name, 'vector': vector.tobytes()}
+                for row, vector in zip(rows, vectors.astype(np.float32))
+            ])
+            last_id = rows[-1].id
+            total += len(rows)
+    if total:
+        logger.info(f"Embedded {total} stored summaries for similarity search")
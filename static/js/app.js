@@ -174,29 +174,51 @@ class EmailWise {
         history.scrollTop = history.scrollHeight;
 
         try {
-            const emailText = document.getElementById('emailContent').value;
-            const response = await fetch('/api/chat', {
+            // Saved analyses are discussed in a server-side session; the email is not re-sent
+            const payload = this.currentSummaryId
+                ? { summary_id: this.currentSummaryId, session_id: this.chatSessionId, query: query }
+                : { email_content: document.getElementById('emailContent').value, query: query };
+            const response = await fetch('/api/chat?stream=1', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    email_content: emailText,
-                    query: query
-                })
+                body: JSON.stringify(payload)
             });
 
-            const result = await response.json();
-
-            // Remove loading
-            loadingDiv.remove();
-
-            // Show Answer
-            const answer = result.success ? result.answer : "Sorry, I couldn't get an answer right now.";
-
             const aiDiv = document.createElement('div');
             aiDiv.className = 'd-flex justify-content-start mb-3';
-            aiDiv.innerHTML = `<div class="glass-card p-2 px-3 rounded-3 small text-white border-0">${this.escapeHtml(answer)}</div>`;
-            history.appendChild(aiDiv);
-            history.scrollTop = history.scrollHeight;
+            const bubble = document.createElement('div');
+            bubble.className = 'glass-card p-2 px-3 rounded-3 small text-white border-0';
+            aiDiv.appendChild(bubble);
+
+            if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                const result = await response.json();
+                loadingDiv.remove();
+                if (result.session_id) this.chatSessionId = result.session_id;
+                bubble.textContent = result.success ? result.answer : "Sorry, I couldn't get an answer right now.";
+                history.appendChild(aiDiv);
+                history.scrollTop = history.scrollHeight;
+                return;
+            }
+
+            // Swap the loading placeholder for the answer on the first token
+            let answer = '';
+            await this.readEventStream(response, (event, payload) => {
+                if (event === 'done' && payload.session_id) this.chatSessionId = payload.session_id;
+                if (event !== 'token') return;
+                if (!answer) {
+                    loadingDiv.remove();
+                    history.appendChild(aiDiv);
+                }
+                answer += payload.text;
+                bubble.textContent = answer;
+                history.scrollTop = history.scrollHeight;
+            });
+
+            if (!answer) {
+                loadingDiv.remove();
+                bubble.textContent = "Sorry, I couldn't get an answer right now.";
+                history.appendChild(aiDiv);
+            }
 
         } catch (error) {
             if (document.getElementById('chatLoading')) document.getElementById('chatLoading').remove();
@@ -309,21 +331,34 @@ class EmailWise {
                 });
             }
 
-            const response = await fetch('/api/analyze', {
+            const response = await fetch('/api/analyze?stream=1', {
                 method: 'POST',
                 // Do NOT set Content-Type header when sending FormData
                 body: formData
             });
 
-            const result = await response.json();
-
-            if (result.success) {
-                this.currentSummaryId = result.id; // Store ID for actions
-                this.displayResults(result.data, result.method);
-                this.loadHistory(); // Refresh history after successful analysis
-            } else {
+            // Validation errors still come back as plain JSON
+            if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                const result = await response.json();
                 this.showError(result.error || 'Failed to analyze email. Please try again.');
+                return;
             }
+
+            const partial = {};
+            await this.readEventStream(response, (event, payload) => {
+                if (event === 'field') {
+                    // Render each section as soon as the model finishes it
+                    partial[payload.name] = payload.value;
+                    this.displayPartialResult(payload.name, payload.value, partial);
+                } else if (event === 'done') {
+                    this.currentSummaryId = payload.id; // Store ID for actions
+                    this.chatSessionId = null; // Chat about the new email starts a new session
+                    this.displayResults(payload.data);
+                    this.loadHistory(); // Refresh history after successful analysis
+                } else if (event === 'error') {
+                    this.showError(payload.error || 'Failed to analyze email. Please try again.');
+                }
+            });
         } catch (error) {
             console.error('Analysis error:', error);
             this.showError('Network error. Please check your connection and try again.');
@@ -332,6 +367,73 @@ class EmailWise {
         }
     }
 
+    async readEventStream(response, onEvent) {
+        // Minimal Server-Sent Events parser over a fetch() body stream
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
+    asList(value) {
+        if (!value) return [];
+        return Array.isArray(value) ? value : [String(value)];
+    }
+
+    displayPartialResult(name, value, partial) {
+        if (this.resultsSection.classList.contains('d-none')) {
+            this.resultsSection.classList.remove('d-none');
+            this.resultsSection.classList.add('fade-in-up');
+        }
+
+        switch (name) {
+            case 'summary':
+                this.displaySection(this.summaryContent, this.asList(value), 'No key points found.', 'fas fa-angle-right');
+                break;
+            case 'action_items':
+                this.displaySection(this.actionItemsContent, this.asList(value), 'No action items identified.', 'far fa-square');
+                break;
+            case 'deadlines':
+                this.displaySection(this.deadlinesContent, this.asList(value), 'No dates found.', 'far fa-clock');
+                break;
+            case 'intent':
+                this.updateText('intentBadge', value || 'General');
+                break;
+            case 'urgency_score':
+                this.updateUrgency(value);
+                break;
+            case 'sentiment':
+                this.updateSentiment(value);
+                break;
+            case 'suggested_replies':
+                this.updateReply({ suggested_replies: value });
+                break;
+            case 'spam_analysis':
+            case 'decision_helper':
+                this.updateIntelligence({ ...partial, risk_assessment: partial.decision_helper });
+                break;
+        }
+    }
+
     async handleQuickAction(action, button) {
         if (!this.currentSummaryId) {
             alert('No active email analysis found.');
@@ -381,9 +483,9 @@ class EmailWise {
 
     displayResults(data, method) {
         // Display results
-        this.displaySection(this.summaryContent, data.summary, 'No key points found.', 'fas fa-angle-right');
-        this.displaySection(this.actionItemsContent, data.action_items, 'No action items identified.', 'far fa-square');
-        this.displaySection(this.deadlinesContent, data.deadlines, 'No dates found.', 'far fa-clock');
+        this.displaySection(this.summaryContent, this.asList(data.summary), 'No key points found.', 'fas fa-angle-right');
+        this.displaySection(this.actionItemsContent, this.asList(data.action_items), 'No action items identified.', 'far fa-square');
+        this.displaySection(this.deadlinesContent, this.asList(data.deadlines), 'No dates found.', 'far fa-clock');
 
         // Intelligence Pipeline
         this.updateIntelligence(data);
@@ -493,11 +595,14 @@ class EmailWise {
             const label1 = document.getElementById('reply-1-tab');
             const label2 = document.getElementById('reply-2-tab');
 
-            if (reply1) reply1.innerText = data.suggested_replies.option_1 || 'No draft generated.';
-            if (reply2) reply2.innerText = data.suggested_replies.option_2 || 'No draft generated.';
+            const option1 = data.suggested_replies.option_1;
+            const option2 = data.suggested_replies.option_2;
+
+            if (reply1) reply1.innerText = (option1 && option1.text !== undefined ? option1.text : option1) || 'No draft generated.';
+            if (reply2) reply2.innerText = (option2 && option2.text !== undefined ? option2.text : option2) || 'No draft generated.';
 
-            if (label1) label1.innerText = data.suggested_replies.option_1_label || 'Option 1';
-            if (label2) label2.innerText = data.suggested_replies.option_2_label || 'Option 2';
+            if (label1) label1.innerText = (option1 && option1.label) || data.suggested_replies.option_1_label || 'Option 1';
+            if (label2) label2.innerText = (option2 && option2.label) || data.suggested_replies.option_2_label || 'Option 2';
 
             return;
         }
@@ -0,0 +1,86 @@
+import json
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JsonFieldStreamer:
+    """Incrementally parse a streamed JSON object.
+
+    feed() returns the top-level (key, value) pairs whose values became complete
+    with the new text, so callers can forward each field as soon as the model
+    finishes writing it instead of waiting for the whole object.
+    """
+
+    _WHITESPACE = ' \t\r\n'
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._opened = False
+        self._decoder = json.JSONDecoder()
+        self.closed = False
+
+    def _skip_whitespace(self, pos):
+        buffer = self._buffer
+        while pos < len(buffer) and buffer[pos] in self._WHITESPACE:
+            pos += 1
+        return pos
+
+    def feed(self, text):
+        self._buffer += text
+        fields = []
+        while not self.closed:
+            field = self._next_field()
+            if field is None:
+                break
+            fields.append(field)
+        return fields
+
+    def _next_field(self):
+        buffer = self._buffer
+        pos = self._skip_whitespace(self._pos)
+
+        if not self._opened:
+            if pos >= len(buffer):
+                return None
+            if buffer[pos] != '{':
+                raise ValueError('Streamed JSON does not start with an object')
+            self._opened = True
+            pos = self._skip_whitespace(pos + 1)
+
+        if pos < len(buffer) and buffer[pos] == ',':
+            pos = self._skip_whitespace(pos + 1)
+        self._pos = pos
+        if pos >= len(buffer):
+            return None
+        if buffer[pos] == '}':
+            self.closed = True
+            return None
+
+        try:
+            key, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return None
+        end = self._skip_whitespace(end)
+        if end >= len(buffer):
+            return None
+        if buffer[end] != ':':
+            raise ValueError('Malformed streamed JSON object')
+
+        value_start = self._skip_whitespace(end + 1)
+        if value_start >= len(buffer):
+            return None
+        try:
+            value, value_end = self._decoder.raw_decode(buffer, value_start)
+        except json.JSONDecodeError:
+            return None
+
+        # Numbers and literals may still be growing until a delimiter arrives
+        if self._skip_whitespace(value_end) >= len(buffer):
+            return None
+
+        self._pos = value_end
+        return key, value
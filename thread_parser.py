@@ -0,0 +1,132 @@
+import re
+import hashlib
+
+# Lines that start a new (older) message inside a pasted reply chain
+_QUOTE = r'(?:[ \t]*>[ \t]?)*'
+_BOUNDARY_PATTERNS = [
+    r'On .{1,200}wrote:\s*$',                                            # Gmail / Apple Mail reply header
+    r'-{2,}\s*Original Message\s*-{2,}\s*$',                             # Outlook
+    r'-{2,}\s*Forwarded message\s*-{2,}\s*$',                            # Gmail forward
+    r'Begin forwarded message:\s*$',                                     # Apple Mail forward
+    r'_{10,}\s*$',                                                       # Outlook separator line
+    rf'From: .+\n(?:{_QUOTE}(?:Sent|Date|To|Cc|Subject): .*\n){{1,4}}',   # Inline forwarded headers
+    r'--- Attachment: .+ ---\s*$',                                       # Added by EmailAnalyzer.process_attachments
+]
+# Boundaries are recognised at any quoting depth ("> On ... wrote:")
+BOUNDARY_RE = re.compile(
+    rf'^{_QUOTE}(?:' + '|'.join(f'(?:{p})' for p in _BOUNDARY_PATTERNS) + ')',
+    re.MULTILINE | re.IGNORECASE
+)
+
+_QUOTE_PREFIX_RE = re.compile(r'^(?:\s*>)+ ?', re.MULTILINE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class ThreadMessage:
+    """One message of a pasted thread: the boundary line(s) that introduced it and its text."""
+
+    __slots__ = ('header', 'text')
+
+    def __init__(self, header, text):
+        self.header = header
+        self.text = text
+
+    @property
+    def content(self):
+        return f"{self.header}\n{self.text}" if self.header else self.text
+
+    @property
+    def fingerprint(self):
+        """Stable hash of the message body, ignoring quoting and whitespace differences."""
+        normalized = _WHITESPACE_RE.sub(' ', self.text).strip().lower()
+        return hashlib.sha256(normalized.encode('utf-8', errors='ignore')).hexdigest()
+
+    def __repr__(self):
+        return f'<ThreadMessage {len(self.text)} chars>'
+
+
+def split_messages(content):
+    """Split a pasted thread into messages at reply/forward/attachment boundaries.
+
+    Messages are returned in document order, i.e. newest first for a typical
+    reply chain. '>' quoting is stripped so a message hashes the same whether
+    it appears on its own or quoted in a later reply.
+    """
+    messages = []
+    start = 0
+    header = ''
+    for match in BOUNDARY_RE.finditer(content):
+        body = content[start:match.start()]
+        if body.strip() or header:
+            messages.append(ThreadMessage(header, _QUOTE_PREFIX_RE.sub('', body).strip()))
+        header = match.group(0).strip()
+        start = match.end()
+
+    body = content[start:]
+    if body.strip() or header:
+        messages.append(ThreadMessage(header, _QUOTE_PREFIX_RE.sub('', body).strip()))
+    return [message for message in messages if message.text or message.header]
+
+
+def _split_oversized(text, max_chars):
+    """Split one oversized message at paragraph, then line, then hard boundaries."""
+    pieces = []
+    current = ''
+    for paragraph in re.split(r'(\n\s*\n)', text):
+        if len(current) + len(paragraph) <= max_chars:
+            current += paragraph
+            continue
+        if current.strip():
+            pieces.append(current)
+        current = ''
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind('\n', 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:]
+        current = paragraph
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def chunk_messages(messages, max_chars=12000):
+    """Group consecutive messages into chunks of at most max_chars characters.
+
+    Packing starts from the oldest (last) message, so when a new reply is added on
+    top of a thread only the first chunk changes and cached chunk summaries stay valid.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for message in reversed(messages):
+        content = message.content
+        if len(content) > max_chars:
+            if current:
+                chunks.append('\n\n'.join(reversed(current)))
+                current, size = [], 0
+            chunks.extend(reversed(_split_oversized(content, max_chars)))
+            continue
+        if current and size + len(content) + 2 > max_chars:
+            chunks.append('\n\n'.join(reversed(current)))
+            current, size = [], 0
+        current.append(content)
+        size += len(content) + 2
+    if current:
+        chunks.append('\n\n'.join(reversed(current)))
+    chunks.reverse()
+    return chunks
+
+
+def chain_hashes(messages):
+    """Cumulative hashes of a thread, oldest message first.
+
+    Element k identifies the thread made of the k+1 oldest messages, so a later
+    paste of the same thread with more replies shares every earlier element.
+    """
+    hashes = []
+    previous = ''
+    for message in reversed(messages):
+        previous = hashlib.sha256(f"{previous}:{message.fingerprint}".encode()).hexdigest()
+        hashes.append(previous)
+    return hashes